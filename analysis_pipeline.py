@@ -0,0 +1,325 @@
+import time
+import queue
+import threading
+import traceback
+
+import pandas as pd
+
+from analyzer_metrics import ProgressReporter
+from result_store import open_result_writer
+
+# Marks the end of the stream on a stage queue
+_END = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Raised inside a stage when another stage has failed and the pipeline is shutting down
+    """
+
+
+class StageStats:
+    """
+    Throughput counters for one pipeline stage
+    """
+
+    def __init__(self, name, input_queue=None):
+        """
+        Initialize the stage counters
+
+        Args:
+            name: Name of the stage
+            input_queue: Queue the stage reads from, used to report queue depth
+        """
+        self.name = name
+        self.input_queue = input_queue
+        self.items = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, rows, seconds):
+        """
+        Record one processed item
+
+        Args:
+            rows: Number of log rows in the item
+            seconds: Time spent processing it
+        """
+        with self._lock:
+            self.items += 1
+            self.rows += rows
+            self.busy_seconds += seconds
+            if self.input_queue is not None:
+                self.max_queue_depth = max(self.max_queue_depth, self.input_queue.qsize())
+
+    def snapshot(self, elapsed):
+        """
+        Get the stage counters
+
+        Args:
+            elapsed: Seconds since the pipeline started
+
+        Returns:
+            Dictionary with items, rows, busy time, throughput and queue depth
+        """
+        with self._lock:
+            return {
+                'items': self.items,
+                'rows': self.rows,
+                'busy_seconds': self.busy_seconds,
+                'rows_per_second': self.rows / elapsed if elapsed > 0 else 0.0,
+                'busy_rows_per_second': self.rows / self.busy_seconds if self.busy_seconds > 0 else 0.0,
+                'queue_depth': self.input_queue.qsize() if self.input_queue is not None else 0,
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+
+class AnalysisPipeline:
+    """
+    Analyze a CSV file in concurrent stages connected by bounded queues
+
+    The stages are a CSV reader, a pool of tokenizer threads (keyword
+    heuristics, cache lookups and tokenization), a model inference stage, and
+    one sink per output (JSON Lines or columnar file, database). Tokenization and database
+    I/O overlap with the forward passes. Every queue is bounded, so a slow
+    sink blocks the stages in front of it instead of buffering unbounded data.
+    """
+
+    def __init__(self, analyzer, chunk_size=1000, tokenizer_threads=2, queue_size=4,
+                 output_path=None, save_db=False, output_format='jsonl'):
+        """
+        Initialize the pipeline
+
+        Args:
+            analyzer: LogAnalyzerTool used for predictions and database writes
+            chunk_size: Number of CSV rows per item flowing through the pipeline
+            tokenizer_threads: Number of threads preparing chunks for inference
+            queue_size: Maximum number of chunks waiting between two stages
+            output_path: Path to save results to (optional)
+            save_db: Whether to save results to the database
+            output_format: 'jsonl' for a JSON Lines file or 'columnar' for a
+                           memory-mapped columnar store directory
+        """
+        self.analyzer = analyzer
+        self.chunk_size = chunk_size
+        self.tokenizer_threads = max(1, int(tokenizer_threads))
+        self.output_path = output_path
+        self.output_format = output_format
+        self.save_db = save_db
+
+        self.read_queue = queue.Queue(maxsize=queue_size)
+        self.inference_queue = queue.Queue(maxsize=queue_size)
+        self.sink_queues = {}
+        if output_path:
+            self.sink_queues['json'] = queue.Queue(maxsize=queue_size)
+        if save_db:
+            self.sink_queues['database'] = queue.Queue(maxsize=queue_size)
+
+        self.stages = {
+            'read': StageStats('read'),
+            'tokenize': StageStats('tokenize', self.read_queue),
+            'inference': StageStats('inference', self.inference_queue),
+        }
+        for name, sink_queue in self.sink_queues.items():
+            self.stages[name] = StageStats(name, sink_queue)
+
+        self.summary = {'rows': 0, 'anomalies': 0, 'db_inserted': 0}
+        self._stop = threading.Event()
+        self._errors = []
+        self._start_time = None
+        self._progress = ProgressReporter()
+
+    def run(self, csv_file_path):
+        """
+        Run the pipeline over a CSV file and wait for it to finish
+
+        Args:
+            csv_file_path: Path to the CSV file containing logs
+
+        Returns:
+            Dictionary with rows processed, anomalies detected, records inserted
+            into the database, elapsed time and per-stage statistics
+        """
+        print(f'Running analysis pipeline on {csv_file_path} '
+              f'(chunk size: {self.chunk_size}, tokenizer threads: {self.tokenizer_threads})')
+        self._start_time = time.perf_counter()
+
+        # Load the model up front so the tokenizer threads don't race to do it, and
+        # start any inference workers before this process has other threads to fork
+        if self.analyzer._ensure_model_loaded() and self.analyzer.workers > 1:
+            self.analyzer._get_worker_pool(fork=True)
+
+        threads = [threading.Thread(target=self._run_stage, args=(self._read, csv_file_path), name='read')]
+        for i in range(self.tokenizer_threads):
+            threads.append(threading.Thread(target=self._run_stage, args=(self._tokenize,), name=f'tokenize-{i}'))
+        threads.append(threading.Thread(target=self._run_stage, args=(self._infer,), name='inference'))
+        for name, sink_queue in self.sink_queues.items():
+            threads.append(threading.Thread(target=self._run_stage, args=(self._sink, name, sink_queue), name=name))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        self._progress.finish()
+        summary = dict(self.summary)
+        summary['elapsed_seconds'] = time.perf_counter() - self._start_time
+        summary['stages'] = self.stats()
+        print(f'Pipeline complete: {summary["rows"]} log entries in {summary["elapsed_seconds"]:.2f}s')
+        return summary
+
+    def stats(self):
+        """
+        Get per-stage throughput and queue depth; safe to call while the pipeline runs
+
+        Returns:
+            Dictionary mapping stage names to their statistics
+        """
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        return {name: stage.snapshot(elapsed) for name, stage in self.stages.items()}
+
+    def _run_stage(self, target, *args):
+        """
+        Run a stage function, stopping the whole pipeline if it fails
+        """
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            print(f'Error in pipeline stage {threading.current_thread().name}: {str(e)}')
+            traceback.print_exc()
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, target_queue, item):
+        """
+        Put an item on a queue, blocking while it is full (backpressure)
+        """
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                target_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source_queue):
+        """
+        Take an item from a queue, blocking while it is empty
+        """
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _read(self, csv_file_path):
+        """
+        Reader stage: read the CSV in chunks
+        """
+        reader = pd.read_csv(csv_file_path, chunksize=self.chunk_size)
+        sequence = 0
+        while True:
+            start = time.perf_counter()
+            chunk = next(reader, None)
+            if chunk is None:
+                break
+            if 'log' not in chunk.columns:
+                raise ValueError('CSV file must contain a "log" column')
+            self.stages['read'].record(len(chunk), time.perf_counter() - start)
+            self._put(self.read_queue, (sequence, chunk))
+            sequence += 1
+
+        # One end marker per tokenizer thread
+        for _ in range(self.tokenizer_threads):
+            self._put(self.read_queue, _END)
+
+    def _tokenize(self):
+        """
+        Tokenizer stage: run heuristics, cache lookups and tokenization for each chunk
+        """
+        while True:
+            item = self._get(self.read_queue)
+            if item is _END:
+                self._put(self.inference_queue, _END)
+                return
+
+            sequence, chunk = item
+            start = time.perf_counter()
+            if self.analyzer.incremental:
+                chunk = self.analyzer._filter_new_rows(chunk)
+            prepared = self.analyzer.prepare_batch(chunk['log'].tolist())
+            self.stages['tokenize'].record(len(chunk), time.perf_counter() - start)
+            self._put(self.inference_queue, (sequence, chunk, prepared))
+
+    def _infer(self):
+        """
+        Inference stage: run the forward passes, restoring the input order of the chunks
+        """
+        waiting = {}
+        next_sequence = 0
+        finished_tokenizers = 0
+
+        while finished_tokenizers < self.tokenizer_threads or waiting:
+            if next_sequence not in waiting:
+                item = self._get(self.inference_queue)
+                if item is _END:
+                    finished_tokenizers += 1
+                    continue
+                waiting[item[0]] = item
+                continue
+
+            _, chunk, prepared = waiting.pop(next_sequence)
+            next_sequence += 1
+
+            start = time.perf_counter()
+            predictions = self.analyzer.finish_batch(prepared)
+            results = self.analyzer._attach_predictions(chunk, predictions)
+            self.stages['inference'].record(len(results), time.perf_counter() - start)
+
+            anomalies = int((results['status'] == 'anomaly').sum())
+            self.summary['rows'] += len(results)
+            self.summary['anomalies'] += anomalies
+            self._progress.update(len(results), anomalies)
+
+            for sink_queue in self.sink_queues.values():
+                self._put(sink_queue, results)
+
+        for sink_queue in self.sink_queues.values():
+            self._put(sink_queue, _END)
+
+    def _sink(self, name, sink_queue):
+        """
+        Sink stage: write results to the output file or the database
+        """
+        writer = open_result_writer(self.output_path, self.output_format) if name == 'json' else None
+        try:
+            while True:
+                results = self._get(sink_queue)
+                if results is _END:
+                    break
+
+                start = time.perf_counter()
+                if writer:
+                    with self.analyzer.metrics.timer('output_write_seconds', {'format': self.output_format}):
+                        writer.write(results)
+                    self.analyzer.metrics.increment('output_rows_total', len(results), {'format': self.output_format})
+                else:
+                    self.summary['db_inserted'] += self.analyzer.save_to_database(results)
+                self.stages[name].record(len(results), time.perf_counter() - start)
+        finally:
+            if writer:
+                writer.close()
+
+        if name == 'json':
+            print(f'Results saved to {self.output_path}')
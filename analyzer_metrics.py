@@ -0,0 +1,337 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Help text for the metrics recorded by the analyzer, shown by the Prometheus exporter
+METRIC_HELP = {
+    'predictions_total': 'Log entries classified, by the method that decided them',
+    'prediction_batch_seconds': 'Time to classify one predict_batch call, excluding queueing between pipeline stages',
+    'heuristic_seconds': 'Time spent in the keyword heuristic per prediction batch',
+    'cache_lookup_seconds': 'Time spent looking up templates in the prediction cache per prediction batch',
+    'cache_hits_total': 'Log entries whose prediction was found in the prediction cache',
+    'cache_misses_total': 'Log entries whose prediction was not in the prediction cache',
+    'tokenize_seconds': 'Time spent tokenizing per prediction batch',
+    'windowed_logs_total': 'Logs longer than the max length that were split into overlapping windows',
+    'log_windows_total': 'Windows classified for logs longer than the max length',
+    'template_mining_seconds': 'Time spent assigning log lines to Drain templates per prediction batch',
+    'template_lines_total': 'Log lines assigned to mined templates',
+    'template_classifications_total': 'Template representatives sent for classification',
+    'sequence_seconds': 'Time spent in the per-device sequence detector per batch of results',
+    'sequence_flags_total': 'Lines given a sequence flag, by kind of flag',
+    'cascade_seconds': 'Time spent in the cascade keyword and linear stages per prediction batch',
+    'forward_seconds': 'Time spent in model forward passes per prediction batch',
+    'forward_batch_seconds': 'Time of a single model forward pass, including those run by inference workers',
+    'output_write_seconds': 'Time spent writing results to an output file, by format',
+    'output_rows_total': 'Results written to output files, by format',
+    'db_insert_seconds': 'Time spent loading results into the database',
+    'db_rows_total': 'Results inserted or upserted into the database',
+    'db_sink_queued_rows_total': 'Results handed to the background database sink',
+    'db_sink_put_wait_seconds': 'Time a caller waited for room in the database sink queue',
+    'db_sink_retries_total': 'Database writes retried after the database could not be reached',
+    'db_sink_spooled_rows_total': 'Results written to the on-disk spool while the database was unavailable',
+    'db_sink_replayed_rows_total': 'Spooled results replayed into the database',
+    'db_sink_rejected_rows_total': 'Results the database refused, saved to the rejected spool directory',
+    'http_requests_total': 'HTTP requests served, by path and status code',
+    'http_request_seconds': 'Time from reading an HTTP request to sending its response',
+}
+
+
+def _series_key(labels):
+    """
+    Turn a label dictionary into a hashable, sorted key
+    """
+    if not labels:
+        return ()
+    return tuple(sorted((str(name), str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    """
+    Format a series key as Prometheus labels, e.g. '{method="model"}'
+    """
+    pairs = list(key) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and latency histograms for the analysis hot paths
+
+    Counters only go up; histograms count observations into fixed buckets and
+    keep their sum and maximum. Both can carry labels (e.g. the prediction
+    method or the output format). snapshot() returns plain dictionaries for
+    JSON, and to_prometheus() renders the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize an empty registry
+
+        Args:
+            buckets: Sorted upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1, labels=None):
+        """
+        Add to a counter
+
+        Args:
+            name: Counter name, ending in '_total' by convention
+            value: Amount to add
+            labels: Dictionary of label names and values (optional)
+        """
+        key = _series_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """
+        Record one observation in a histogram
+
+        Args:
+            name: Histogram name
+            value: Observed value, usually seconds
+            labels: Dictionary of label names and values (optional)
+        """
+        key = _series_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {'counts': [0] * (len(self.buckets) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            histogram['counts'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        """
+        Time a block of code into a histogram
+
+        Args:
+            name: Histogram name
+            labels: Dictionary of label names and values (optional)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def reset(self):
+        """
+        Drop every recorded value
+        """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self.start_time = time.time()
+
+    def snapshot(self):
+        """
+        Get the current values
+
+        Returns:
+            Dictionary with 'counters' and 'histograms', each mapping a metric name
+            to its series keyed by Prometheus-style label text ('' without labels).
+            Histogram series hold count, sum, mean, max and cumulative bucket counts.
+        """
+        with self._lock:
+            counters = {
+                name: {_format_labels(key): value for key, value in series.items()}
+                for name, series in self._counters.items()
+            }
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = {}
+                for key, histogram in series.items():
+                    cumulative, buckets = 0, {}
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram['counts']):
+                        cumulative += count
+                        buckets[_format_number(bound)] = cumulative
+                    histograms[name][_format_labels(key)] = {
+                        'count': histogram['count'],
+                        'sum': histogram['sum'],
+                        'mean': histogram['sum'] / histogram['count'] if histogram['count'] else 0.0,
+                        'max': histogram['max'],
+                        'buckets': buckets,
+                    }
+        return {'uptime_seconds': time.time() - self.start_time, 'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self, prefix='log_analyzer_'):
+        """
+        Render the metrics in the Prometheus text exposition format (version 0.0.4)
+
+        Args:
+            prefix: Prefix added to every metric name
+
+        Returns:
+            The exposition text
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full_name = prefix + name
+                lines.append(f'# HELP {full_name} {METRIC_HELP.get(name, name)}')
+                lines.append(f'# TYPE {full_name} counter')
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f'{full_name}{_format_labels(key)} {_format_number(value)}')
+
+            for name in sorted(self._histograms):
+                full_name = prefix + name
+                lines.append(f'# HELP {full_name} {METRIC_HELP.get(name, name)}')
+                lines.append(f'# TYPE {full_name} histogram')
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram['counts']):
+                        cumulative += count
+                        labels = _format_labels(key, [('le', _format_number(bound))])
+                        lines.append(f'{full_name}_bucket{labels} {cumulative}')
+                    lines.append(f'{full_name}_sum{_format_labels(key)} {_format_number(histogram["sum"])}')
+                    lines.append(f'{full_name}_count{_format_labels(key)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, output_path, prefix='log_analyzer_'):
+        """
+        Write the Prometheus text to a file, replacing it atomically
+
+        The file can be picked up by the node_exporter textfile collector.
+
+        Args:
+            output_path: Path of the .prom file
+            prefix: Prefix added to every metric name
+        """
+        temp_path = output_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(temp_path, output_path)
+
+    def timing_summary(self):
+        """
+        Summarize the histograms for printing
+
+        Returns:
+            List of (series name, count, total seconds, mean seconds, max seconds) tuples
+        """
+        summary = []
+        for name, series in self.snapshot()['histograms'].items():
+            for labels, histogram in series.items():
+                summary.append((name + labels, histogram['count'], histogram['sum'], histogram['mean'], histogram['max']))
+        return summary
+
+
+def start_metrics_server(registry, port, host='127.0.0.1'):
+    """
+    Serve the registry in the Prometheus text format from a background thread
+
+    Args:
+        registry: MetricsRegistry to expose
+        port: Port to listen on
+        host: Interface to listen on
+
+    Returns:
+        The running ThreadingHTTPServer; call shutdown() to stop it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True)
+    thread.start()
+    print(f'Serving Prometheus metrics on http://{host}:{port}/metrics')
+    return server
+
+
+class ProgressReporter:
+    """
+    Print analysis progress at most once every few seconds
+
+    Replaces printing a line per log entry, which slows the analysis loop
+    down and floods the console on large files.
+    """
+
+    def __init__(self, total=None, interval=5.0, label='log entries'):
+        """
+        Initialize the reporter
+
+        Args:
+            total: Number of rows expected, if known, to print a percentage
+            interval: Minimum number of seconds between progress lines
+            label: Name of the things being counted
+        """
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.rows = 0
+        self.anomalies = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self._reported_rows = None
+
+    def update(self, rows, anomalies=0):
+        """
+        Count newly processed rows and print progress if the interval has passed
+
+        Args:
+            rows: Number of rows just processed
+            anomalies: Number of them classified as anomalies
+        """
+        self.rows += rows
+        self.anomalies += anomalies
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._print(now)
+
+    def finish(self):
+        """
+        Print the final counts, unless the last progress line already showed them
+        """
+        if self._reported_rows != self.rows:
+            self._print(time.perf_counter())
+
+    def _print(self, now):
+        self._reported_rows = self.rows
+        elapsed = now - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        done = f'{self.rows:,}' if self.total is None else f'{self.rows:,}/{self.total:,}'
+        percent = f'{self.rows / self.total:.0%}, ' if self.total else ''
+        print(f'Processed {done} {self.label} ({percent}{rate:,.0f} rows/sec, {self.anomalies:,} anomalies)')
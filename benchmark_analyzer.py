@@ -0,0 +1,578 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import sqlite3
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+from datetime import datetime
+
+from test_gui import NORMAL_LOGS, ANOMALY_LOGS, generate_log_entry
+
+# Stages that can be selected with --stages, in the order they run
+STAGES = ['generate', 'startup', 'predict', 'predict_batch', 'analyze_csv',
+          'analyze_csv_stream', 'save_to_json', 'save_to_database']
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    'rows_per_second': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+CSV_COLUMNS = ['user_id', 'device_name', 'device_mac', 'device_ip', 'time', 'log']
+
+
+def generate_benchmark_data(num_rows, output_file, seed=0, chunk_rows=100000):
+    """
+    Generate a synthetic log CSV of any size, writing it in chunks
+
+    Rows are drawn like test_gui.generate_test_data (same devices and log
+    templates, 70% normal / 30% anomaly) but written incrementally, so
+    generating millions of rows does not hold them all in memory.
+
+    Args:
+        num_rows: Number of log rows to generate
+        output_file: Path of the CSV file to write
+        seed: Random seed, so every run produces the same file
+        chunk_rows: Number of rows generated per write
+    """
+    rng_state = random.getstate()
+    random.seed(seed)
+    start_time = datetime(2024, 1, 1)
+
+    try:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+            written = 0
+            while written < num_rows:
+                count = min(chunk_rows, num_rows - written)
+                writer.writerows(generate_log_entry(start_time) for _ in range(count))
+                written += count
+    finally:
+        random.setstate(rng_state)
+
+
+def build_tiny_model(output_dir, seed=0):
+    """
+    Build a tiny randomly initialised RoBERTa classifier so benchmarks run offline
+
+    The tokenizer is a byte-level BPE trained on the synthetic log templates.
+    Predictions are meaningless, but the model exercises the same tokenizer,
+    batching and forward-pass code as the real one.
+
+    Args:
+        output_dir: Directory to save the model and tokenizer to
+        seed: Random seed for the model weights
+
+    Returns:
+        Path to the model directory
+    """
+    import torch
+    from tokenizers import ByteLevelBPETokenizer
+    from tokenizers.processors import RobertaProcessing
+    from transformers import RobertaConfig, RobertaForSequenceClassification, RobertaTokenizerFast
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator((NORMAL_LOGS + ANOMALY_LOGS) * 10, vocab_size=512,
+                            special_tokens=['<s>', '<pad>', '</s>', '<unk>', '<mask>'])
+    bpe.save_model(output_dir)
+    bpe.post_processor = RobertaProcessing(('</s>', bpe.token_to_id('</s>')), ('<s>', bpe.token_to_id('<s>')))
+
+    # Wrap the trained tokenizer itself; newer transformers ignore vocab_file/merges_file here
+    tokenizer = RobertaTokenizerFast(
+        tokenizer_object=bpe._tokenizer,
+        bos_token='<s>', eos_token='</s>', sep_token='</s>', cls_token='<s>',
+        unk_token='<unk>', pad_token='<pad>', mask_token='<mask>',
+        model_max_length=128
+    )
+    sample_ids = tokenizer(NORMAL_LOGS[0])['input_ids']
+    if len(sample_ids) <= 2:
+        raise RuntimeError(f"Tiny tokenizer produced no tokens for {NORMAL_LOGS[0]!r}: {sample_ids}")
+    tokenizer.save_pretrained(output_dir)
+
+    config = RobertaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        max_position_embeddings=130,
+        num_labels=2,
+        pad_token_id=tokenizer.pad_token_id
+    )
+    torch.manual_seed(seed)
+    RobertaForSequenceClassification(config).save_pretrained(output_dir)
+    return output_dir
+
+
+def _current_rss():
+    """
+    Get the resident set size of this process in bytes, or None if unavailable
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+
+class PeakMemorySampler:
+    """
+    Track the peak resident memory of the process while a stage runs
+
+    A background thread samples the RSS every few milliseconds. Where
+    /proc is not available the process-wide peak from getrusage is used,
+    which never goes down between stages.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Initialize the sampler
+
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = interval
+        self.start_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = _current_rss()
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._record(_current_rss())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record(_current_rss())
+
+    def _record(self, rss):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+
+def _percentile(sorted_values, percent):
+    """
+    Linearly interpolated percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _stage_result(rows, seconds, memory, latencies=None):
+    """
+    Build the result dictionary for one stage
+
+    Args:
+        rows: Number of log rows the stage processed
+        seconds: Wall-clock time of the stage
+        memory: PeakMemorySampler used while the stage ran
+        latencies: Optional list of per-call latencies in seconds
+
+    Returns:
+        Dictionary of stage metrics
+    """
+    result = {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else 0.0,
+        'start_rss_mb': memory.start_rss / 2 ** 20 if memory.start_rss is not None else None,
+        'peak_rss_mb': memory.peak_rss / 2 ** 20 if memory.peak_rss is not None else None,
+    }
+    if latencies:
+        latencies = sorted(latencies)
+        result['calls'] = len(latencies)
+        for percent in (50, 90, 99):
+            result[f'latency_p{percent}_ms'] = _percentile(latencies, percent) * 1000
+        result['latency_max_ms'] = latencies[-1] * 1000
+    return result
+
+
+@contextlib.contextmanager
+def _quiet(enabled):
+    """
+    Silence the analyzer's per-row progress output while a stage runs
+    """
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def save_to_sqlite(results, db_path):
+    """
+    Insert analysis results into a SQLite logs table shaped like the PostgreSQL one
+
+    Used as a stand-in for save_to_database when no PostgreSQL server is available.
+
+    Args:
+        results: List of result dictionaries
+        db_path: Path to the SQLite database file
+
+    Returns:
+        Number of records inserted
+    """
+    from db_loader import LOG_COLUMNS, result_to_row
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "device_name TEXT, device_mac TEXT, device_ip TEXT, log TEXT, status TEXT, confidence REAL, time TEXT, "
+            "template_id INTEGER, template_params TEXT, fingerprint TEXT)"
+        )
+        placeholders = ', '.join('?' for _ in LOG_COLUMNS)
+        cursor = conn.executemany(
+            f"INSERT INTO logs ({', '.join(LOG_COLUMNS)}) VALUES ({placeholders})",
+            (result_to_row(result, position) for position, result in enumerate(results))
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def get_git_revision():
+    """
+    Get the git commit the benchmark ran against
+
+    Returns:
+        Dictionary with the commit hash and 'git describe' output (None outside a git checkout)
+    """
+    revision = {'commit': None, 'describe': None}
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for key, command in (('commit', ['git', 'rev-parse', 'HEAD']),
+                         ('describe', ['git', 'describe', '--always', '--dirty'])):
+        try:
+            revision[key] = subprocess.run(command, cwd=cwd, capture_output=True, text=True,
+                                           check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return revision
+
+
+class AnalyzerBenchmark:
+    """
+    Time the analyzer's hot paths on synthetic CSVs of increasing size
+
+    Every stage reports wall-clock time, rows per second and peak resident
+    memory; the predict and predict_batch stages also report per-call
+    latency percentiles.
+    """
+
+    def __init__(self, model_path, data_dir, stages=None, analyzer_kwargs=None, db='sqlite',
+                 latency_samples=200, sample_rows=10000, chunk_size=1000, seed=0, quiet=True):
+        """
+        Initialize the benchmark
+
+        Args:
+            model_path: Path to the model directory to benchmark
+            data_dir: Directory for generated CSVs and outputs
+            stages: List of stage names to run (default: all of STAGES)
+            analyzer_kwargs: Extra keyword arguments for LogAnalyzerTool
+            db: Database for save_to_database, 'sqlite' (stand-in) or 'postgres'
+            latency_samples: Number of single-log predict calls timed
+            sample_rows: Number of logs run through predict_batch
+            chunk_size: Number of logs per predict_batch call and per streamed chunk
+            seed: Random seed for the generated data
+            quiet: Whether to silence the analyzer's own output
+        """
+        self.model_path = model_path
+        self.data_dir = data_dir
+        self.stages = stages or STAGES
+        self.analyzer_kwargs = analyzer_kwargs or {}
+        self.db = db
+        self.latency_samples = latency_samples
+        self.sample_rows = sample_rows
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.quiet = quiet
+
+    def run(self, num_rows):
+        """
+        Run the selected stages on a CSV with num_rows rows
+
+        Args:
+            num_rows: Number of log rows in the benchmark CSV
+
+        Returns:
+            Dictionary mapping stage names to their metrics
+        """
+        import pandas as pd
+        from log_analyzer_tool import LogAnalyzerTool
+
+        stages = {}
+        csv_path = os.path.join(self.data_dir, f'benchmark_{num_rows}.csv')
+
+        # Generated files are reused between runs with the same --data-dir
+        if not os.path.exists(csv_path) or 'generate' in self.stages:
+            with PeakMemorySampler() as memory:
+                start = time.perf_counter()
+                generate_benchmark_data(num_rows, csv_path, seed=self.seed)
+                seconds = time.perf_counter() - start
+            if 'generate' in self.stages:
+                stages['generate'] = _stage_result(num_rows, seconds, memory)
+
+        with _quiet(self.quiet), PeakMemorySampler() as memory:
+            start = time.perf_counter()
+            analyzer = LogAnalyzerTool(model_path=self.model_path, lazy_load=False, **self.analyzer_kwargs)
+            seconds = time.perf_counter() - start
+        if 'startup' in self.stages:
+            stages['startup'] = _stage_result(0, seconds, memory)
+            stages['startup']['phases'] = dict(analyzer.startup_timings)
+            stages['startup']['model_loaded'] = analyzer.model_loaded
+
+        try:
+            sample_logs = pd.read_csv(csv_path, usecols=['log'], nrows=max(self.latency_samples, self.sample_rows))['log'].tolist()
+
+            if 'predict' in self.stages:
+                latencies = []
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    for log_text in sample_logs[:self.latency_samples]:
+                        call_start = time.perf_counter()
+                        analyzer.predict(log_text)
+                        latencies.append(time.perf_counter() - call_start)
+                    seconds = time.perf_counter() - start
+                stages['predict'] = _stage_result(len(latencies), seconds, memory, latencies)
+
+            if 'predict_batch' in self.stages:
+                latencies = []
+                logs = sample_logs[:self.sample_rows]
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    for offset in range(0, len(logs), self.chunk_size):
+                        call_start = time.perf_counter()
+                        analyzer.predict_batch(logs[offset:offset + self.chunk_size])
+                        latencies.append(time.perf_counter() - call_start)
+                    seconds = time.perf_counter() - start
+                stages['predict_batch'] = _stage_result(len(logs), seconds, memory, latencies)
+                stages['predict_batch']['chunk_size'] = self.chunk_size
+
+            results = None
+            if 'analyze_csv' in self.stages:
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    results = analyzer.analyze_csv(csv_path)
+                    seconds = time.perf_counter() - start
+                stages['analyze_csv'] = _stage_result(len(results), seconds, memory)
+
+            if 'analyze_csv_stream' in self.stages:
+                output_path = os.path.join(self.data_dir, f'benchmark_{num_rows}_stream.jsonl')
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    summary = analyzer.analyze_csv_stream(csv_path, output_path=output_path, chunk_size=self.chunk_size)
+                    seconds = time.perf_counter() - start
+                stages['analyze_csv_stream'] = _stage_result(summary['rows'], seconds, memory)
+                os.remove(output_path)
+
+            if results is None and ('save_to_json' in self.stages or 'save_to_database' in self.stages):
+                with _quiet(self.quiet):
+                    results = analyzer.analyze_csv(csv_path)
+
+            if 'save_to_json' in self.stages:
+                output_path = os.path.join(self.data_dir, f'benchmark_{num_rows}.json')
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    analyzer.save_to_json(results, output_path)
+                    seconds = time.perf_counter() - start
+                stages['save_to_json'] = _stage_result(len(results), seconds, memory)
+                os.remove(output_path)
+
+            if 'save_to_database' in self.stages:
+                db_path = os.path.join(self.data_dir, f'benchmark_{num_rows}.sqlite')
+                with _quiet(self.quiet), PeakMemorySampler() as memory:
+                    start = time.perf_counter()
+                    if self.db == 'postgres':
+                        inserted = analyzer.save_to_database(results)
+                    else:
+                        inserted = save_to_sqlite(results, db_path)
+                    seconds = time.perf_counter() - start
+                stages['save_to_database'] = _stage_result(inserted, seconds, memory)
+                stages['save_to_database']['database'] = self.db
+                if os.path.exists(db_path):
+                    os.remove(db_path)
+        finally:
+            analyzer.close()
+
+        return stages
+
+
+def compare_results(baseline, current, threshold=10.0):
+    """
+    Compare two benchmark result files stage by stage
+
+    Args:
+        baseline: Benchmark results dictionary of the reference commit
+        current: Benchmark results dictionary of the commit under test
+        threshold: Percentage change in the bad direction reported as a regression
+
+    Returns:
+        List of (rows, stage, metric, baseline value, current value, percent change, is_regression)
+    """
+    baseline_runs = {run['rows']: run['stages'] for run in baseline.get('runs', [])}
+    comparisons = []
+
+    for run in current.get('runs', []):
+        for stage, metrics in run['stages'].items():
+            reference = baseline_runs.get(run['rows'], {}).get(stage)
+            if not reference:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old, new = reference.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                worse = -change if higher_is_better else change
+                comparisons.append((run['rows'], stage, metric, old, new, change, worse > threshold))
+
+    return comparisons
+
+
+def main():
+    """
+    Main function to run the benchmark suite
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the log analyzer hot paths on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='CSV sizes to benchmark (e.g. 1000 100000 10000000)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to run')
+    parser.add_argument('--output', default='benchmark_results.json', help='Path to save the JSON results')
+    parser.add_argument('--compare', help='Path to the JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percentage slowdown reported as a regression by --compare')
+    parser.add_argument('--model', help='Path to a model directory (default: a tiny randomly initialised RoBERTa)')
+    parser.add_argument('--data-dir', help='Directory to keep generated CSVs in and reuse them from (default: a temporary directory)')
+    parser.add_argument('--db', choices=['sqlite', 'postgres'], default='sqlite',
+                        help='Database for the save_to_database stage; postgres writes to the DB_* database, so use a scratch one')
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of logs per model forward pass')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of logs per predict_batch call and per streamed chunk')
+    parser.add_argument('--latency-samples', type=int, default=200, help='Number of single-log predict calls to time')
+    parser.add_argument('--sample-rows', type=int, default=10000, help='Number of logs run through predict_batch')
+    parser.add_argument('--cache-size', type=int, default=0, help='Prediction cache size (default 0, so every log goes through the model)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for model inference')
+    parser.add_argument('--backend', default='torch', help='Inference backend')
+    parser.add_argument('--max-length', help='Tokens per model input: a profile name (short, medium, full) or a number (default: the model\'s limit)')
+    parser.add_argument('--heuristic-only', action='store_true', help='Benchmark keyword heuristics without the model')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for generated data and the tiny model')
+    parser.add_argument('--verbose', action='store_true', help="Show the analyzer's own output")
+
+    args = parser.parse_args()
+
+    temp_dir = None
+    data_dir = args.data_dir
+    if data_dir:
+        os.makedirs(data_dir, exist_ok=True)
+    else:
+        temp_dir = data_dir = tempfile.mkdtemp(prefix='log_analyzer_benchmark_')
+
+    try:
+        model_path = args.model
+        if not model_path and not args.heuristic_only:
+            print('Building tiny RoBERTa model...')
+            model_path = build_tiny_model(os.path.join(data_dir, 'tiny-roberta'), seed=args.seed)
+
+        benchmark = AnalyzerBenchmark(
+            model_path or 'AI/main-federated-roberta-model',
+            data_dir,
+            stages=args.stages,
+            analyzer_kwargs={
+                'batch_size': args.batch_size,
+                'cache_size': args.cache_size,
+                'workers': args.workers,
+                'backend': args.backend,
+                'max_length': args.max_length,
+                'use_model': not args.heuristic_only,
+            },
+            db=args.db,
+            latency_samples=args.latency_samples,
+            sample_rows=args.sample_rows,
+            chunk_size=args.chunk_size,
+            seed=args.seed,
+            quiet=not args.verbose
+        )
+
+        report = {
+            **get_git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')},
+            'runs': [],
+        }
+        try:
+            import torch
+            report['torch'] = torch.__version__
+        except ImportError:
+            report['torch'] = None
+
+        for num_rows in args.rows:
+            print(f'\nBenchmarking {num_rows} rows...')
+            stages = benchmark.run(num_rows)
+            report['runs'].append({'rows': num_rows, 'stages': stages})
+            for name, metrics in stages.items():
+                line = f"  {name:<20} {metrics['seconds']:9.3f}s {metrics['rows_per_second']:>14,.0f} rows/sec"
+                if metrics['peak_rss_mb'] is not None:
+                    line += f"  peak RSS {metrics['peak_rss_mb']:8.1f} MB"
+                if 'latency_p50_ms' in metrics:
+                    line += f"  p50 {metrics['latency_p50_ms']:.2f} ms  p99 {metrics['latency_p99_ms']:.2f} ms"
+                print(line)
+
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nBenchmark results saved to {args.output}')
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparisons = compare_results(baseline, report, threshold=args.threshold)
+        print(f"\nComparison against {args.compare} ({baseline.get('describe') or baseline.get('commit')}):")
+        regressions = 0
+        for rows, stage, metric, old, new, change, is_regression in comparisons:
+            regressions += is_regression
+            marker = '  REGRESSION' if is_regression else ''
+            print(f'  {rows:>10} {stage:<20} {metric:<16} {old:12.2f} -> {new:12.2f} ({change:+.1f}%){marker}')
+        if regressions:
+            print(f'{regressions} regression(s) beyond {args.threshold:.0f}%')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
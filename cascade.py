@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import zlib
+
+import numpy as np
+
+from prediction_cache import mask_log_template
+
+# Stages of the cascade, cheapest first; 'model' is the full RoBERTa model
+CASCADE_STAGES = ['cache', 'keywords', 'linear', 'model']
+
+CASCADE_CONFIG_FILE = 'cascade.json'
+LINEAR_WEIGHTS_FILE = 'linear_model.npz'
+
+
+def _labels_to_targets(labels):
+    """
+    Turn 'anomaly'/'normal' labels into 1/0 targets
+    """
+    return np.array([1.0 if str(label).lower() == 'anomaly' else 0.0 for label in labels])
+
+
+class HashedNgramModel:
+    """
+    Logistic regression over hashed word n-grams of masked log templates
+
+    Logs are masked with the prediction cache's template rules, lowercased and
+    split into words; every word and word bigram is hashed (CRC32, so indices
+    are stable across processes) into a fixed number of buckets. Scoring a log
+    is a sum of a few weights, thousands of times cheaper than a transformer
+    forward pass.
+    """
+
+    def __init__(self, hash_bits=18, weights=None):
+        """
+        Initialize the model
+
+        Args:
+            hash_bits: Number of hash buckets as a power of two
+            weights: Trained weight vector of 2**hash_bits + 1 values, the last being the bias (optional)
+        """
+        self.hash_bits = hash_bits
+        self.num_buckets = 1 << hash_bits
+        self.weights = weights if weights is not None else np.zeros(self.num_buckets + 1)
+        self._feature_cache = {}
+
+    def features(self, log_text):
+        """
+        Get the hashed feature indices of a log line, including the bias index
+
+        Args:
+            log_text: The log text
+
+        Returns:
+            numpy array of distinct feature indices
+        """
+        template = mask_log_template(log_text).lower()
+        indices = self._feature_cache.get(template)
+        if indices is None:
+            words = template.split()
+            grams = words + [first + ' ' + second for first, second in zip(words, words[1:])]
+            buckets = {zlib.crc32(gram.encode('utf-8')) & (self.num_buckets - 1) for gram in grams}
+            buckets.add(self.num_buckets)
+            indices = np.fromiter(sorted(buckets), dtype=np.int64)
+            if len(self._feature_cache) < 100000:
+                self._feature_cache[template] = indices
+        return indices
+
+    def _feature_matrix(self, log_texts):
+        """
+        Build a CSR-style (indices, row pointers) pair for a list of logs
+        """
+        rows = [self.features(log_text) for log_text in log_texts]
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        return indices, indptr, lengths
+
+    @staticmethod
+    def _sigmoid(z):
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+    def predict_proba(self, log_texts):
+        """
+        Estimate the probability that each log is an anomaly
+
+        Args:
+            log_texts: List of log texts
+
+        Returns:
+            numpy array of anomaly probabilities, in the same order as log_texts
+        """
+        if not len(log_texts):
+            return np.zeros(0)
+        indices, indptr, _ = self._feature_matrix(log_texts)
+        return self._sigmoid(np.add.reduceat(self.weights[indices], indptr[:-1]))
+
+    def fit(self, log_texts, targets, epochs=100, learning_rate=0.5, l2=1e-5):
+        """
+        Train the weights with full-batch AdaGrad on the log loss
+
+        Args:
+            log_texts: List of log texts
+            targets: Sequence of 1 (anomaly) / 0 (normal) targets
+            epochs: Number of passes over the data
+            learning_rate: AdaGrad step size
+            l2: L2 regularization strength
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        indices, indptr, lengths = self._feature_matrix(log_texts)
+        accumulated = np.full_like(self.weights, 1e-8)
+        for _ in range(epochs):
+            probabilities = self._sigmoid(np.add.reduceat(self.weights[indices], indptr[:-1]))
+            errors = np.repeat(probabilities - targets, lengths)
+            gradient = np.bincount(indices, weights=errors, minlength=len(self.weights)) / len(targets)
+            gradient += l2 * self.weights
+            accumulated += gradient * gradient
+            self.weights -= learning_rate * gradient / np.sqrt(accumulated)
+        return self
+
+
+class CascadeModel:
+    """
+    Calibrated cheap stages that decide confident logs before the full model
+
+    The keyword stage flags an anomaly when the keyword heuristic fires, if
+    calibration showed it agrees with the reference often enough. The linear
+    stage decides a log when the hashed n-gram model's anomaly probability is
+    at least anomaly_threshold or at most normal_threshold. Anything else is
+    escalated to RoBERTa.
+    """
+
+    def __init__(self, linear_model, anomaly_threshold=1.01, normal_threshold=-0.01,
+                 use_keywords=False, keyword_precision=0.0, calibration=None):
+        """
+        Initialize the cascade
+
+        Args:
+            linear_model: Trained HashedNgramModel
+            anomaly_threshold: Probability at or above which the linear stage decides 'anomaly'
+            normal_threshold: Probability at or below which the linear stage decides 'normal'
+            use_keywords: Whether keyword matches decide 'anomaly' on their own
+            keyword_precision: Measured precision of keyword matches, reported as their confidence
+            calibration: Calibration report saved with the cascade (optional)
+        """
+        self.linear_model = linear_model
+        self.anomaly_threshold = anomaly_threshold
+        self.normal_threshold = normal_threshold
+        self.use_keywords = use_keywords
+        self.keyword_precision = keyword_precision
+        self.calibration = calibration or {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a cascade written by save
+
+        Args:
+            path: Cascade directory
+
+        Returns:
+            CascadeModel instance
+        """
+        with open(os.path.join(path, CASCADE_CONFIG_FILE)) as f:
+            config = json.load(f)
+        weights = np.load(os.path.join(path, LINEAR_WEIGHTS_FILE))['weights']
+        return cls(
+            HashedNgramModel(config['hash_bits'], weights),
+            anomaly_threshold=config['anomaly_threshold'],
+            normal_threshold=config['normal_threshold'],
+            use_keywords=config['use_keywords'],
+            keyword_precision=config['keyword_precision'],
+            calibration=config.get('calibration')
+        )
+
+    def save(self, path):
+        """
+        Write the cascade to a directory
+
+        Args:
+            path: Cascade directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.savez_compressed(os.path.join(path, LINEAR_WEIGHTS_FILE), weights=self.linear_model.weights)
+        config = {
+            'hash_bits': self.linear_model.hash_bits,
+            'anomaly_threshold': self.anomaly_threshold,
+            'normal_threshold': self.normal_threshold,
+            'use_keywords': self.use_keywords,
+            'keyword_precision': self.keyword_precision,
+            'calibration': self.calibration,
+        }
+        with open(os.path.join(path, CASCADE_CONFIG_FILE), 'w') as f:
+            json.dump(config, f, indent=2)
+
+    def classify(self, log_texts, keyword_matcher):
+        """
+        Run the cheap stages over a list of logs
+
+        Args:
+            log_texts: List of log texts
+            keyword_matcher: KeywordMatcher used by the keyword stage
+
+        Returns:
+            Tuple of (list of prediction dictionaries, or None for logs to escalate,
+            list of the stage that decided each log, or None)
+        """
+        results = [None] * len(log_texts)
+        stages = [None] * len(log_texts)
+        remaining = list(range(len(log_texts)))
+
+        if self.use_keywords:
+            undecided = []
+            for i in remaining:
+                if keyword_matcher.is_anomaly(keyword_matcher.match(log_texts[i])):
+                    results[i] = {'label': 'anomaly', 'score': self.keyword_precision}
+                    stages[i] = 'keywords'
+                else:
+                    undecided.append(i)
+            remaining = undecided
+
+        probabilities = self.linear_model.predict_proba([log_texts[i] for i in remaining])
+        for i, probability in zip(remaining, probabilities.tolist()):
+            if probability >= self.anomaly_threshold:
+                results[i] = {'label': 'anomaly', 'score': probability}
+                stages[i] = 'linear'
+            elif probability <= self.normal_threshold:
+                results[i] = {'label': 'normal', 'score': 1.0 - probability}
+                stages[i] = 'linear'
+        return results, stages
+
+
+def _anomaly_threshold(probabilities, correct_if_anomaly, target_precision, min_support):
+    """
+    Lowest probability threshold whose 'anomaly' decisions reach the target precision
+    """
+    order = np.argsort(-probabilities)
+    hits = np.cumsum(correct_if_anomaly[order])
+    counts = np.arange(1, len(order) + 1)
+    precision = hits / counts
+    best = 1.01
+    for position in range(len(order)):
+        # Only cut between distinct probabilities
+        if position + 1 < len(order) and probabilities[order[position + 1]] == probabilities[order[position]]:
+            continue
+        if counts[position] >= min_support and precision[position] >= target_precision:
+            best = float(probabilities[order[position]])
+    return best
+
+
+def calibrate_cascade(model_path, csv_file_path, output_dir, target_precision=0.99, holdout=0.2,
+                      keywords_path=None, batch_size=32, backend='torch', hash_bits=18, epochs=100,
+                      min_support=20, seed=0):
+    """
+    Train and calibrate a cascade on a CSV of logs, and measure its accuracy cost
+
+    The full model classifies every log first. The linear stage is trained to
+    reproduce the 'label' column if there is one, otherwise the model's own
+    verdicts (distillation). Thresholds are chosen on a held-out split so that
+    every decision a cheap stage takes agrees with the reference labels at
+    least target_precision of the time.
+
+    Args:
+        model_path: Path to the model directory
+        csv_file_path: Path to a CSV file with a 'log' column and optionally a
+                       'label' column of 'anomaly'/'normal' values
+        output_dir: Directory to save the cascade to
+        target_precision: Minimum agreement of cheap-stage decisions with the reference
+        holdout: Fraction of rows held out for calibration and evaluation
+        keywords_path: Path to a keyword file for the keyword stage (optional)
+        batch_size: Number of logs per forward pass
+        backend: Inference backend for the full model
+        hash_bits: Number of hash buckets of the linear model as a power of two
+        epochs: Training passes of the linear model
+        min_support: Minimum number of held-out logs a threshold must decide
+        seed: Seed of the train/holdout split
+
+    Returns:
+        Calibration report dictionary (also saved in the cascade directory)
+    """
+    import pandas as pd
+    from log_analyzer_tool import LogAnalyzerTool
+
+    df = pd.read_csv(csv_file_path)
+    if 'log' not in df.columns:
+        raise ValueError('CSV file must contain a "log" column')
+    log_texts = df['log'].fillna('').astype(str).tolist()
+
+    analyzer = LogAnalyzerTool(model_path=model_path, batch_size=batch_size, cache_size=0, backend=backend,
+                               keywords_path=keywords_path, lazy_load=False)
+    if not analyzer.model_loaded:
+        raise RuntimeError('Could not load the model to calibrate the cascade against')
+    start = time.perf_counter()
+    model_labels = [prediction['label'] for prediction in analyzer.predict_batch(log_texts)]
+    model_seconds = time.perf_counter() - start
+    keyword_flags = np.array([analyzer.keyword_matcher.is_anomaly(analyzer.keyword_matcher.match(log_text))
+                              for log_text in log_texts])
+    analyzer.close()
+
+    has_labels = 'label' in df.columns
+    reference = _labels_to_targets(df['label'] if has_labels else model_labels)
+    model_targets = _labels_to_targets(model_labels)
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(log_texts))
+    split = len(order) - max(1, int(len(order) * holdout))
+    train, test = order[:split], order[split:]
+
+    print(f'Training the linear stage on {len(train)} logs ({"labels" if has_labels else "distilled from the model"})...')
+    linear_model = HashedNgramModel(hash_bits).fit([log_texts[i] for i in train], reference[train], epochs=epochs)
+
+    # Keyword stage: keep it only if its anomaly flags are precise enough on the holdout
+    test_flags = keyword_flags[test]
+    keyword_precision = float(reference[test][test_flags].mean()) if test_flags.any() else 0.0
+    use_keywords = bool(test_flags.sum() >= min_support and keyword_precision >= target_precision)
+
+    # Linear stage thresholds, chosen on the holdout logs the keyword stage leaves
+    linear_rows = test[~test_flags] if use_keywords else test
+    probabilities = linear_model.predict_proba([log_texts[i] for i in linear_rows])
+    targets = reference[linear_rows]
+    anomaly_threshold = _anomaly_threshold(probabilities, targets, target_precision, min_support)
+    normal_threshold = 1.0 - _anomaly_threshold(1.0 - probabilities, 1.0 - targets, target_precision, min_support)
+    if normal_threshold >= anomaly_threshold:
+        normal_threshold = anomaly_threshold - 1e-6
+
+    cascade = CascadeModel(linear_model, anomaly_threshold, normal_threshold, use_keywords, keyword_precision)
+
+    # Evaluate the cascade (without a warm cache) against the full model on the holdout
+    results, stages = cascade.classify([log_texts[i] for i in test], analyzer.keyword_matcher)
+    cascade_targets = np.array([
+        (1.0 if result['label'] == 'anomaly' else 0.0) if result is not None else model_targets[i]
+        for i, result in zip(test, results)
+    ])
+    stage_counts = {stage: 0 for stage in CASCADE_STAGES}
+    for stage in stages:
+        stage_counts[stage or 'model'] += 1
+
+    report = {
+        'csv': csv_file_path,
+        'rows': len(log_texts),
+        'holdout_rows': len(test),
+        'reference': 'labels' if has_labels else 'model',
+        'target_precision': target_precision,
+        'anomaly_threshold': anomaly_threshold,
+        'normal_threshold': normal_threshold,
+        'use_keywords': use_keywords,
+        'keyword_precision': keyword_precision,
+        'stage_fractions': {stage: count / max(1, len(test)) for stage, count in stage_counts.items()},
+        'model_call_reduction': len(test) / max(1, stage_counts['model']),
+        'model_accuracy': float((model_targets[test] == reference[test]).mean()),
+        'cascade_accuracy': float((cascade_targets == reference[test]).mean()),
+        'model_agreement': float((cascade_targets == model_targets[test]).mean()),
+        'model_seconds_per_log': model_seconds / max(1, len(log_texts)),
+    }
+    cascade.calibration = report
+    cascade.save(output_dir)
+    return report
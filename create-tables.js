@@ -24,17 +24,51 @@ CREATE TABLE IF NOT EXISTS users (
   user_name VARCHAR(255) NOT NULL
 );
 
--- Create logs table
+-- Status labels, stored as a 4-byte enum instead of free text
+DO $$ BEGIN
+  CREATE TYPE log_status AS ENUM ('normal', 'anomaly', 'non-anomaly', 'unknown', 'Normal', 'Anomaly');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+-- Create logs table, partitioned by month on time (same layout as db_loader.py;
+-- existing unpartitioned tables are converted with: python db_loader.py --migrate)
 CREATE TABLE IF NOT EXISTS logs (
-  log_id SERIAL PRIMARY KEY,
+  log_id BIGSERIAL,
   user_id INT REFERENCES users(user_id) ON DELETE CASCADE,
   device_name VARCHAR(255),
   device_mac VARCHAR(255),
   device_ip VARCHAR(255),
   log TEXT,
-  status VARCHAR(50),
-  time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+  status log_status,
+  confidence DOUBLE PRECISION,
+  time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  template_id INTEGER,
+  template_params TEXT,
+  fingerprint CHAR(64)
+) PARTITION BY RANGE (time);
+CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT;
+
+-- Monthly partitions from a year back to two months ahead; the analyzer adds others as needed
+DO $$
+DECLARE
+  month DATE;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = 'logs'::regclass) = 'p' THEN
+    FOR month IN SELECT generate_series(date_trunc('month', now()) - INTERVAL '12 months',
+                                        date_trunc('month', now()) + INTERVAL '2 months', INTERVAL '1 month')::date LOOP
+      IF to_regclass('logs_p' || to_char(month, 'YYYY_MM')) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+                       'logs_p' || to_char(month, 'YYYY_MM'), month, (month + INTERVAL '1 month')::date);
+      END IF;
+    END LOOP;
+
+    CREATE INDEX IF NOT EXISTS logs_log_id_idx ON logs (log_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS logs_fingerprint_time_key ON logs (fingerprint, time);
+    CREATE INDEX IF NOT EXISTS logs_user_time_idx ON logs (user_id, time);
+    CREATE INDEX IF NOT EXISTS logs_device_time_idx ON logs (device_name, time);
+    CREATE INDEX IF NOT EXISTS logs_anomaly_time_idx ON logs (time) WHERE status = 'anomaly';
+  END IF;
+END $$;
 
 -- Create contact table
 CREATE TABLE IF NOT EXISTS contact (
@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+from datetime import datetime
+
+import psycopg2
+
+from db_loader import LOGS_INDEXES_SQL, create_partitioned_logs_table
+from test_gui import NORMAL_LOGS, ANOMALY_LOGS
+
+# The logs table as it was before partitioning: no indexes besides the primary key and fingerprint
+LEGACY_LOGS_TABLE_SQL = """
+    CREATE TABLE logs (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        device_name VARCHAR(255),
+        device_mac VARCHAR(255),
+        device_ip VARCHAR(255),
+        log TEXT,
+        status VARCHAR(50),
+        time TIMESTAMP,
+        template_id INTEGER,
+        template_params TEXT,
+        fingerprint CHAR(64)
+    );
+"""
+LEGACY_INDEXES_SQL = "CREATE UNIQUE INDEX logs_fingerprint_key ON logs (fingerprint);"
+
+LAYOUTS = ['legacy', 'partitioned']
+
+NUM_USERS = 50
+NUM_DEVICES = 500
+START_TIME = datetime(2024, 1, 1)
+
+# Rows are derived from their number alone, so both layouts get identical data.
+# 30% are anomalies; times are spread evenly over the generated months.
+GENERATE_ROWS_SQL = f"""
+    INSERT INTO logs (user_id, device_name, device_mac, device_ip, log, status, time, fingerprint)
+    SELECT
+        1 + mod(i * 7919, {NUM_USERS}),
+        'Device-' || lpad(mod(i * 104729, {NUM_DEVICES})::text, 3, '0'),
+        '00:1B:44:' || lpad(to_hex(mod(i * 104729, {NUM_DEVICES})::int), 6, '0'),
+        '10.0.' || div(mod(i * 104729, {NUM_DEVICES}), 256) || '.' || mod(mod(i * 104729, {NUM_DEVICES}), 256),
+        CASE WHEN mod(i * 31, 10) < 3
+            THEN (ARRAY[{', '.join(f"'{log}'" for log in ANOMALY_LOGS)}])[1 + mod(i, {len(ANOMALY_LOGS)})]
+            ELSE (ARRAY[{', '.join(f"'{log}'" for log in NORMAL_LOGS)}])[1 + mod(i, {len(NORMAL_LOGS)})]
+        END,
+        (CASE WHEN mod(i * 31, 10) < 3 THEN 'anomaly' ELSE 'normal' END){{status_cast}},
+        TIMESTAMP '{START_TIME:%Y-%m-%d}' + (i::float8 / %(total_rows)s) * %(span_seconds)s * INTERVAL '1 second',
+        md5(i::text) || md5((-i)::text)
+    FROM generate_series(%(first_row)s::bigint, %(last_row)s::bigint) AS i
+"""
+
+# Dashboard-style queries: the filters check_db.py and the web app's log views use
+QUERIES = {
+    'device_recent_100': "SELECT * FROM logs WHERE device_name = 'Device-042' AND time >= %(last_month)s "
+                         "ORDER BY time DESC LIMIT 100",
+    'user_one_day_count': "SELECT COUNT(*) FROM logs WHERE user_id = 7 AND time >= %(mid_day)s "
+                          "AND time < %(mid_day)s::timestamp + INTERVAL '1 day'",
+    'check_db_devices_count': "SELECT COUNT(*) FROM logs WHERE device_name IN "
+                              "('Device-005', 'Device-006', 'Device-105', 'Device-201', 'Device-301')",
+    'anomalies_week_by_device': "SELECT device_name, COUNT(*) FROM logs WHERE status = 'anomaly' "
+                                "AND time >= %(last_month)s AND time < %(last_month)s::timestamp + INTERVAL '7 days' "
+                                "GROUP BY device_name ORDER BY 2 DESC LIMIT 10",
+    'latest_anomalies_50': "SELECT * FROM logs WHERE status = 'anomaly' ORDER BY time DESC LIMIT 50",
+    'month_status_counts': "SELECT status, COUNT(*) FROM logs WHERE time >= %(mid_month)s "
+                           "AND time < %(mid_month)s::timestamp + INTERVAL '1 month' GROUP BY status",
+}
+
+
+def _months(num_months):
+    """
+    List the (year, month) pairs of the generated time span
+    """
+    return [(START_TIME.year + (START_TIME.month - 1 + i) // 12, (START_TIME.month - 1 + i) % 12 + 1)
+            for i in range(num_months)]
+
+
+def _scan_types(plan):
+    """
+    List the distinct scan node types of a query plan, e.g. 'Index Scan, Seq Scan'
+    """
+    scans = set()
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if 'Scan' in node['Node Type']:
+            scans.add(node['Node Type'])
+        nodes.extend(node.get('Plans', []))
+    return ', '.join(sorted(scans))
+
+
+def build_layout(conn, layout, num_rows, num_months, chunk_rows=1000000):
+    """
+    Create a schema holding a logs table in one layout and fill it with generated rows
+
+    Args:
+        conn: Open database connection
+        layout: 'legacy' (unpartitioned, VARCHAR status) or 'partitioned'
+        num_rows: Number of rows to generate
+        num_months: Number of months the row times are spread over
+        chunk_rows: Number of rows generated per INSERT and commit
+
+    Returns:
+        Dictionary with the load and index build times
+    """
+    schema = f'load_test_{layout}'
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}")
+        if layout == 'legacy':
+            cur.execute(LEGACY_LOGS_TABLE_SQL)
+        else:
+            create_partitioned_logs_table(cur, months=_months(num_months), indexes=False)
+    conn.commit()
+
+    start = time.perf_counter()
+    span_seconds = (datetime(*_months(num_months + 1)[-1], 1) - START_TIME).total_seconds()
+    insert_sql = GENERATE_ROWS_SQL.replace('{status_cast}', '::log_status' if layout == 'partitioned' else '')
+    with conn.cursor() as cur:
+        for first_row in range(1, num_rows + 1, chunk_rows):
+            last_row = min(num_rows, first_row + chunk_rows - 1)
+            cur.execute(insert_sql, {'first_row': first_row, 'last_row': last_row,
+                                     'total_rows': num_rows, 'span_seconds': span_seconds})
+            conn.commit()
+            print(f'  {layout}: generated {last_row:,}/{num_rows:,} rows')
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(LEGACY_INDEXES_SQL if layout == 'legacy' else LOGS_INDEXES_SQL.format(id_column='id'))
+    conn.commit()
+    index_seconds = time.perf_counter() - start
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE logs")
+            cur.execute("SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0)::bigint, COALESCE(SUM(pg_indexes_size(c.oid)), 0)::bigint "
+                        "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                        "WHERE n.nspname = %s AND c.relkind IN ('r', 'p')", (schema,))
+            total_bytes, index_bytes = cur.fetchone()
+    finally:
+        conn.autocommit = False
+
+    return {
+        'load_seconds': load_seconds,
+        'index_seconds': index_seconds,
+        'total_mb': total_bytes / (1024 * 1024),
+        'index_mb': index_bytes / (1024 * 1024),
+    }
+
+
+def time_queries(conn, layout, num_months, repeat=5):
+    """
+    Time every dashboard query against one layout
+
+    Args:
+        conn: Open database connection
+        layout: Layout whose schema to query
+        num_months: Number of generated months, to pick query time ranges inside the data
+        repeat: Number of timed runs per query, after one warm-up run
+
+    Returns:
+        Dictionary mapping each query name to its median and max milliseconds and scan types
+    """
+    months = _months(num_months)
+    params = {
+        'last_month': datetime(*months[-1], 1),
+        'mid_month': datetime(*months[len(months) // 2], 1),
+        'mid_day': datetime(*months[len(months) // 2], 15),
+    }
+    results = {}
+    with conn.cursor() as cur:
+        cur.execute(f"SET search_path TO load_test_{layout}")
+        for name, sql in QUERIES.items():
+            cur.execute(sql, params)
+            cur.fetchall()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cur.execute(sql, params)
+                cur.fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cur.fetchone()[0][0]['Plan']
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'max_ms': max(timings),
+                'scans': _scan_types(plan),
+            }
+    conn.commit()
+    return results
+
+
+def main():
+    """
+    Compare dashboard query latency on the unpartitioned and partitioned logs layouts
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Load test the logs table layouts with generated rows')
+    parser.add_argument('--rows', type=int, default=10000000, help='Number of rows to generate per layout')
+    parser.add_argument('--months', type=int, default=12, help='Number of months the rows are spread over')
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS, help='Layouts to test')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+    parser.add_argument('--reuse', action='store_true', help='Query the load_test_* schemas of an earlier run instead of regenerating them')
+    parser.add_argument('--keep', action='store_true', help='Keep the load_test_* schemas afterwards')
+    parser.add_argument('--output', default='db_load_test_results.json', help='Path to save the JSON results')
+
+    args = parser.parse_args()
+
+    # Uses the DB_* database like the analyzer; the tables live in their own schemas
+    db_config = {
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': os.environ.get('DB_NAME', 'log_analyzer'),
+        'password': os.environ.get('DB_PASSWORD', 'logai'),
+        'port': os.environ.get('DB_PORT', 5432),
+    }
+
+    try:
+        conn = psycopg2.connect(**db_config)
+    except Exception as e:
+        print(f'Error connecting to the database: {str(e)}')
+        sys.exit(1)
+
+    results = {
+        'rows': args.rows,
+        'months': args.months,
+        'server_version': conn.server_version,
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'layouts': {},
+    }
+    try:
+        for layout in args.layouts:
+            layout_result = {}
+            if not args.reuse:
+                print(f'\nBuilding the {layout} layout with {args.rows:,} rows...')
+                layout_result.update(build_layout(conn, layout, args.rows, args.months))
+                print(f"  loaded in {layout_result['load_seconds']:.1f}s, indexed in {layout_result['index_seconds']:.1f}s, "
+                      f"{layout_result['total_mb']:,.0f} MB ({layout_result['index_mb']:,.0f} MB of indexes)")
+            layout_result['queries'] = time_queries(conn, layout, args.months, args.repeat)
+            results['layouts'][layout] = layout_result
+
+        print(f'\nMedian query latency at {args.rows:,} rows (ms):')
+        print(f"  {'query':<26}" + ''.join(f'{layout:>14}' for layout in args.layouts) + '   scans')
+        for name in QUERIES:
+            timings = [results['layouts'][layout]['queries'][name] for layout in args.layouts]
+            print(f'  {name:<26}' + ''.join(f"{timing['median_ms']:>14.2f}" for timing in timings)
+                  + '   ' + ' / '.join(timing['scans'] for timing in timings))
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nLoad test results saved to {args.output}')
+    finally:
+        if not args.keep:
+            with conn.cursor() as cur:
+                for layout in args.layouts:
+                    cur.execute(f"DROP SCHEMA IF EXISTS load_test_{layout} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
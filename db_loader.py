@@ -0,0 +1,1017 @@
+import io
+import json
+import math
+import hashlib
+import time
+import struct
+import datetime
+import threading
+from contextlib import contextmanager
+
+from psycopg2 import errors, pool
+from psycopg2.extras import execute_values
+
+# Columns of the logs table filled from analysis results, in COPY order
+LOG_COLUMNS = ('user_id', 'device_name', 'device_mac', 'device_ip', 'log', 'status', 'confidence', 'time',
+               'template_id', 'template_params', 'fingerprint')
+
+# Result fields hashed into a row fingerprint
+FINGERPRINT_FIELDS = ('log', 'device_name', 'device_mac', 'device_ip', 'time')
+
+# Formats tried after ISO 8601 when parsing a log time; like PostgreSQL's default DateStyle, the month comes first
+TIME_FORMATS = ('%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M:%S.%f', '%m/%d/%Y %H:%M', '%m/%d/%Y',
+                '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M:%S.%f', '%Y/%m/%d',
+                '%b %d %Y %H:%M:%S', '%b %d %H:%M:%S %Y', '%d/%b/%Y:%H:%M:%S %z', '%d/%b/%Y:%H:%M:%S')
+
+# Labels of the log_status enum; the capitalized ones are the spellings the web app's test data uses
+STATUS_VALUES = ('normal', 'anomaly', 'non-anomaly', 'unknown', 'Normal', 'Anomaly')
+
+STATUS_TYPE_SQL = f"""
+    DO $$ BEGIN
+        CREATE TYPE log_status AS ENUM ({', '.join(f"'{value}'" for value in STATUS_VALUES)});
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$;
+"""
+
+# Logs table, range-partitioned by month on time; rows without a time go to the default partition
+LOGS_TABLE_SQL = """
+    CREATE TABLE logs (
+        {id_column} BIGSERIAL,
+        user_id INTEGER NOT NULL,
+        device_name VARCHAR(255),
+        device_mac VARCHAR(255),
+        device_ip VARCHAR(255),
+        log TEXT,
+        status log_status,
+        confidence DOUBLE PRECISION,
+        time TIMESTAMP,
+        template_id INTEGER,
+        template_params TEXT,
+        fingerprint CHAR(64)
+    ) PARTITION BY RANGE (time);
+    CREATE TABLE logs_default PARTITION OF logs DEFAULT;
+"""
+
+# Indexes of the partitioned logs table, created on every partition. Unique
+# indexes of a partitioned table must include the partition key. For rows with
+# a time, which the fingerprint already hashes, (fingerprint, time) is as
+# selective as fingerprint. Rows without a time never conflict on it, since
+# NULLs are distinct; BulkLoader matches those on the fingerprint alone.
+# (NULLS NOT DISTINCT is not used: rows the web app inserts have no
+# fingerprint and would then collide whenever their times are equal.)
+LOGS_INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS logs_{id_column}_idx ON logs ({id_column});
+    CREATE UNIQUE INDEX IF NOT EXISTS logs_fingerprint_time_key ON logs (fingerprint, time);
+    CREATE INDEX IF NOT EXISTS logs_user_time_idx ON logs (user_id, time);
+    CREATE INDEX IF NOT EXISTS logs_device_time_idx ON logs (device_name, time);
+    CREATE INDEX IF NOT EXISTS logs_anomaly_time_idx ON logs (time) WHERE status = 'anomaly';
+"""
+
+# Months after the current one whose partitions are created ahead of time
+PARTITION_MONTHS_AHEAD = 2
+
+# Adds the mined template columns to tables created before they existed
+TEMPLATE_COLUMNS_SQL = """
+    ALTER TABLE logs ADD COLUMN IF NOT EXISTS template_id INTEGER;
+    ALTER TABLE logs ADD COLUMN IF NOT EXISTS template_params TEXT;
+"""
+
+# Adds the confidence column to tables created before it existed
+CONFIDENCE_COLUMN_SQL = "ALTER TABLE logs ADD COLUMN IF NOT EXISTS confidence DOUBLE PRECISION;"
+
+# Adds the fingerprint column and its unique index to unpartitioned tables created before it existed
+FINGERPRINT_SQL = """
+    ALTER TABLE logs ADD COLUMN IF NOT EXISTS fingerprint CHAR(64);
+    CREATE UNIQUE INDEX IF NOT EXISTS logs_fingerprint_key ON logs (fingerprint);
+"""
+
+# Serializes upserts of rows without a time, which the unique index can't deduplicate
+NULL_TIME_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('logs_null_time_upsert'))"
+
+# Update the stored rows without a time that match staged ones, then drop those from the staging table
+UPDATE_NULL_TIME_SQL = """
+    UPDATE logs l SET status = s.status, confidence = s.confidence
+    FROM logs_staging s
+    WHERE s.time IS NULL AND l.time IS NULL AND l.fingerprint = s.fingerprint
+      AND l.status IS DISTINCT FROM s.status
+"""
+DROP_STORED_NULL_TIME_SQL = """
+    DELETE FROM logs_staging s USING logs l
+    WHERE s.time IS NULL AND l.time IS NULL AND l.fingerprint = s.fingerprint
+"""
+
+# Per-connection staging table for upserts; emptied at every commit
+STAGING_TABLE_SQL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS logs_staging ON COMMIT DELETE ROWS AS
+    SELECT {', '.join(LOG_COLUMNS)} FROM logs WITH NO DATA;
+"""
+
+# Rollup granularities; every row is counted once per granularity
+ROLLUP_GRANULARITIES = ('hour', 'day')
+
+# Number of equal-width confidence histogram bins between 0 and 1
+CONFIDENCE_BINS = 10
+
+# Pre-aggregated counts kept up to date by BulkLoader in the transaction that
+# writes the rows, so dashboards read O(buckets) rows instead of scanning logs.
+# Rows without a time are not counted; a missing device name is stored as ''.
+ROLLUP_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS log_status_rollups (
+        granularity VARCHAR(4) NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        user_id INTEGER NOT NULL,
+        device_name VARCHAR(255) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        count BIGINT NOT NULL,
+        PRIMARY KEY (granularity, bucket, user_id, device_name, status)
+    );
+    CREATE TABLE IF NOT EXISTS log_confidence_rollups (
+        granularity VARCHAR(4) NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        device_name VARCHAR(255) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        confidence_bin SMALLINT NOT NULL,
+        count BIGINT NOT NULL,
+        PRIMARY KEY (granularity, bucket, device_name, status, confidence_bin)
+    );
+    CREATE INDEX IF NOT EXISTS log_status_rollups_device_idx ON log_status_rollups (granularity, device_name, bucket);
+    CREATE INDEX IF NOT EXISTS log_status_rollups_user_idx ON log_status_rollups (granularity, user_id, bucket);
+"""
+
+# Per-connection count changes of the current transaction, at hour granularity
+ROLLUP_DELTA_TABLE_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS rollup_delta (
+        hour TIMESTAMP,
+        user_id INTEGER,
+        device_name VARCHAR(255),
+        status VARCHAR(50),
+        confidence_bin SMALLINT,
+        delta BIGINT
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# SQL expressions computing the rollup keys of a logs row; they match _rollup_key
+_HOUR_SQL = "date_trunc('hour', {table}time)"
+_CONFIDENCE_BIN_SQL = (f"CASE WHEN {{table}}confidence IS NOT NULL THEN "  # LEAST and GREATEST skip NULLs
+                       f"GREATEST(LEAST(FLOOR({{table}}confidence * {CONFIDENCE_BINS}), {CONFIDENCE_BINS - 1}), 0) END::smallint")
+_ROLLUP_KEY_SQL = (f"{_HOUR_SQL}, {{table}}user_id, {{table}}device_name, {{table}}status::text, {_CONFIDENCE_BIN_SQL}")
+
+# Fold the pending count changes into both rollup tables, in key order to avoid deadlocks between loaders
+FOLD_ROLLUPS_SQL = f"""
+    INSERT INTO log_status_rollups AS r (granularity, bucket, user_id, device_name, status, count)
+    SELECT g.granularity, date_trunc(g.granularity, d.hour), d.user_id, COALESCE(d.device_name, ''),
+           COALESCE(d.status, 'unknown'), SUM(d.delta)
+    FROM rollup_delta d CROSS JOIN (VALUES {', '.join(f"('{granularity}')" for granularity in ROLLUP_GRANULARITIES)}) AS g (granularity)
+    WHERE d.hour IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5 HAVING SUM(d.delta) <> 0 ORDER BY 1, 2, 3, 4, 5
+    ON CONFLICT (granularity, bucket, user_id, device_name, status) DO UPDATE SET count = r.count + EXCLUDED.count;
+
+    INSERT INTO log_confidence_rollups AS r (granularity, bucket, device_name, status, confidence_bin, count)
+    SELECT g.granularity, date_trunc(g.granularity, d.hour), COALESCE(d.device_name, ''),
+           COALESCE(d.status, 'unknown'), d.confidence_bin, SUM(d.delta)
+    FROM rollup_delta d CROSS JOIN (VALUES {', '.join(f"('{granularity}')" for granularity in ROLLUP_GRANULARITIES)}) AS g (granularity)
+    WHERE d.hour IS NOT NULL AND d.confidence_bin IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5 HAVING SUM(d.delta) <> 0 ORDER BY 1, 2, 3, 4, 5
+    ON CONFLICT (granularity, bucket, device_name, status, confidence_bin) DO UPDATE SET count = r.count + EXCLUDED.count;
+"""
+
+# Connection pools, schema checks and known partitions are shared by every loader in the process
+_connection_pools = {}
+_schema_checked = {}
+_known_partitions = {}
+_lock = threading.Lock()
+
+# PostgreSQL binary COPY framing
+_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_BINARY_TRAILER = struct.pack('!h', -1)
+_POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def _config_key(db_config):
+    """
+    Build a hashable key identifying a database configuration
+    """
+    return tuple(sorted((k, str(v)) for k, v in db_config.items()))
+
+
+def get_connection_pool(db_config, max_connections=4):
+    """
+    Get the process-wide connection pool for a database configuration
+
+    Args:
+        db_config: Database configuration dictionary
+        max_connections: Maximum number of open connections in a new pool
+
+    Returns:
+        A psycopg2 ThreadedConnectionPool
+    """
+    key = _config_key(db_config)
+    with _lock:
+        if key not in _connection_pools:
+            _connection_pools[key] = pool.ThreadedConnectionPool(1, max_connections, **db_config)
+        return _connection_pools[key]
+
+
+@contextmanager
+def pooled_connection(db_config):
+    """
+    Borrow a connection from the pool, rolling back on errors
+
+    Args:
+        db_config: Database configuration dictionary
+
+    Yields:
+        An open psycopg2 connection
+    """
+    connection_pool = get_connection_pool(db_config)
+    conn = connection_pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_connection_pools():
+    """
+    Close every connection pool opened by this process
+    """
+    with _lock:
+        for connection_pool in _connection_pools.values():
+            connection_pool.closeall()
+        _connection_pools.clear()
+        _schema_checked.clear()
+        _known_partitions.clear()
+
+
+def _add_months(year, month, months):
+    """
+    Get the (year, month) a number of months after another
+    """
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def parse_time(value):
+    """
+    Parse a log time the way it is stored in the timestamp column
+
+    Args:
+        value: datetime, ISO 8601 text or text in one of TIME_FORMATS
+
+    Returns:
+        Naive datetime (any UTC offset is dropped, as the column has no time zone),
+        or None if the value is missing or can't be parsed
+    """
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    elif isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    elif _is_null(value):
+        return None
+    else:
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            parsed = _parse_time_formats(str(value).strip())
+            if parsed is None:
+                return None
+    return parsed if parsed.tzinfo is None else parsed.replace(tzinfo=None)
+
+
+def _parse_time_formats(text):
+    """
+    Parse a time in ISO 8601 with surrounding spaces or in one of TIME_FORMATS, or return None
+    """
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _month_of(value):
+    """
+    Get the (year, month) of a timestamp value, or None if it has none or can't be parsed
+    """
+    parsed = parse_time(value)
+    if parsed is None:
+        return None
+    return parsed.year, parsed.month
+
+
+def partition_name(year, month):
+    """
+    Get the name of the logs partition holding a month, e.g. logs_p2025_06
+    """
+    return f'logs_p{year:04d}_{month:02d}'
+
+
+def create_month_partition(cur, year, month):
+    """
+    Create the partition of the logs table for one month if it does not exist
+
+    Rows of that month that were stored before the partition existed sit in
+    the default partition; they are moved into the new partition, which is
+    then attached.
+
+    Args:
+        cur: Cursor on an open connection; the caller commits
+        year: Year of the month
+        month: Month number (1-12)
+
+    Returns:
+        True if the partition was created, False if it already existed
+    """
+    name = partition_name(year, month)
+    start = datetime.date(year, month, 1)
+    end = datetime.date(*_add_months(year, month, 1), 1)
+
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return False
+
+    cur.execute("SAVEPOINT create_partition")
+    try:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF logs FOR VALUES FROM (%s) TO (%s)", (start, end))
+    except errors.DuplicateTable:
+        # Another process created it first
+        cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+        return False
+    except errors.CheckViolation:
+        cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+        cur.execute(f"CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS)")
+        cur.execute(
+            f"WITH moved AS (DELETE FROM logs_default WHERE time >= %s AND time < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            (start, end)
+        )
+        cur.execute(f"ALTER TABLE logs ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+    cur.execute("RELEASE SAVEPOINT create_partition")
+    return True
+
+
+def create_partitioned_logs_table(cur, id_column='id', months=(), indexes=True):
+    """
+    Create the status type and the partitioned logs table with its partitions and indexes
+
+    Args:
+        cur: Cursor on an open connection; the caller commits
+        id_column: Name of the row id column ('log_id' in tables created by the web app)
+        months: Iterable of (year, month) pairs to create partitions for, besides
+                the current month and the next PARTITION_MONTHS_AHEAD
+        indexes: Whether to create the indexes (bulk loads create them afterwards)
+    """
+    cur.execute(STATUS_TYPE_SQL)
+    cur.execute(LOGS_TABLE_SQL.format(id_column=id_column))
+    today = datetime.date.today()
+    upcoming = {_add_months(today.year, today.month, ahead) for ahead in range(PARTITION_MONTHS_AHEAD + 1)}
+    for year, month in sorted(set(months) | upcoming):
+        create_month_partition(cur, year, month)
+    if indexes:
+        cur.execute(LOGS_INDEXES_SQL.format(id_column=id_column))
+
+
+def _logs_table_kind(cur):
+    """
+    Get the relkind of the logs table: 'p' if partitioned, 'r' if a plain table, None if missing
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def ensure_logs_table(db_config):
+    """
+    Create the logs table and its indexes if needed, checking the database only once per process
+
+    New tables are partitioned by month. Unpartitioned tables from earlier
+    versions keep working (with their fingerprint column and index added)
+    until they are migrated with migrate_logs_table.
+
+    Args:
+        db_config: Database configuration dictionary
+
+    Returns:
+        True if the logs table is partitioned, False otherwise
+    """
+    key = _config_key(db_config)
+    if key in _schema_checked:
+        return _schema_checked[key]
+
+    with pooled_connection(db_config) as conn:
+        with conn.cursor() as cur:
+            table_kind = _logs_table_kind(cur)
+
+            if table_kind is None:
+                print("Logs table does not exist. Creating it...")
+                create_partitioned_logs_table(cur)
+                print("Logs table created successfully (partitioned by month).")
+            elif table_kind == 'p':
+                today = datetime.date.today()
+                for ahead in range(PARTITION_MONTHS_AHEAD + 1):
+                    create_month_partition(cur, *_add_months(today.year, today.month, ahead))
+            else:
+                cur.execute(FINGERPRINT_SQL)
+                print("The logs table is not partitioned; run 'python db_loader.py --migrate' "
+                      "to add monthly partitions and the dashboard indexes.")
+            cur.execute(TEMPLATE_COLUMNS_SQL)
+            cur.execute(CONFIDENCE_COLUMN_SQL)
+            ensure_rollup_tables(cur)
+        conn.commit()
+
+    _schema_checked[key] = table_kind != 'r'
+    return _schema_checked[key]
+
+
+def rebuild_rollups(cur):
+    """
+    Recompute both rollup tables from the logs table
+
+    Args:
+        cur: Cursor on an open connection; the caller commits
+
+    Returns:
+        Number of log rows counted
+    """
+    cur.execute(ROLLUP_DELTA_TABLE_SQL)
+    cur.execute("TRUNCATE log_status_rollups, log_confidence_rollups")
+    cur.execute(f"INSERT INTO rollup_delta SELECT {_ROLLUP_KEY_SQL.format(table='')}, COUNT(*) "
+                "FROM logs WHERE time IS NOT NULL GROUP BY 1, 2, 3, 4, 5")
+    cur.execute("SELECT COALESCE(SUM(delta), 0) FROM rollup_delta")
+    counted = int(cur.fetchone()[0])
+    cur.execute(FOLD_ROLLUPS_SQL)
+    cur.execute("DELETE FROM rollup_delta")
+    return counted
+
+
+def ensure_rollup_tables(cur):
+    """
+    Create the rollup tables if needed, filling them from the rows already stored
+
+    Args:
+        cur: Cursor on an open connection; the caller commits
+    """
+    cur.execute("SELECT to_regclass('log_status_rollups') IS NULL OR to_regclass('log_confidence_rollups') IS NULL")
+    if not cur.fetchone()[0]:
+        return
+    cur.execute(ROLLUP_TABLES_SQL)
+    counted = rebuild_rollups(cur)
+    if counted:
+        print(f"Created the rollup tables from {counted:,} stored log rows.")
+
+
+def _rollup_key(row, time_index, status_index, confidence_index):
+    """
+    Get the hour bucket, user, device, status and confidence bin a row is counted under
+
+    Matches _ROLLUP_KEY_SQL, so counts added here and removed in SQL cancel out.
+    Returns None if parse_time can't parse the time; PostgreSQL may still
+    accept it, so those rows are counted in SQL once they are stored.
+    """
+    value = row[time_index]
+    if value is None:
+        hour = None
+    else:
+        value = parse_time(value)
+        if value is None:
+            return None
+        hour = value.replace(minute=0, second=0, microsecond=0)
+    confidence = row[confidence_index]
+    if confidence is not None:
+        confidence = max(min(math.floor(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1), 0)
+    return hour, row[0], row[1], row[status_index], confidence
+
+
+def ensure_partitions(db_config, conn, cur, times):
+    """
+    Create the monthly partitions a batch of timestamps needs, committing them
+
+    Args:
+        db_config: Database configuration dictionary the connection belongs to
+        conn: Open database connection
+        cur: Cursor on the connection
+        times: Iterable of timestamp values (datetimes or strings parse_time can read)
+    """
+    known = _known_partitions.setdefault(_config_key(db_config), set())
+    months = {_month_of(value) for value in times}
+    months.discard(None)
+    missing = months - known
+    if not missing:
+        return
+    for year, month in sorted(missing):
+        create_month_partition(cur, year, month)
+    conn.commit()
+    known.update(missing)
+
+
+def migrate_logs_table(db_config, keep_old_table=False):
+    """
+    Rebuild an unpartitioned logs table as a monthly-partitioned one
+
+    Every row is copied in a single transaction, with its status converted
+    to the log_status enum (unrecognized values become 'unknown') and a
+    missing user_id set to 1. The id column name and values and the default
+    of the time column are kept, and the id sequence continues after the
+    largest id. The old table is dropped unless keep_old_table is set, in
+    which case it is left as logs_unpartitioned. Foreign keys of the old
+    table are not recreated.
+
+    Args:
+        db_config: Database configuration dictionary
+        keep_old_table: Whether to keep the old table as logs_unpartitioned
+
+    Returns:
+        Number of rows migrated, or None if there was nothing to migrate
+    """
+    with pooled_connection(db_config) as conn:
+        with conn.cursor() as cur:
+            table_kind = _logs_table_kind(cur)
+            if table_kind != 'r':
+                print("The logs table is already partitioned." if table_kind else "There is no logs table to migrate.")
+                return None
+
+            start = time.perf_counter()
+            cur.execute("LOCK TABLE logs IN ACCESS EXCLUSIVE MODE")
+            cur.execute("ALTER TABLE logs ADD COLUMN IF NOT EXISTS fingerprint CHAR(64)")
+            cur.execute(TEMPLATE_COLUMNS_SQL)
+            cur.execute(CONFIDENCE_COLUMN_SQL)
+            cur.execute("SELECT column_name, column_default FROM information_schema.columns "
+                        "WHERE table_name = 'logs' AND table_schema = current_schema()")
+            old_defaults = dict(cur.fetchall())
+            old_columns = set(old_defaults)
+            id_column = 'log_id' if 'log_id' in old_columns and 'id' not in old_columns else 'id'
+
+            cur.execute("ALTER TABLE logs RENAME TO logs_unpartitioned")
+            old_sequence = None
+            if id_column in old_columns:
+                cur.execute("SELECT pg_get_serial_sequence('logs_unpartitioned', %s)", (id_column,))
+                old_sequence = cur.fetchone()[0]
+            if old_sequence:
+                cur.execute(f"ALTER SEQUENCE {old_sequence} RENAME TO logs_unpartitioned_{id_column}_seq")
+
+            cur.execute("SELECT DISTINCT EXTRACT(YEAR FROM time)::int, EXTRACT(MONTH FROM time)::int "
+                        "FROM logs_unpartitioned WHERE time IS NOT NULL")
+            months = cur.fetchall()
+            # Build the indexes after copying the rows, which is much faster than maintaining them row by row
+            create_partitioned_logs_table(cur, id_column, months, indexes=False)
+            if old_defaults.get('time'):
+                # e.g. CURRENT_TIMESTAMP in tables created by the web app
+                cur.execute(f"ALTER TABLE logs ALTER COLUMN time SET DEFAULT {old_defaults['time']}")
+
+            labels = ', '.join(f"'{value}'" for value in STATUS_VALUES)
+            status_sql = (
+                f"CASE WHEN status IN ({labels}) THEN status::log_status "
+                f"WHEN lower(status) IN ({labels}) THEN lower(status)::log_status "
+                "ELSE 'unknown'::log_status END"
+            )
+            copied_columns = [column for column in LOG_COLUMNS if column not in ('user_id', 'status')]
+            source_id = [id_column] if id_column in old_columns else []
+            cur.execute(
+                f"INSERT INTO logs ({', '.join(source_id + ['user_id', 'status'] + copied_columns)}) "
+                f"SELECT {', '.join(source_id + ['COALESCE(user_id, 1)', status_sql] + copied_columns)} "
+                "FROM logs_unpartitioned"
+            )
+            migrated = cur.rowcount
+            cur.execute(LOGS_INDEXES_SQL.format(id_column=id_column))
+            # Statuses may have been converted, so count the rows again
+            cur.execute(ROLLUP_TABLES_SQL)
+            rebuild_rollups(cur)
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('logs', %s), COALESCE(MAX({id_column}), 0) + 1, false) "
+                        "FROM logs", (id_column,))
+            if not keep_old_table:
+                cur.execute("DROP TABLE logs_unpartitioned")
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE logs")
+        conn.commit()
+
+    _schema_checked.pop(_config_key(db_config), None)
+    print(f"Migrated {migrated:,} rows into the partitioned logs table in {time.perf_counter() - start:.1f}s")
+    return migrated
+
+
+def _is_null(value):
+    """
+    Check whether a result value should be stored as NULL (None or NaN)
+    """
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _column_value(column, value):
+    """
+    Convert a result value for storage: NULL for missing values, JSON text for lists such as template parameters
+    """
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    if _is_null(value):
+        return None
+    if column == 'status' and value not in STATUS_VALUES:
+        # The status column is an enum; map other spellings onto its labels
+        value = str(value).lower()
+        return value if value in STATUS_VALUES else 'unknown'
+    if column == 'confidence':
+        return float(value)
+    return int(value) if column == 'template_id' else value
+
+
+def row_fingerprint(log, device_name=None, device_mac=None, device_ip=None, time=None, position=None):
+    """
+    Compute the hash that identifies a log row across runs
+
+    The same line can legitimately repeat with the same device and time (e.g.
+    two timeouts within a second), so the row's position in its source is
+    hashed too: identical lines are stored once each, and reading the same
+    source again gives the same fingerprints.
+
+    Args:
+        log: Log text
+        device_name: Device name
+        device_mac: Device MAC address
+        device_ip: Device IP address
+        time: Log timestamp
+        position: Where the row was read from, e.g. its CSV row number (optional)
+
+    Returns:
+        Hex SHA-256 digest of the log text, device, time and position
+    """
+    parts = ['' if _is_null(value) else str(value) for value in (log, device_name, device_mac, device_ip, time)]
+    if position is not None:
+        parts.append(str(position))
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def existing_fingerprints(db_config, fingerprints, chunk_size=10000):
+    """
+    Find which fingerprints are already stored in the logs table
+
+    Args:
+        db_config: Database configuration dictionary
+        fingerprints: List of fingerprints to look up
+        chunk_size: Number of fingerprints per query
+
+    Returns:
+        Set of the fingerprints that are already stored
+    """
+    ensure_logs_table(db_config)
+
+    existing = set()
+    with pooled_connection(db_config) as conn:
+        with conn.cursor() as cur:
+            for start in range(0, len(fingerprints), chunk_size):
+                cur.execute("SELECT fingerprint FROM logs WHERE fingerprint = ANY(%s)",
+                            (list(fingerprints[start:start + chunk_size]),))
+                existing.update(row[0] for row in cur.fetchall())
+        conn.commit()
+    return existing
+
+
+def result_to_row(result, position=None):
+    """
+    Extract the logs table columns from an analysis result
+
+    Args:
+        result: Result dictionary
+        position: Position hashed into the fingerprint if the result has none,
+                  normally the result's index in the list being saved
+
+    Returns:
+        Tuple of values in LOG_COLUMNS order, with missing values as None
+    """
+    user_id = result.get('user_id')
+    row = [1 if _is_null(user_id) else int(user_id)]  # Default to user_id 1 if not provided
+    for column in LOG_COLUMNS[1:-1]:
+        row.append(_column_value(column, result.get(column)))
+    row.append(result.get('fingerprint')
+               or row_fingerprint(*(result.get(field) for field in FINGERPRINT_FIELDS), position=position))
+    return tuple(row)
+
+
+def frame_to_rows(frame):
+    """
+    Extract the logs table columns from a DataFrame of analysis results
+
+    The columns are converted one at a time rather than row by row, giving
+    the same tuples as result_to_row. Rows without a fingerprint are
+    fingerprinted with their index label as position, which for frames read
+    with pandas.read_csv, in chunks or not, is the CSV row number.
+
+    Args:
+        frame: DataFrame from LogAnalyzerTool.analyze_frame
+
+    Returns:
+        List of tuples in LOG_COLUMNS order, with missing values as None
+    """
+    num_rows = len(frame)
+
+    def column_values(name):
+        if name not in frame.columns:
+            return [None] * num_rows
+        return [_column_value(name, value) for value in frame[name].tolist()]
+
+    columns = [[1 if value is None else int(value) for value in column_values('user_id')]]  # Default to user_id 1
+    columns.extend(column_values(column) for column in LOG_COLUMNS[1:-1])
+
+    fields = [column_values(field) for field in FINGERPRINT_FIELDS]
+    fingerprints = column_values('fingerprint')
+    columns.append([fingerprint or row_fingerprint(*values, position=position)
+                    for fingerprint, values, position in zip(fingerprints, zip(*fields), frame.index.tolist())])
+    return list(zip(*columns))
+
+
+def _csv_field(value):
+    """
+    Encode one value for CSV COPY: NULL is an unquoted empty field, everything else is quoted
+    """
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def encode_csv(rows):
+    """
+    Encode rows as a CSV COPY payload
+
+    Args:
+        rows: Iterable of tuples in LOG_COLUMNS order
+
+    Returns:
+        A file-like object to pass to COPY FROM STDIN
+    """
+    payload = ''.join(','.join(_csv_field(value) for value in row) + '\n' for row in rows)
+    return io.StringIO(payload)
+
+
+def _binary_timestamp(value):
+    """
+    Encode a timestamp as microseconds since 2000-01-01, or as NULL if it can't be parsed
+    """
+    value = parse_time(value)
+    if value is None:
+        return struct.pack('!i', -1)
+    delta = value - _POSTGRES_EPOCH
+    return struct.pack('!iq', 8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def encode_binary(rows):
+    """
+    Encode rows as a binary COPY payload
+
+    Args:
+        rows: Iterable of tuples in LOG_COLUMNS order
+
+    Returns:
+        A file-like object to pass to COPY FROM STDIN
+    """
+    buffer = io.BytesIO()
+    buffer.write(_BINARY_HEADER)
+    field_count = struct.pack('!h', len(LOG_COLUMNS))
+
+    time_index = LOG_COLUMNS.index('time')
+    template_index = LOG_COLUMNS.index('template_id')
+    confidence_index = LOG_COLUMNS.index('confidence')
+
+    for row in rows:
+        buffer.write(field_count)
+        buffer.write(struct.pack('!ii', 4, row[0]))
+        for index, value in enumerate(row[1:], 1):
+            if value is None:
+                buffer.write(struct.pack('!i', -1))
+            elif index == time_index:
+                buffer.write(_binary_timestamp(value))
+            elif index == template_index:
+                buffer.write(struct.pack('!ii', 4, int(value)))
+            elif index == confidence_index:
+                buffer.write(struct.pack('!id', 8, value))
+            else:
+                data = str(value).encode('utf-8')
+                buffer.write(struct.pack('!i', len(data)))
+                buffer.write(data)
+
+    buffer.write(_BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+class BulkLoader:
+    """
+    Load analysis results into the logs table with COPY FROM STDIN
+
+    Rows are streamed in batches, each committed in its own transaction, over
+    a connection borrowed from the process-wide pool. In upsert mode each batch
+    is copied into a temporary staging table and merged with
+    INSERT ... ON CONFLICT on the row fingerprint, so rows that are already
+    stored only have their status updated instead of being duplicated. On a
+    partitioned logs table the monthly partitions a batch needs are created
+    before it is copied, and the conflict target is (fingerprint, time). Rows
+    without a time can't conflict on that, so they are matched on their
+    fingerprint before the merge, under an advisory lock that keeps two
+    loaders from inserting the same row.
+
+    Each batch also updates the rollup tables in its own transaction: the
+    counts of the rows it inserts are added, and in upsert mode the counts
+    of rows whose status changes move from the old status to the new one.
+    """
+
+    def __init__(self, db_config, batch_size=50000, copy_format='csv', upsert=False):
+        """
+        Initialize the bulk loader
+
+        Args:
+            db_config: Database configuration dictionary
+            batch_size: Number of rows per COPY and commit
+            copy_format: COPY framing, 'csv' or 'binary'
+            upsert: Whether to merge rows on their fingerprint instead of inserting them
+        """
+        if copy_format not in ('csv', 'binary'):
+            raise ValueError("copy_format must be 'csv' or 'binary'")
+
+        self.db_config = db_config
+        self.batch_size = max(1, int(batch_size))
+        self.copy_format = copy_format
+        self.upsert = upsert
+        self.partitioned = False
+
+    def load(self, results):
+        """
+        Insert analysis results into the logs table
+
+        Args:
+            results: Iterable of result dictionaries, or a DataFrame from LogAnalyzerTool.analyze_frame
+
+        Returns:
+            Number of records inserted
+        """
+        if hasattr(results, 'columns'):
+            rows = frame_to_rows(results)
+        else:
+            rows = (result_to_row(result, position) for position, result in enumerate(results))
+        return self.load_rows(rows)
+
+    def load_rows(self, rows):
+        """
+        Insert rows already converted with result_to_row or frame_to_rows into the logs table
+
+        Args:
+            rows: Iterable of tuples in LOG_COLUMNS order
+
+        Returns:
+            Number of records inserted
+        """
+        self.partitioned = ensure_logs_table(self.db_config)
+
+        start = time.perf_counter()
+        inserted = 0
+        seen = set()
+
+        with pooled_connection(self.db_config) as conn:
+            with conn.cursor() as cur:
+                cur.execute(ROLLUP_DELTA_TABLE_SQL)
+                if self.upsert:
+                    cur.execute(STAGING_TABLE_SQL)
+
+                batch = []
+                for row in rows:
+                    if self.upsert:
+                        # A single INSERT ... ON CONFLICT can't touch the same row twice
+                        if row[-1] in seen:
+                            continue
+                        seen.add(row[-1])
+                    batch.append(row)
+                    if len(batch) >= self.batch_size:
+                        inserted += self._copy_batch(conn, cur, batch)
+                        batch = []
+                if batch:
+                    inserted += self._copy_batch(conn, cur, batch)
+
+        elapsed = time.perf_counter() - start
+        rate = inserted / elapsed if elapsed > 0 else 0.0
+        action = 'Upserted' if self.upsert else 'Inserted'
+        print(f'{action} {inserted} records into the database in {elapsed:.2f}s ({rate:,.0f} rows/sec)')
+        return inserted
+
+    def _copy_batch(self, conn, cur, rows):
+        """
+        COPY one batch of rows and commit it
+
+        Args:
+            conn: Open database connection
+            cur: Cursor on the connection
+            rows: List of tuples in LOG_COLUMNS order
+
+        Returns:
+            Number of rows copied, or in upsert mode the number of rows inserted or updated
+        """
+        time_index = LOG_COLUMNS.index('time')
+        if self.partitioned:
+            ensure_partitions(self.db_config, conn, cur, (row[time_index] for row in rows))
+
+        columns = ', '.join(LOG_COLUMNS)
+        table = 'logs_staging' if self.upsert else 'logs'
+        if self.copy_format == 'binary':
+            payload = encode_binary(rows)
+            cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)", payload)
+        else:
+            payload = encode_csv(rows)
+            cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", payload)
+
+        written = len(rows)
+        if self.upsert:
+            # Unique indexes of the partitioned table include the partition key
+            conflict_columns = ('fingerprint', 'time') if self.partitioned else ('fingerprint',)
+            if self.partitioned and any(parse_time(row[time_index]) is None for row in rows):
+                # NULL times, including ones binary COPY can't parse, never conflict in the
+                # unique index, so merge those rows here. They are not in the rollups, so no counts change.
+                cur.execute(NULL_TIME_LOCK_SQL)
+                cur.execute(UPDATE_NULL_TIME_SQL)
+                updated_without_time = cur.rowcount
+                cur.execute(DROP_STORED_NULL_TIME_SQL)
+            else:
+                updated_without_time = 0
+            # Take the rows about to change status out of their old rollup counts
+            cur.execute(
+                f"INSERT INTO rollup_delta SELECT {_ROLLUP_KEY_SQL.format(table='l.')}, -1 "
+                "FROM logs l JOIN logs_staging s ON "
+                + ' AND '.join(f'l.{column} = s.{column}' for column in conflict_columns)
+                + " WHERE l.status IS DISTINCT FROM s.status"
+            )
+            cur.execute(
+                f"WITH merged AS (INSERT INTO logs ({columns}) SELECT {columns} FROM logs_staging "
+                f"ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET status = EXCLUDED.status, "
+                "confidence = EXCLUDED.confidence WHERE logs.status IS DISTINCT FROM EXCLUDED.status "
+                f"RETURNING time, user_id, device_name, status, confidence) "
+                f"INSERT INTO rollup_delta SELECT {_ROLLUP_KEY_SQL.format(table='')}, 1 FROM merged"
+            )
+            written = cur.rowcount + updated_without_time
+        else:
+            counts = {}
+            unparsed = []
+            status_index = LOG_COLUMNS.index('status')
+            confidence_index, fingerprint_index = LOG_COLUMNS.index('confidence'), LOG_COLUMNS.index('fingerprint')
+            for row in rows:
+                key = _rollup_key(row, time_index, status_index, confidence_index)
+                if key is None:
+                    unparsed.append(row[fingerprint_index])
+                else:
+                    counts[key] = counts.get(key, 0) + 1
+            if counts:
+                execute_values(cur, "INSERT INTO rollup_delta VALUES %s",
+                               [key + (count,) for key, count in counts.items()])
+            if unparsed:
+                # Count rows whose time only PostgreSQL could parse from the stored values
+                cur.execute(
+                    f"INSERT INTO rollup_delta SELECT {_ROLLUP_KEY_SQL.format(table='')}, 1 "
+                    "FROM logs WHERE fingerprint = ANY(%s)",
+                    (unparsed,)
+                )
+        cur.execute(FOLD_ROLLUPS_SQL)
+        conn.commit()
+        return written
+
+
+def main():
+    """
+    Migrate the logs table or rebuild its rollups from the command line
+    """
+    import os
+    import argparse
+    parser = argparse.ArgumentParser(description='Manage the logs table schema')
+    parser.add_argument('--migrate', action='store_true', help='Rebuild an unpartitioned logs table as a monthly-partitioned one')
+    parser.add_argument('--keep-old-table', action='store_true', help='Keep the old table as logs_unpartitioned after migrating')
+    parser.add_argument('--rebuild-rollups', action='store_true', help='Recompute the rollup tables from the logs table, e.g. after rows were changed by other tools')
+
+    args = parser.parse_args()
+    if not args.migrate and not args.rebuild_rollups:
+        parser.print_help()
+        return
+
+    db_config = {
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': os.environ.get('DB_NAME', 'log_analyzer'),
+        'password': os.environ.get('DB_PASSWORD', 'logai'),
+        'port': os.environ.get('DB_PORT', 5432),
+    }
+    try:
+        if args.migrate:
+            migrate_logs_table(db_config, keep_old_table=args.keep_old_table)
+        if args.rebuild_rollups:
+            ensure_logs_table(db_config)
+            with pooled_connection(db_config) as conn:
+                with conn.cursor() as cur:
+                    counted = rebuild_rollups(cur)
+                conn.commit()
+            print(f"Rebuilt the rollup tables from {counted:,} log rows")
+    finally:
+        close_connection_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import traceback
+from collections import deque
+
+import psycopg2
+from psycopg2 import pool
+
+from db_loader import BulkLoader, frame_to_rows, result_to_row
+
+# Errors that mean the database can't be reached right now, as opposed to rows it refuses
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+
+# Subdirectory of the spool directory for batches the database rejected
+REJECTED_DIR = 'rejected'
+
+_spool_sequence = 0
+_spool_lock = threading.Lock()
+
+
+def results_to_rows(results):
+    """
+    Convert analysis results to logs table rows
+
+    Args:
+        results: List of result dictionaries, or a DataFrame from LogAnalyzerTool.analyze_frame
+
+    Returns:
+        List of tuples in LOG_COLUMNS order
+    """
+    if hasattr(results, 'columns'):
+        return frame_to_rows(results)
+    return [result_to_row(result, position) for position, result in enumerate(results)]
+
+
+def spool_rows(spool_dir, rows, rejected=False):
+    """
+    Write a batch of rows to a new spool file, replacing it atomically and syncing it to disk
+
+    Args:
+        spool_dir: Spool directory
+        rows: List of tuples in LOG_COLUMNS order
+        rejected: Whether to put the file in the rejected subdirectory, which is not replayed
+
+    Returns:
+        Path of the spool file
+    """
+    global _spool_sequence
+    directory = os.path.join(spool_dir, REJECTED_DIR) if rejected else spool_dir
+    os.makedirs(directory, exist_ok=True)
+    with _spool_lock:
+        _spool_sequence += 1
+        # Names sort in the order the batches were spooled
+        name = f'{time.time_ns():020d}-{os.getpid()}-{_spool_sequence:06d}.jsonl'
+
+    path = os.path.join(directory, name)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+def read_spool_file(path):
+    """
+    Read the rows of a spool file
+
+    Args:
+        path: Path of the spool file
+
+    Returns:
+        List of tuples in LOG_COLUMNS order
+    """
+    with open(path, encoding='utf-8') as f:
+        return [tuple(json.loads(line)) for line in f if line.strip()]
+
+
+def list_spool_files(spool_dir):
+    """
+    List the spool files waiting to be replayed, oldest first
+
+    Args:
+        spool_dir: Spool directory
+
+    Returns:
+        List of paths
+    """
+    if not os.path.isdir(spool_dir):
+        return []
+    return [os.path.join(spool_dir, name) for name in sorted(os.listdir(spool_dir)) if name.endswith('.jsonl')]
+
+
+class DatabaseSink:
+    """
+    Save analysis results to the database from a background thread
+
+    put() queues a batch of results and returns at once, so the analysis
+    never waits on the database. The worker thread converts queued results
+    to rows and writes them with BulkLoader, one transaction per flush: a
+    flush happens when batch_size rows are waiting or the oldest waiting
+    row is flush_interval seconds old.
+
+    A write that fails because the database can't be reached is retried
+    with exponential backoff and jitter. After max_retries the batch is
+    written to a spool file on disk instead, and until the next retry time
+    further batches go straight to the spool. Spool files are replayed
+    oldest first, with upserts so a batch that was in fact committed isn't
+    duplicated, as soon as the database answers again, including by the
+    next sink started on the same spool directory. While spool files are
+    waiting new batches are spooled too, keeping the rows in order.
+    Batches the database refuses (e.g. invalid values) are moved to the
+    rejected subdirectory and reported instead of being retried forever.
+
+    put() only blocks when max_pending_rows rows are queued and the worker
+    hasn't caught up yet, which bounds the memory used by the queue.
+    """
+
+    def __init__(self, db_config, batch_size=50000, copy_format='csv', upsert=False, flush_interval=2.0,
+                 max_pending_rows=200000, spool_dir='db_spool', max_retries=3, initial_backoff=0.5,
+                 max_backoff=60.0, metrics=None):
+        """
+        Start the sink's worker thread
+
+        Args:
+            db_config: Database configuration dictionary
+            batch_size: Number of rows written per transaction
+            copy_format: COPY framing, 'csv' or 'binary'
+            upsert: Whether to merge rows on their fingerprint instead of inserting them
+            flush_interval: Longest time in seconds a queued row waits before it is written
+            max_pending_rows: Number of queued rows above which put() blocks
+            spool_dir: Directory for batches waiting for the database; use one per process
+            max_retries: Number of retries of a failed write before it is spooled
+            initial_backoff: Delay in seconds before the first retry; it doubles after every failure
+            max_backoff: Longest delay in seconds between attempts to reach the database
+            metrics: MetricsRegistry to record write times and counters in (optional)
+        """
+        self.db_config = db_config
+        self.batch_size = max(1, int(batch_size))
+        self.copy_format = copy_format
+        self.upsert = upsert
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max(1, int(max_pending_rows))
+        self.spool_dir = spool_dir
+        self.max_retries = max(0, int(max_retries))
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+
+        self.stats = {'queued': 0, 'written': 0, 'spooled': 0, 'replayed': 0, 'rejected': 0, 'retries': 0}
+
+        self._items = deque()
+        self._pending_rows = 0
+        self._closing = False
+        self._condition = threading.Condition()
+
+        # Consecutive failed attempts and the earliest time of the next one
+        self._failures = 0
+        self._next_attempt = 0.0
+
+        self._spool_files = list_spool_files(spool_dir)
+        if self._spool_files:
+            print(f'Found {len(self._spool_files)} spooled database batches in {spool_dir}; they will be replayed')
+
+        self._thread = threading.Thread(target=self._run, name='db-sink', daemon=True)
+        self._thread.start()
+
+    def put(self, results, timeout=None):
+        """
+        Queue analysis results to be saved
+
+        Args:
+            results: List of result dictionaries, or a DataFrame from LogAnalyzerTool.analyze_frame
+            timeout: Longest time in seconds to wait for room in the queue (default: no limit)
+
+        Returns:
+            Number of results queued
+
+        Raises:
+            RuntimeError: If the sink is closed
+            TimeoutError: If the queue stayed full for timeout seconds
+        """
+        count = len(results)
+        if not count:
+            return 0
+
+        start = time.perf_counter()
+        with self._condition:
+            if self._closing:
+                raise RuntimeError('The database sink is closed')
+            if not self._condition.wait_for(lambda: self._pending_rows < self.max_pending_rows or self._closing, timeout):
+                raise TimeoutError(f'The database sink queue stayed full for {timeout}s')
+            if self._closing:
+                raise RuntimeError('The database sink is closed')
+            self._items.append(results)
+            self._pending_rows += count
+            self.stats['queued'] += count
+            self._condition.notify_all()
+
+        if self.metrics is not None:
+            self.metrics.observe('db_sink_put_wait_seconds', time.perf_counter() - start)
+            self.metrics.increment('db_sink_queued_rows_total', count)
+        return count
+
+    def close(self, timeout=None):
+        """
+        Write or spool everything queued and stop the worker thread
+
+        Args:
+            timeout: Longest time in seconds to wait for the worker (default: no limit)
+
+        Returns:
+            Dictionary with the numbers of rows queued, written (including replayed ones),
+            spooled, replayed and rejected and of retries, plus the number of spool files
+            left for a later run
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+        stats = dict(self.stats, spool_files=len(self._spool_files))
+        print(f"Database sink closed: {stats['written']} rows written ({stats['replayed']} replayed from the spool), "
+              f"{stats['spooled']} spooled, {stats['rejected']} rejected")
+        if self._spool_files:
+            print(f'{len(self._spool_files)} batches are waiting in {self.spool_dir}; they are replayed by the next '
+                  f'run, or now with: python db_sink.py --spool-dir {self.spool_dir}')
+        return stats
+
+    def _online(self):
+        return time.monotonic() >= self._next_attempt
+
+    def _run(self):
+        """
+        Worker loop: gather queued results into batches, write them and replay the spool
+        """
+        rows = []
+        oldest = None
+        while True:
+            with self._condition:
+                while not self._items and not self._closing:
+                    if rows:
+                        timeout = oldest + self.flush_interval - time.monotonic()
+                    elif self._spool_files:
+                        timeout = self._next_attempt - time.monotonic()
+                    else:
+                        timeout = None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                items = list(self._items)
+                self._items.clear()
+                self._pending_rows = 0
+                closing = self._closing
+                self._condition.notify_all()
+
+            for results in items:
+                try:
+                    rows.extend(results_to_rows(results))
+                except Exception as e:
+                    print(f'Error converting results for the database: {str(e)}')
+                    traceback.print_exc()
+                    path = spool_rows(self.spool_dir, _records(results), rejected=True)
+                    self.stats['rejected'] += len(results)
+                    print(f'Saved the results that could not be converted to {path}')
+            if rows and oldest is None:
+                oldest = time.monotonic()
+
+            while len(rows) >= self.batch_size:
+                self._flush(rows[:self.batch_size])
+                rows = rows[self.batch_size:]
+                oldest = time.monotonic() if rows else None
+            if rows and (closing or time.monotonic() - oldest >= self.flush_interval):
+                self._flush(rows)
+                rows, oldest = [], None
+
+            self._replay(closing)
+            if closing:
+                with self._condition:
+                    if not self._items:
+                        return
+
+    def _flush(self, rows):
+        """
+        Write one batch to the database, or to the spool if the database is unavailable
+        """
+        if self._spool_files or not self._online() or not self._write(rows, self.upsert, self.max_retries):
+            self._spill(rows)
+
+    def _write(self, rows, upsert, retries):
+        """
+        Write rows in one transaction, retrying with backoff while the database can't be reached
+
+        Returns:
+            True if the rows were written or rejected, False if they still need to be saved
+        """
+        attempt = 0
+        while True:
+            try:
+                loader = BulkLoader(self.db_config, batch_size=len(rows), copy_format=self.copy_format, upsert=upsert)
+                start = time.perf_counter()
+                written = loader.load_rows(rows)
+                self.stats['written'] += written
+                if self.metrics is not None:
+                    self.metrics.observe('db_insert_seconds', time.perf_counter() - start)
+                    self.metrics.increment('db_rows_total', written)
+                self._failures = 0
+                self._next_attempt = 0.0
+                return True
+            except TRANSIENT_ERRORS as e:
+                self._failures += 1
+                delay = min(self.initial_backoff * 2 ** (self._failures - 1), self.max_backoff)
+                delay *= 0.5 + random.random() / 2  # Jitter, so restarted sinks don't retry in lockstep
+                self._next_attempt = time.monotonic() + delay
+                print(f"Database unavailable ({' '.join(str(e).split())}); attempt {self._failures}, next in {delay:.1f}s")
+                if attempt >= retries or self._closing:
+                    return False
+                attempt += 1
+                self.stats['retries'] += 1
+                if self.metrics is not None:
+                    self.metrics.increment('db_sink_retries_total')
+                with self._condition:
+                    # close() cuts the wait short; the batch is then spooled
+                    self._condition.wait_for(lambda: self._closing, delay)
+            except Exception as e:
+                print(f'The database rejected a batch of {len(rows)} rows: {str(e).strip()}')
+                if getattr(e, 'pgcode', None) == '23505':  # unique_violation on the fingerprint index
+                    print('Some of these log entries are already in the database; use --incremental to skip them')
+                self._reject(rows)
+                return True
+
+    def _spill(self, rows):
+        """
+        Save a batch to a new spool file to be replayed later
+        """
+        path = spool_rows(self.spool_dir, rows)
+        self._spool_files.append(path)
+        self.stats['spooled'] += len(rows)
+        if self.metrics is not None:
+            self.metrics.increment('db_sink_spooled_rows_total', len(rows))
+        print(f'Spooled {len(rows)} rows to {path}')
+
+    def _reject(self, rows):
+        path = spool_rows(self.spool_dir, rows, rejected=True)
+        self.stats['rejected'] += len(rows)
+        if self.metrics is not None:
+            self.metrics.increment('db_sink_rejected_rows_total', len(rows))
+        print(f'Saved the rejected rows to {path}; fix them and move the file back to {self.spool_dir} to retry')
+
+    def _replay(self, closing):
+        """
+        Replay spool files, oldest first: one per call, or all of them while closing
+        """
+        while self._spool_files and self._online():
+            path = self._spool_files[0]
+            try:
+                rows = read_spool_file(path)
+            except FileNotFoundError:
+                self._spool_files.pop(0)
+                continue
+            if not self._write(rows, True, 0):
+                return
+            os.remove(path)
+            self._spool_files.pop(0)
+            self.stats['replayed'] += len(rows)
+            if self.metrics is not None:
+                self.metrics.increment('db_sink_replayed_rows_total', len(rows))
+            print(f'Replayed {len(rows)} spooled rows from {path}')
+            if not closing:
+                return
+
+
+def _records(results):
+    """
+    Get results as a list of dictionaries, for saving ones that couldn't be converted
+    """
+    if hasattr(results, 'to_dict'):
+        return results.to_dict('records')
+    return list(results)
+
+
+def main():
+    """
+    Replay a spool directory into the database from the command line
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay database batches spooled while the database was unavailable')
+    parser.add_argument('--spool-dir', default='db_spool', help='Spool directory to replay')
+    parser.add_argument('--copy-format', choices=['csv', 'binary'], default='csv', help='COPY framing used for the replay')
+
+    args = parser.parse_args()
+
+    db_config = {
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': os.environ.get('DB_NAME', 'log_analyzer'),
+        'password': os.environ.get('DB_PASSWORD', 'logai'),
+        'port': os.environ.get('DB_PORT', 5432),
+    }
+
+    sink = DatabaseSink(db_config, copy_format=args.copy_format, spool_dir=args.spool_dir, max_retries=0)
+    stats = sink.close()
+    if stats['spool_files']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,655 @@
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WEIGHTS_FILE = 'model.safetensors'
+CLIENT_INFO_FILE = 'client.json'
+ROUND_INFO_FILE = 'federated_round.json'
+
+# Files copied next to the aggregated weights so the directory loads like the original model
+MODEL_SIDE_FILES = [
+    'config.json', 'generation_config.json', 'tokenizer.json', 'tokenizer_config.json',
+    'special_tokens_map.json', 'added_tokens.json', 'vocab.json', 'merges.txt', 'vocab.txt',
+]
+
+# numpy storage type of each safetensors dtype; BF16 is read as raw 16-bit words
+SAFETENSORS_DTYPES = {
+    'F64': np.float64, 'F32': np.float32, 'F16': np.float16, 'BF16': np.uint16,
+    'I64': np.int64, 'I32': np.int32, 'I16': np.int16, 'I8': np.int8,
+    'U64': np.uint64, 'U32': np.uint32, 'U16': np.uint16, 'U8': np.uint8, 'BOOL': np.bool_,
+}
+FLOAT_DTYPES = ('F64', 'F32', 'F16', 'BF16')
+
+# Elements averaged per task; bounds the working memory of each worker thread
+DEFAULT_CHUNK_ELEMENTS = 1 << 20
+
+
+def read_safetensors_header(path):
+    """
+    Read the tensor table of a safetensors file without loading any weights
+
+    Args:
+        path: Path to the .safetensors file
+
+    Returns:
+        Tuple of (dictionary of tensor name to its dtype, shape and data_offsets,
+        metadata dictionary, byte offset where the tensor data starts)
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    metadata = header.pop('__metadata__', None) or {}
+    return header, metadata, 8 + header_size
+
+
+def write_safetensors_header(path, tensors, metadata=None):
+    """
+    Create a safetensors file with the given tensor table and room for its data
+
+    Tensors are laid out in the order given. The data region is allocated
+    (sparsely on most file systems) so tensors can be filled in any order.
+
+    Args:
+        path: Path of the file to create
+        tensors: List of (name, dtype, shape) tuples
+        metadata: Dictionary of string metadata (optional)
+
+    Returns:
+        Tuple of (dictionary of tensor name to its (begin, end) data offsets,
+        byte offset where the tensor data starts)
+    """
+    header = {'__metadata__': dict(metadata or {})} if metadata else {}
+    offsets = {}
+    position = 0
+    for name, dtype, shape in tensors:
+        size = int(np.prod(shape, dtype=np.int64)) * np.dtype(SAFETENSORS_DTYPES[dtype]).itemsize
+        offsets[name] = (position, position + size)
+        header[name] = {'dtype': dtype, 'shape': list(shape), 'data_offsets': [position, position + size]}
+        position += size
+
+    # Pad the header with spaces so the data starts 8-byte aligned
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        f.truncate(8 + len(header_bytes) + position)
+    return offsets, 8 + len(header_bytes)
+
+
+def _to_float(values, dtype):
+    """
+    Widen a chunk of stored weights to float64 for accumulation
+    """
+    # Signaling NaNs widen to quiet ones; numpy would warn about each of them
+    with np.errstate(invalid='ignore'):
+        if dtype == 'BF16':
+            return (values.astype(np.uint32) << 16).view(np.float32).astype(np.float64)
+        return values.astype(np.float64)
+
+
+def _from_float(values, dtype):
+    """
+    Narrow an accumulated float64 chunk back to the stored dtype
+    """
+    if dtype == 'BF16':
+        # Round to nearest even on the upper 16 bits of the float32 value; infinities
+        # stay infinite and values past the BF16 range round to them
+        with np.errstate(over='ignore'):
+            bits = values.astype(np.float32).view(np.uint32)
+        rounded = ((bits + (0x7FFF + ((bits >> 16) & 1))) >> 16).astype(np.uint16)
+        # Rounding could carry a NaN's payload into the exponent or past the sign bit,
+        # so NaNs become a quiet NaN of the same sign instead
+        nan = np.isnan(values)
+        if nan.any():
+            rounded[nan] = (bits[nan] >> 16).astype(np.uint16) | 0x7FC0
+        return rounded
+    with np.errstate(over='ignore'):
+        return values.astype(SAFETENSORS_DTYPES[dtype])
+
+
+class SafetensorsFile:
+    """
+    A read-only, memory-mapped view of the tensors in a safetensors file
+
+    Tensors are exposed as flat numpy arrays backed by the file, so reading a
+    slice only pages in that slice and the process never holds the whole
+    checkpoint in memory.
+    """
+
+    def __init__(self, path):
+        """
+        Map the file
+
+        Args:
+            path: Path to the .safetensors file
+        """
+        self.path = path
+        self.header, self.metadata, self.data_start = read_safetensors_header(path)
+        data_size = max((info['data_offsets'][1] for info in self.header.values()), default=0)
+        self._data = np.memmap(path, dtype=np.uint8, mode='r', offset=self.data_start, shape=(data_size,)) \
+            if data_size else np.zeros(0, dtype=np.uint8)
+
+    def names(self):
+        """
+        Get the tensor names in file order
+        """
+        return sorted(self.header, key=lambda name: self.header[name]['data_offsets'][0])
+
+    def dtype(self, name):
+        return self.header[name]['dtype']
+
+    def shape(self, name):
+        return tuple(self.header[name]['shape'])
+
+    def flat(self, name):
+        """
+        Get a tensor as a flat, memory-mapped numpy array in its storage dtype
+
+        Args:
+            name: Tensor name
+
+        Returns:
+            One-dimensional numpy array backed by the file
+        """
+        begin, end = self.header[name]['data_offsets']
+        return self._data[begin:end].view(SAFETENSORS_DTYPES[self.dtype(name)])
+
+    def close(self):
+        mmap = getattr(self._data, '_mmap', None)
+        self._data = None
+        if mmap is not None:
+            mmap.close()
+
+
+def weights_path(model_dir):
+    """
+    Get the path to the safetensors weights of a model directory (or a weights file itself)
+    """
+    return model_dir if model_dir.endswith('.safetensors') else os.path.join(model_dir, WEIGHTS_FILE)
+
+
+def read_sample_count(client_dir):
+    """
+    Read the number of training samples recorded by train_client
+
+    Args:
+        client_dir: Path to a client model directory
+
+    Returns:
+        The sample count, or None if the client did not record one
+    """
+    info_path = os.path.join(client_dir, CLIENT_INFO_FILE)
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path) as f:
+        return json.load(f).get('num_samples')
+
+
+def _check_compatible(reference, other):
+    """
+    Make sure two checkpoints have the same tensors with the same shapes and dtypes
+    """
+    if set(reference.header) != set(other.header):
+        missing = sorted(set(reference.header) ^ set(other.header))
+        raise ValueError(f'{other.path} does not have the same tensors as {reference.path} (differences: {missing[:5]})')
+    for name in reference.header:
+        if reference.shape(name) != other.shape(name) or reference.dtype(name) != other.dtype(name):
+            raise ValueError(
+                f'Tensor {name} is {other.dtype(name)}{list(other.shape(name))} in {other.path} '
+                f'but {reference.dtype(name)}{list(reference.shape(name))} in {reference.path}'
+            )
+
+
+def copy_model_files(source_dir, output_dir):
+    """
+    Copy the config and tokenizer files of a model directory (not its weights)
+
+    Args:
+        source_dir: Model directory to copy from
+        output_dir: Directory to copy to
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name in MODEL_SIDE_FILES:
+        source = os.path.join(source_dir, file_name)
+        if os.path.exists(source):
+            shutil.copyfile(source, os.path.join(output_dir, file_name))
+
+
+def write_tensors(reference, output_path, fill_chunk, metadata=None, workers=None,
+                  chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    """
+    Write a safetensors file with the same tensor table as a reference checkpoint, chunk by chunk
+
+    The file is preallocated and memory-mapped, and chunks of every tensor are
+    computed by fill_chunk in parallel threads and written in place, so only
+    a few chunks are in memory at any time. The file is written under a
+    temporary name and renamed when complete.
+
+    Args:
+        reference: SafetensorsFile whose tensor names, dtypes and shapes are written
+        output_path: Path of the .safetensors file to write
+        fill_chunk: Function (name, chunk start, chunk end) returning the flat
+                    values of that element range in the tensor's storage dtype
+        metadata: Dictionary of string metadata (optional)
+        workers: Number of threads filling chunks (default: number of CPUs)
+        chunk_elements: Number of elements per chunk
+
+    Returns:
+        List of the tensor names written
+    """
+    temp_path = output_path + '.tmp'
+    names = reference.names()
+    offsets, data_start = write_safetensors_header(
+        temp_path, [(name, reference.dtype(name), reference.shape(name)) for name in names], metadata
+    )
+    data_size = max((end for _, end in offsets.values()), default=0)
+
+    # Split every tensor into chunks; large tensors are spread over several tasks
+    tasks = []
+    for name in names:
+        size = int(np.prod(reference.shape(name), dtype=np.int64))
+        for chunk_start in range(0, size, chunk_elements):
+            tasks.append((name, chunk_start, min(size, chunk_start + chunk_elements)))
+
+    output = np.memmap(temp_path, dtype=np.uint8, mode='r+', offset=data_start, shape=(data_size,)) \
+        if data_size else None
+
+    def write_chunk(task):
+        name, chunk_start, chunk_end = task
+        begin, end = offsets[name]
+        target = output[begin:end].view(SAFETENSORS_DTYPES[reference.dtype(name)])
+        target[chunk_start:chunk_end] = fill_chunk(name, chunk_start, chunk_end)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            # Consume the iterator so exceptions from worker threads are raised here
+            list(executor.map(write_chunk, tasks))
+    finally:
+        if output is not None:
+            output.flush()
+            output._mmap.close()
+            del output
+    os.replace(temp_path, output_path)
+    return names
+
+
+def federated_average(client_dirs, sample_counts=None, output_dir='federated-model', base_model_dir=None,
+                      algorithm='fedavg', workers=None, chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    """
+    Aggregate client checkpoints into a new global model with sample-weighted averaging
+
+    Every client's model.safetensors is memory-mapped and the output file is
+    written in place, chunk by chunk, so memory use is bounded by the chunk
+    size times the number of workers rather than by the number of clients.
+    Chunks of different tensors are averaged in parallel threads. Floating
+    point tensors are accumulated in float64 and written in their original
+    dtype; integer and boolean buffers (e.g. position ids) are copied from
+    the first client.
+
+    FedAvg and FedProx aggregate the same way; FedProx differs only in the
+    proximal term the clients train with (see train_client), and is recorded
+    in the round information.
+
+    Args:
+        client_dirs: List of client model directories (or .safetensors files)
+        sample_counts: Number of training samples of each client; read from each
+                       client's client.json when not given
+        output_dir: Directory to write the aggregated model to
+        base_model_dir: Model directory to copy config and tokenizer files from
+                        (default: the first client directory)
+        algorithm: 'fedavg' or 'fedprox', recorded in the round information
+        workers: Number of threads averaging chunks (default: number of CPUs)
+        chunk_elements: Number of elements per averaging task
+
+    Returns:
+        Dictionary with the round information (also saved as federated_round.json)
+    """
+    if not client_dirs:
+        raise ValueError('At least one client checkpoint is needed to aggregate')
+    if sample_counts is None:
+        sample_counts = [read_sample_count(client_dir) for client_dir in client_dirs]
+        if any(count is None for count in sample_counts):
+            raise ValueError('Sample counts are needed for clients without a client.json')
+    if len(sample_counts) != len(client_dirs):
+        raise ValueError(f'Got {len(sample_counts)} sample counts for {len(client_dirs)} clients')
+    if any(count <= 0 for count in sample_counts):
+        raise ValueError('Sample counts must be positive')
+
+    start = time.perf_counter()
+    total_samples = float(sum(sample_counts))
+    weights = [count / total_samples for count in sample_counts]
+
+    clients = [SafetensorsFile(weights_path(client_dir)) for client_dir in client_dirs]
+    try:
+        reference = clients[0]
+        for client in clients[1:]:
+            _check_compatible(reference, client)
+
+        def average_chunk(name, chunk_start, chunk_end):
+            dtype = reference.dtype(name)
+            if dtype not in FLOAT_DTYPES:
+                return reference.flat(name)[chunk_start:chunk_end]
+            total = _to_float(clients[0].flat(name)[chunk_start:chunk_end], dtype) * weights[0]
+            for client, weight in zip(clients[1:], weights[1:]):
+                total += _to_float(client.flat(name)[chunk_start:chunk_end], dtype) * weight
+            return _from_float(total, dtype)
+
+        metadata = dict(reference.metadata)
+        metadata.update({'format': 'pt', 'federated_algorithm': algorithm, 'federated_clients': str(len(clients))})
+        os.makedirs(output_dir, exist_ok=True)
+        names = write_tensors(reference, os.path.join(output_dir, WEIGHTS_FILE), average_chunk, metadata,
+                              workers=workers, chunk_elements=chunk_elements)
+    finally:
+        for client in clients:
+            client.close()
+
+    copy_model_files(base_model_dir or (client_dirs[0] if os.path.isdir(client_dirs[0]) else os.path.dirname(client_dirs[0])),
+                     output_dir)
+
+    round_info = {
+        'algorithm': algorithm,
+        'clients': [
+            {'path': client_dir, 'num_samples': count, 'weight': weight}
+            for client_dir, count, weight in zip(client_dirs, sample_counts, weights)
+        ],
+        'total_samples': int(total_samples),
+        'tensors': len(names),
+        'parameters': int(sum(np.prod(reference.shape(name), dtype=np.int64) for name in names)),
+        'aggregation_seconds': time.perf_counter() - start,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with open(os.path.join(output_dir, ROUND_INFO_FILE), 'w') as f:
+        json.dump(round_info, f, indent=2)
+    return round_info
+
+
+def split_csv_shards(csv_file_path, num_clients, output_dir, by=None, seed=0):
+    """
+    Split a CSV of logs into disjoint shards, one per simulated client
+
+    Args:
+        csv_file_path: Path to the CSV file
+        num_clients: Number of shards
+        output_dir: Directory to write client_<n>.csv shards to
+        by: Column whose values are kept together in one shard, e.g. 'device_name'
+            for a realistic non-IID split (default: random rows)
+        seed: Seed of the random assignment
+
+    Returns:
+        List of shard paths
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_file_path)
+    rng = np.random.default_rng(seed)
+    if by:
+        if by not in df.columns:
+            raise ValueError(f'CSV file has no "{by}" column to shard by')
+        groups = df[by].astype(str).unique()
+        group_shards = dict(zip(groups, rng.permutation(len(groups)) % num_clients))
+        assignment = df[by].astype(str).map(group_shards).to_numpy()
+    else:
+        assignment = rng.permutation(len(df)) % num_clients
+
+    os.makedirs(output_dir, exist_ok=True)
+    shard_paths = []
+    for client in range(num_clients):
+        shard_path = os.path.join(output_dir, f'client_{client + 1}.csv')
+        df[assignment == client].to_csv(shard_path, index=False)
+        shard_paths.append(shard_path)
+    return shard_paths
+
+
+def train_client(base_model_dir, csv_file_path, output_dir, epochs=1, batch_size=16, learning_rate=2e-5,
+                 mu=0.0, max_length=128, seed=0):
+    """
+    Fine-tune a copy of the global model on one client's logs
+
+    Labels come from the CSV's 'label' column ('anomaly'/'normal') if there is
+    one, otherwise from the global model's own verdicts. With mu > 0 the loss
+    includes the FedProx proximal term mu/2 * ||w - w_global||^2, which keeps
+    clients with very different data close to the global model.
+
+    Args:
+        base_model_dir: Path to the global model directory
+        csv_file_path: Path to the client's CSV shard with a 'log' column
+        output_dir: Directory to save the client model to
+        epochs: Passes over the shard
+        batch_size: Number of logs per training step
+        learning_rate: AdamW learning rate
+        mu: FedProx proximal coefficient (0 gives plain FedAvg training)
+        max_length: Maximum number of tokens per log
+        seed: Seed of the shuffling
+
+    Returns:
+        Number of training samples, also saved in the client's client.json
+    """
+    import pandas as pd
+    import torch
+    from transformers import AutoTokenizer, RobertaForSequenceClassification, logging
+
+    logging.set_verbosity_error()
+    df = pd.read_csv(csv_file_path)
+    if 'log' not in df.columns:
+        raise ValueError('CSV file must contain a "log" column')
+    log_texts = df['log'].fillna('').astype(str).tolist()
+    if not log_texts:
+        raise ValueError(f'Client shard {csv_file_path} has no logs')
+
+    if 'label' in df.columns:
+        labels = df['label'].astype(str).str.lower().tolist()
+    else:
+        from log_analyzer_tool import LogAnalyzerTool
+        analyzer = LogAnalyzerTool(model_path=base_model_dir, cache_size=0, lazy_load=False)
+        labels = [prediction['label'] for prediction in analyzer.predict_batch(log_texts)]
+        analyzer.close()
+    # Class 0 is anomaly and class 1 is normal in this model
+    targets = torch.tensor([0 if label == 'anomaly' else 1 for label in labels])
+
+    torch.manual_seed(seed)
+    tokenizer = AutoTokenizer.from_pretrained(base_model_dir)
+    model = RobertaForSequenceClassification.from_pretrained(base_model_dir)
+    model.train()
+    global_params = [param.detach().clone() for param in model.parameters()] if mu > 0 else None
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+
+    for epoch in range(epochs):
+        order = torch.randperm(len(log_texts)).tolist()
+        epoch_loss = 0.0
+        for batch_start in range(0, len(order), batch_size):
+            indices = order[batch_start:batch_start + batch_size]
+            inputs = tokenizer([log_texts[i] for i in indices], padding=True, truncation=True,
+                               max_length=max_length, return_tensors='pt')
+            loss = model(**inputs, labels=targets[indices]).loss
+            if global_params is not None:
+                proximal = sum(((param - global_param) ** 2).sum()
+                               for param, global_param in zip(model.parameters(), global_params))
+                loss = loss + mu / 2 * proximal
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(indices)
+        print(f'  {os.path.basename(output_dir)}: epoch {epoch + 1}/{epochs}, loss {epoch_loss / len(order):.4f}')
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    copy_model_files(base_model_dir, output_dir)
+    with open(os.path.join(output_dir, CLIENT_INFO_FILE), 'w') as f:
+        json.dump({
+            'num_samples': len(log_texts),
+            'csv': csv_file_path,
+            'base_model': base_model_dir,
+            'epochs': epochs,
+            'learning_rate': learning_rate,
+            'mu': mu,
+        }, f, indent=2)
+    return len(log_texts)
+
+
+def simulate_round(base_model_dir, csv_file_path, num_clients, work_dir, output_dir, algorithm='fedavg', mu=0.01,
+                   shard_by=None, epochs=1, batch_size=16, learning_rate=2e-5, workers=None, seed=0,
+                   delta_method=None, density=0.01):
+    """
+    Simulate one federated round: shard a CSV, train a client on each shard and aggregate
+
+    Args:
+        base_model_dir: Path to the global model directory
+        csv_file_path: Path to the CSV file of logs
+        num_clients: Number of simulated clients
+        work_dir: Directory for the shards and client models
+        output_dir: Directory to write the aggregated model to
+        algorithm: 'fedavg' or 'fedprox'
+        mu: FedProx proximal coefficient (ignored for fedavg)
+        shard_by: Column whose values are kept together in one shard (optional)
+        epochs: Local training passes per client
+        batch_size: Number of logs per training step
+        learning_rate: Client learning rate
+        workers: Number of aggregation threads
+        seed: Seed of the sharding and shuffling
+        delta_method: Have clients upload 'topk' or 'int8' deltas instead of full checkpoints (optional)
+        density: Fraction of each tensor kept by 'topk' deltas
+
+    Returns:
+        Dictionary with the round information
+    """
+    shard_paths = split_csv_shards(csv_file_path, num_clients, os.path.join(work_dir, 'shards'), by=shard_by, seed=seed)
+    client_dirs, sample_counts = [], []
+    for client, shard_path in enumerate(shard_paths):
+        client_dir = os.path.join(work_dir, f'client_{client + 1}')
+        try:
+            print(f'Training client {client + 1}/{num_clients} on {shard_path}...')
+            sample_counts.append(train_client(
+                base_model_dir, shard_path, client_dir, epochs=epochs, batch_size=batch_size,
+                learning_rate=learning_rate, mu=mu if algorithm == 'fedprox' else 0.0, seed=seed + client
+            ))
+            client_dirs.append(client_dir)
+        except ValueError as e:
+            # An empty shard (e.g. fewer devices than clients) just sits the round out
+            print(f'Skipping client {client + 1}: {str(e)}')
+
+    if delta_method:
+        from federated_delta import aggregate_deltas, create_delta
+
+        delta_paths = []
+        for client_dir in client_dirs:
+            delta = create_delta(base_model_dir, client_dir, os.path.join(client_dir, 'update.delta'), method=delta_method,
+                                 density=density, residual_path=os.path.join(client_dir, 'delta_residual.safetensors'))
+            print(f"  {os.path.basename(client_dir)}: {delta['delta_bytes']:,} byte {delta_method} delta "
+                  f"({delta['compression_ratio']:.1f}x smaller than the checkpoint)")
+            delta_paths.append(delta['path'])
+        print(f'Aggregating {len(delta_paths)} client deltas...')
+        return aggregate_deltas(base_model_dir, delta_paths, output_dir, sample_counts, workers=workers)
+
+    print(f'Aggregating {len(client_dirs)} client models with {algorithm}...')
+    return federated_average(client_dirs, sample_counts, output_dir, base_model_dir=base_model_dir,
+                             algorithm=algorithm, workers=workers)
+
+
+def main():
+    """
+    Aggregate client checkpoints or simulate a federated round from the command line
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Federated averaging of RoBERTa log model checkpoints')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    aggregate_parser = subparsers.add_parser('aggregate', help='Average client model directories into a new model')
+    aggregate_parser.add_argument('clients', nargs='+', help='Client model directories')
+    aggregate_parser.add_argument('--samples', type=int, nargs='+', help="Training samples per client (default: read from each client's client.json)")
+    aggregate_parser.add_argument('--output', required=True, help='Directory to write the aggregated model to')
+    aggregate_parser.add_argument('--base-model', help='Model directory to copy config and tokenizer files from (default: the first client)')
+    aggregate_parser.add_argument('--algorithm', choices=['fedavg', 'fedprox'], default='fedavg', help='Algorithm recorded for the round')
+    aggregate_parser.add_argument('--workers', type=int, help='Number of aggregation threads (default: number of CPUs)')
+
+    simulate_parser = subparsers.add_parser('simulate', help='Train clients on disjoint CSV shards and aggregate them')
+    simulate_parser.add_argument('--model', default='AI/main-federated-roberta-model', help='Path to the global model directory')
+    simulate_parser.add_argument('--csv', required=True, help='CSV file of logs to shard across the clients')
+    simulate_parser.add_argument('--clients', type=int, default=3, help='Number of simulated clients')
+    simulate_parser.add_argument('--shard-by', help="Keep each value of this column on one client, e.g. 'device_name' (default: random rows)")
+    simulate_parser.add_argument('--work-dir', default='federated-work', help='Directory for the shards and client models')
+    simulate_parser.add_argument('--output', required=True, help='Directory to write the aggregated model to')
+    simulate_parser.add_argument('--algorithm', choices=['fedavg', 'fedprox'], default='fedavg', help='Aggregation algorithm')
+    simulate_parser.add_argument('--mu', type=float, default=0.01, help='FedProx proximal coefficient')
+    simulate_parser.add_argument('--epochs', type=int, default=1, help='Local training passes per client')
+    simulate_parser.add_argument('--batch-size', type=int, default=16, help='Number of logs per training step')
+    simulate_parser.add_argument('--learning-rate', type=float, default=2e-5, help='Client learning rate')
+    simulate_parser.add_argument('--workers', type=int, help='Number of aggregation threads (default: number of CPUs)')
+    simulate_parser.add_argument('--delta', choices=['topk', 'int8'], help='Have clients upload compressed deltas instead of full checkpoints')
+    simulate_parser.add_argument('--density', type=float, default=0.01, help='Fraction of each tensor kept by top-k deltas')
+
+    create_parser = subparsers.add_parser('create-delta', help='Encode a client model as a compressed delta against the base model')
+    create_parser.add_argument('client', help='Client model directory')
+    create_parser.add_argument('--base', required=True, help='Base model directory the client was trained from')
+    create_parser.add_argument('--output', required=True, help='Path of the delta file to write')
+    create_parser.add_argument('--method', choices=['topk', 'int8'], default='topk', help='Compression method')
+    create_parser.add_argument('--density', type=float, default=0.01, help='Fraction of each tensor kept by top-k')
+    create_parser.add_argument('--residual', help='Error-feedback residual file, read if present and rewritten (optional)')
+    create_parser.add_argument('--samples', type=int, help="Training samples to record (default: read from the client's client.json)")
+
+    apply_parser = subparsers.add_parser('apply-delta', help='Rebuild a client model from the base model and a delta')
+    apply_parser.add_argument('delta', help='Delta file')
+    apply_parser.add_argument('--base', required=True, help='Base model directory the delta was created against')
+    apply_parser.add_argument('--output', required=True, help='Directory to write the rebuilt model to')
+
+    deltas_parser = subparsers.add_parser('aggregate-deltas', help='Aggregate client deltas into a new model in one streaming pass')
+    deltas_parser.add_argument('deltas', nargs='+', help='Delta files')
+    deltas_parser.add_argument('--base', required=True, help='Base model directory the deltas were created against')
+    deltas_parser.add_argument('--output', required=True, help='Directory to write the aggregated model to')
+    deltas_parser.add_argument('--samples', type=int, nargs='+', help='Training samples per client (default: read from the deltas)')
+    deltas_parser.add_argument('--server-learning-rate', type=float, default=1.0, help='Scale of the averaged update applied to the base')
+    deltas_parser.add_argument('--workers', type=int, help='Number of aggregation threads (default: number of CPUs)')
+
+    args = parser.parse_args()
+
+    try:
+        from log_analyzer_tool import resolve_model_path
+        if args.command == 'aggregate':
+            round_info = federated_average(args.clients, args.samples, args.output, base_model_dir=args.base_model,
+                                           algorithm=args.algorithm, workers=args.workers)
+        elif args.command == 'simulate':
+            round_info = simulate_round(
+                resolve_model_path(args.model), args.csv, args.clients, args.work_dir, args.output,
+                algorithm=args.algorithm, mu=args.mu, shard_by=args.shard_by, epochs=args.epochs,
+                batch_size=args.batch_size, learning_rate=args.learning_rate, workers=args.workers,
+                delta_method=args.delta, density=args.density
+            )
+        elif args.command == 'create-delta':
+            from federated_delta import create_delta
+            delta = create_delta(args.base, args.client, args.output, method=args.method, density=args.density,
+                                 residual_path=args.residual, num_samples=args.samples)
+            print(f"Wrote {delta['method']} delta to {delta['path']}: {delta['delta_bytes']:,} bytes, "
+                  f"{delta['compression_ratio']:.1f}x smaller than the {delta['full_bytes']:,} byte checkpoint")
+            return
+        elif args.command == 'apply-delta':
+            from federated_delta import apply_delta
+            apply_delta(args.base, args.delta, args.output)
+            print(f'Rebuilt the client model in {args.output}')
+            return
+        else:
+            from federated_delta import aggregate_deltas
+            round_info = aggregate_deltas(args.base, args.deltas, args.output, args.samples,
+                                          server_learning_rate=args.server_learning_rate, workers=args.workers)
+    except Exception as e:
+        print(f'Error: {str(e)}')
+        traceback.print_exc()
+        sys.exit(1)
+
+    print(f"Aggregated {len(round_info['clients'])} clients ({round_info['total_samples']:,} samples, "
+          f"{round_info['parameters']:,} parameters) in {round_info['aggregation_seconds']:.2f}s")
+    for client in round_info['clients']:
+        print(f"  {client['path']}: {client['num_samples']:,} samples, weight {client['weight']:.3f}")
+    if 'upload_bytes' in round_info:
+        print(f"Uploaded {round_info['upload_bytes']:,} bytes of deltas instead of {round_info['full_model_bytes']:,} "
+              f"bytes of full checkpoints ({round_info['full_model_bytes'] / max(1, round_info['upload_bytes']):.1f}x less)")
+    print(f'Saved the aggregated model to {args.output}')
+
+if __name__ == '__main__':
+    main()
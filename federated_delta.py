@@ -0,0 +1,474 @@
+import os
+import json
+import math
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from federated import (
+    DEFAULT_CHUNK_ELEMENTS, FLOAT_DTYPES, ROUND_INFO_FILE, WEIGHTS_FILE,
+    SafetensorsFile, _check_compatible, _from_float, _to_float, copy_model_files, read_sample_count,
+    weights_path, write_safetensors_header, write_tensors,
+)
+
+DELTA_FORMAT = 'log-analyzer-delta'
+DELTA_VERSION = '1'
+DELTA_METHODS = ['topk', 'int8']
+
+# Elements sharing one int8 scale
+DEFAULT_BLOCK_SIZE = 4096
+
+# Stands in for the payload hash until the payload has been written; same length as a SHA-256 hex digest
+_HASH_PLACEHOLDER = '0' * 64
+
+
+def file_sha256(path, start=0, block_size=1 << 22):
+    """
+    Hash a file, or the part of it from a byte offset on, without reading it into memory
+
+    Args:
+        path: Path to the file
+        start: Byte offset to start hashing at
+        block_size: Number of bytes read at a time
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _difference(client, base, name, residual=None):
+    """
+    Get client - base (+ the carried-over residual) for one tensor as a flat float32 array
+    """
+    if base.dtype(name) == 'BF16':
+        widen = lambda values: (values.astype(np.uint32) << 16).view(np.float32)
+    else:
+        widen = lambda values: values.astype(np.float32)
+    difference = widen(client.flat(name)) - widen(base.flat(name))
+    if residual is not None:
+        difference += residual.flat(name)
+    return difference
+
+
+def _delta_entries(base, name, method, density, block_size):
+    """
+    Get the (entry name, dtype, shape) tuples a float tensor is stored as in a delta
+    """
+    size = int(np.prod(base.shape(name), dtype=np.int64))
+    if method == 'topk':
+        k = min(size, max(1, math.ceil(size * density)))
+        index_dtype = 'I32' if size < 2 ** 31 else 'I64'
+        return [(name + '::indices', index_dtype, (k,)), (name + '::values', 'F16', (k,))]
+    return [(name + '::q', 'I8', (size,)), (name + '::scales', 'F32', (math.ceil(size / block_size),))]
+
+
+def _compress(difference, method, density, block_size):
+    """
+    Compress a flat difference and decode it again
+
+    Returns:
+        Tuple of (dictionary of entry suffix to stored array, decoded float32 array)
+    """
+    size = len(difference)
+    if method == 'topk':
+        # Keep the k largest changes, stored as sorted indices and fp16 values
+        k = min(size, max(1, math.ceil(size * density)))
+        indices = np.argpartition(np.abs(difference), size - k)[size - k:]
+        indices.sort()
+        values = difference[indices].astype(np.float16)
+        decoded = np.zeros(size, dtype=np.float32)
+        decoded[indices] = values
+        index_dtype = np.int32 if size < 2 ** 31 else np.int64
+        return {'indices': indices.astype(index_dtype), 'values': values}, decoded
+
+    # Symmetric int8 quantization with one scale per block of elements
+    blocks = math.ceil(size / block_size)
+    padded = np.zeros(blocks * block_size, dtype=np.float32)
+    padded[:size] = difference
+    padded = padded.reshape(blocks, block_size)
+    scales = (np.abs(padded).max(axis=1) / 127.0).astype(np.float32)
+    safe_scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    quantized = np.clip(np.rint(padded / safe_scales[:, None]), -127, 127).astype(np.int8)
+    decoded = (quantized.astype(np.float32) * scales[:, None]).reshape(-1)[:size]
+    return {'q': quantized.reshape(-1)[:size], 'scales': scales}, decoded
+
+
+def create_delta(base_model_dir, client_model_dir, output_path, method='topk', density=0.01,
+                 block_size=DEFAULT_BLOCK_SIZE, residual_path=None, num_samples=None, workers=None):
+    """
+    Encode a client checkpoint as a compressed delta against the base checkpoint
+
+    The delta is a safetensors file. With 'topk' each float tensor keeps only
+    the largest density fraction of its changes (int32 indices and fp16
+    values). With 'int8' every change is quantized to int8 with one float32
+    scale per block. Integer buffers are only stored if the client changed
+    them. The metadata records the SHA-256 of the base weights the delta
+    applies to and of the delta's own payload.
+
+    With a residual_path the delta uses error feedback: the part of the change
+    the compression dropped is saved there and added to the next delta this
+    client creates, so small updates are delayed rather than lost.
+
+    Args:
+        base_model_dir: Path to the base (global) model directory or weights file
+        client_model_dir: Path to the fine-tuned client model directory or weights file
+        output_path: Path of the delta file to write
+        method: 'topk' or 'int8'
+        density: Fraction of each tensor's elements kept by 'topk'
+        block_size: Number of elements per int8 scale
+        residual_path: Path of the client's error-feedback residual file (optional)
+        num_samples: Number of training samples, stored for weighting the aggregation
+                     (default: read from the client's client.json)
+        workers: Number of threads compressing tensors (default: up to 4)
+
+    Returns:
+        Dictionary with the delta and full checkpoint sizes and the compression ratio
+    """
+    if method not in DELTA_METHODS:
+        raise ValueError(f'Unknown delta method: {method} (choose from {", ".join(DELTA_METHODS)})')
+    if method == 'topk' and not 0 < density <= 1:
+        raise ValueError('Top-k density must be in (0, 1]')
+    if num_samples is None and os.path.isdir(client_model_dir):
+        num_samples = read_sample_count(client_model_dir)
+
+    start = time.perf_counter()
+    base_path = weights_path(base_model_dir)
+    base = SafetensorsFile(base_path)
+    client = SafetensorsFile(weights_path(client_model_dir))
+    residual = None
+    new_residual = None
+    try:
+        _check_compatible(base, client)
+        names = base.names()
+        float_names = [name for name in names if base.dtype(name) in FLOAT_DTYPES]
+
+        if residual_path and os.path.exists(residual_path):
+            residual = SafetensorsFile(residual_path)
+            if set(residual.header) != set(float_names) or any(
+                    residual.shape(name) != (int(np.prod(base.shape(name), dtype=np.int64)),) for name in float_names):
+                print(f'Ignoring residual {residual_path}: it does not match the model')
+                residual.close()
+                residual = None
+
+        # Plan the entries up front so the header can be written before the payload
+        entries = []
+        for name in names:
+            if name in float_names:
+                entries.extend(_delta_entries(base, name, method, density, block_size))
+            elif not np.array_equal(base.flat(name), client.flat(name)):
+                entries.append((name + '::raw', base.dtype(name), (int(np.prod(base.shape(name), dtype=np.int64)),)))
+
+        metadata = {
+            'format': DELTA_FORMAT,
+            'version': DELTA_VERSION,
+            'method': method,
+            'density': str(density),
+            'block_size': str(block_size),
+            'base_sha256': file_sha256(base_path),
+            'payload_sha256': _HASH_PLACEHOLDER,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if num_samples is not None:
+            metadata['num_samples'] = str(int(num_samples))
+
+        temp_path = output_path + '.tmp'
+        offsets, data_start = write_safetensors_header(temp_path, entries, metadata)
+        data_size = max((end for _, end in offsets.values()), default=0)
+        output = np.memmap(temp_path, dtype=np.uint8, mode='r+', offset=data_start, shape=(data_size,)) \
+            if data_size else None
+
+        if residual_path:
+            residual_offsets, residual_start = write_safetensors_header(
+                residual_path + '.tmp',
+                [(name, 'F32', (int(np.prod(base.shape(name), dtype=np.int64)),)) for name in float_names],
+                {'format': DELTA_FORMAT + '-residual'}
+            )
+            residual_size = max((end for _, end in residual_offsets.values()), default=0)
+            if residual_size:
+                new_residual = np.memmap(residual_path + '.tmp', dtype=np.uint8, mode='r+',
+                                         offset=residual_start, shape=(residual_size,))
+
+        def store(entry_name, values):
+            begin, end = offsets[entry_name]
+            output[begin:end] = np.ascontiguousarray(values).view(np.uint8)
+
+        def encode_tensor(name):
+            if name not in float_names:
+                if name + '::raw' in offsets:
+                    store(name + '::raw', client.flat(name))
+                return
+            difference = _difference(client, base, name, residual)
+            stored, decoded = _compress(difference, method, density, block_size)
+            for suffix, values in stored.items():
+                store(f'{name}::{suffix}', values)
+            if new_residual is not None:
+                begin, end = residual_offsets[name]
+                new_residual[begin:end].view(np.float32)[:] = difference - decoded
+
+        with ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1)) as executor:
+            list(executor.map(encode_tensor, names))
+
+        if output is not None:
+            output.flush()
+            output._mmap.close()
+            del output
+        if new_residual is not None:
+            new_residual.flush()
+            new_residual._mmap.close()
+            new_residual = None
+    finally:
+        for checkpoint in (base, client, residual):
+            if checkpoint is not None:
+                checkpoint.close()
+
+    # Fill in the payload hash; the header keeps its length so the data does not move
+    payload_hash = file_sha256(temp_path, data_start)
+    with open(temp_path, 'r+b') as f:
+        f.seek(8)
+        header_bytes = f.read(data_start - 8)
+        f.seek(8)
+        f.write(header_bytes.replace(_HASH_PLACEHOLDER.encode('ascii'), payload_hash.encode('ascii'), 1))
+    os.replace(temp_path, output_path)
+    if residual_path:
+        os.replace(residual_path + '.tmp', residual_path)
+
+    delta_bytes = os.path.getsize(output_path)
+    full_bytes = os.path.getsize(weights_path(client_model_dir))
+    return {
+        'path': output_path,
+        'method': method,
+        'delta_bytes': delta_bytes,
+        'full_bytes': full_bytes,
+        'compression_ratio': full_bytes / max(1, delta_bytes),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+class DeltaFile:
+    """
+    A memory-mapped delta created by create_delta
+    """
+
+    def __init__(self, path):
+        """
+        Map the delta file and read its metadata
+
+        Args:
+            path: Path to the delta file
+        """
+        self.path = path
+        self.file = SafetensorsFile(path)
+        metadata = self.file.metadata
+        if metadata.get('format') != DELTA_FORMAT:
+            self.file.close()
+            raise ValueError(f'{path} is not a model delta')
+        self.method = metadata['method']
+        self.block_size = int(metadata.get('block_size', DEFAULT_BLOCK_SIZE))
+        self.base_sha256 = metadata['base_sha256']
+        self.payload_sha256 = metadata['payload_sha256']
+        self.num_samples = int(metadata['num_samples']) if 'num_samples' in metadata else None
+
+    def verify(self, base_sha256=None):
+        """
+        Check the payload against its recorded hash, and optionally the base it applies to
+
+        Args:
+            base_sha256: SHA-256 of the base weights the delta will be applied to (optional)
+
+        Raises:
+            ValueError: If the payload is corrupt or the delta was made against another base
+        """
+        if file_sha256(self.path, self.file.data_start) != self.payload_sha256:
+            raise ValueError(f'Delta {self.path} is corrupt: its payload does not match its SHA-256')
+        if base_sha256 is not None and base_sha256 != self.base_sha256:
+            raise ValueError(f'Delta {self.path} was created against a different base model')
+
+    def raw(self, name):
+        """
+        Get the replacement values of an integer buffer the client changed, or None
+        """
+        return self.file.flat(name + '::raw') if name + '::raw' in self.file.header else None
+
+    def decode_chunk(self, name, chunk_start, chunk_end):
+        """
+        Decode the change to an element range of a float tensor
+
+        Args:
+            name: Tensor name
+            chunk_start: First element of the range
+            chunk_end: End (exclusive) of the range
+
+        Returns:
+            float64 numpy array of the decoded changes in the range
+        """
+        if self.method == 'topk':
+            indices = self.file.flat(name + '::indices')
+            lo, hi = np.searchsorted(indices, [chunk_start, chunk_end])
+            decoded = np.zeros(chunk_end - chunk_start, dtype=np.float64)
+            decoded[indices[lo:hi] - chunk_start] = self.file.flat(name + '::values')[lo:hi]
+            return decoded
+
+        first_block = chunk_start // self.block_size
+        last_block = (chunk_end - 1) // self.block_size
+        scales = np.repeat(self.file.flat(name + '::scales')[first_block:last_block + 1].astype(np.float64),
+                           self.block_size)
+        skip = chunk_start - first_block * self.block_size
+        return self.file.flat(name + '::q')[chunk_start:chunk_end].astype(np.float64) * \
+            scales[skip:skip + chunk_end - chunk_start]
+
+    def close(self):
+        self.file.close()
+
+
+def _apply_deltas(base, deltas, weights, output_dir, server_learning_rate, workers, chunk_elements, metadata):
+    """
+    Write base + server_learning_rate * sum(weight * delta) in one streaming pass over every file
+    """
+    # Changed integer buffers come from the heaviest client that changed them
+    raw_sources = {}
+    for delta, weight in sorted(zip(deltas, weights), key=lambda pair: pair[1]):
+        for name in base.header:
+            if delta.raw(name) is not None:
+                raw_sources[name] = delta
+
+    def apply_chunk(name, chunk_start, chunk_end):
+        dtype = base.dtype(name)
+        if dtype not in FLOAT_DTYPES:
+            source = raw_sources.get(name)
+            values = source.raw(name) if source is not None else base.flat(name)
+            return values[chunk_start:chunk_end]
+        update = deltas[0].decode_chunk(name, chunk_start, chunk_end) * weights[0]
+        for delta, weight in zip(deltas[1:], weights[1:]):
+            update += delta.decode_chunk(name, chunk_start, chunk_end) * weight
+        total = _to_float(base.flat(name)[chunk_start:chunk_end], dtype) + server_learning_rate * update
+        return _from_float(total, dtype)
+
+    os.makedirs(output_dir, exist_ok=True)
+    return write_tensors(base, os.path.join(output_dir, WEIGHTS_FILE), apply_chunk, metadata,
+                         workers=workers, chunk_elements=chunk_elements)
+
+
+def _open_deltas(base_path, delta_paths, verify):
+    """
+    Open delta files and check them against the base weights
+    """
+    base_hash = file_sha256(base_path) if verify else None
+    deltas = []
+    try:
+        for delta_path in delta_paths:
+            deltas.append(DeltaFile(delta_path))
+            if verify:
+                deltas[-1].verify(base_hash)
+    except Exception:
+        for delta in deltas:
+            delta.close()
+        raise
+    return deltas
+
+
+def apply_delta(base_model_dir, delta_path, output_dir, verify=True, workers=None,
+                chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    """
+    Rebuild a client model from the base model and its delta
+
+    Args:
+        base_model_dir: Path to the base model directory the delta was created against
+        delta_path: Path to the delta file
+        output_dir: Directory to write the rebuilt model to
+        verify: Whether to check the payload and base hashes first
+        workers: Number of threads applying chunks (default: number of CPUs)
+        chunk_elements: Number of elements per task
+    """
+    base = SafetensorsFile(weights_path(base_model_dir))
+    deltas = _open_deltas(base.path, [delta_path], verify)
+    try:
+        metadata = dict(base.metadata)
+        metadata['format'] = 'pt'
+        _apply_deltas(base, deltas, [1.0], output_dir, 1.0, workers, chunk_elements, metadata)
+    finally:
+        base.close()
+        deltas[0].close()
+    copy_model_files(base_model_dir, output_dir)
+
+
+def aggregate_deltas(base_model_dir, delta_paths, output_dir, sample_counts=None, server_learning_rate=1.0,
+                     verify=True, workers=None, chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    """
+    Aggregate client deltas into a new global model in one streaming pass (FedAvg on updates)
+
+    The new weights are base + server_learning_rate * the sample-weighted mean
+    of the decoded deltas; with a learning rate of 1 this equals averaging the
+    rebuilt client models. The base and every delta are memory-mapped and the
+    output is written chunk by chunk, so no delta is ever expanded to a full
+    model in memory.
+
+    Args:
+        base_model_dir: Path to the base model directory every delta was created against
+        delta_paths: List of delta files
+        output_dir: Directory to write the aggregated model to
+        sample_counts: Number of training samples per client (default: read from the deltas)
+        server_learning_rate: Scale of the averaged update applied to the base
+        verify: Whether to check every delta's payload and base hash first
+        workers: Number of threads aggregating chunks (default: number of CPUs)
+        chunk_elements: Number of elements per task
+
+    Returns:
+        Dictionary with the round information (also saved as federated_round.json)
+    """
+    if not delta_paths:
+        raise ValueError('At least one delta is needed to aggregate')
+    start = time.perf_counter()
+    base = SafetensorsFile(weights_path(base_model_dir))
+    deltas = []
+    try:
+        deltas = _open_deltas(base.path, delta_paths, verify)
+        if sample_counts is None:
+            sample_counts = [delta.num_samples for delta in deltas]
+            if any(count is None for count in sample_counts):
+                raise ValueError('Sample counts are needed for deltas that do not record one')
+        if len(sample_counts) != len(deltas):
+            raise ValueError(f'Got {len(sample_counts)} sample counts for {len(deltas)} deltas')
+        if any(count <= 0 for count in sample_counts):
+            raise ValueError('Sample counts must be positive')
+        total_samples = float(sum(sample_counts))
+        weights = [count / total_samples for count in sample_counts]
+
+        metadata = dict(base.metadata)
+        metadata.update({'format': 'pt', 'federated_algorithm': 'fedavg-delta', 'federated_clients': str(len(deltas))})
+        names = _apply_deltas(base, deltas, weights, output_dir, server_learning_rate, workers, chunk_elements, metadata)
+        parameters = int(sum(np.prod(base.shape(name), dtype=np.int64) for name in names))
+        methods = [delta.method for delta in deltas]
+    finally:
+        base.close()
+        for delta in deltas:
+            delta.close()
+    copy_model_files(base_model_dir, output_dir)
+
+    delta_bytes = [os.path.getsize(delta_path) for delta_path in delta_paths]
+    round_info = {
+        'algorithm': 'fedavg-delta',
+        'base_model': base_model_dir,
+        'server_learning_rate': server_learning_rate,
+        'clients': [
+            {'path': delta_path, 'method': method, 'num_samples': count, 'weight': weight, 'bytes': size}
+            for delta_path, method, count, weight, size in zip(delta_paths, methods, sample_counts, weights, delta_bytes)
+        ],
+        'total_samples': int(total_samples),
+        'tensors': len(names),
+        'parameters': parameters,
+        'upload_bytes': sum(delta_bytes),
+        'full_model_bytes': os.path.getsize(weights_path(base_model_dir)) * len(delta_paths),
+        'aggregation_seconds': time.perf_counter() - start,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with open(os.path.join(output_dir, ROUND_INFO_FILE), 'w') as f:
+        json.dump(round_info, f, indent=2)
+    return round_info
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+
+# Default anomaly keywords used by the heuristic approach
+DEFAULT_ANOMALY_KEYWORDS = [
+    'failed', 'failure', 'error', 'denied', 'unauthorized', 'suspicious',
+    'violation', 'attack', 'multiple', 'unusual', 'malware', 'virus',
+    'blocked', 'scan', 'breach', 'compromise', 'brute force', 'port scan',
+    'detection', 'detected', 'critical', 'down', 'outage', 'timeout'
+]
+
+
+def _trie_pattern(trie):
+    """
+    Turn a character trie into a regular expression with shared prefixes factored out
+
+    Args:
+        trie: Nested dictionary of characters, where the '' key marks the end of a keyword
+
+    Returns:
+        Regular expression source matching every keyword in the trie
+    """
+    alternatives = [re.escape(char) + _trie_pattern(trie[char]) for char in sorted(trie) if char]
+    if not alternatives:
+        return ''
+
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in trie:
+        # The keyword may also end here; the greedy '?' still prefers the longer match
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+def _is_word_char(char):
+    """
+    Check whether a character counts as part of a word, like \\w in a regex
+    """
+    return char.isalnum() or char == '_'
+
+
+class KeywordMatcher:
+    """
+    Match many anomaly keywords against log text in a single regex pass
+
+    All keywords are compiled into one regular expression built from a
+    prefix trie, so the cost of a lookup grows with the length of the log
+    line rather than with the number of keywords. The expression is a
+    lookahead, so it finds the longest keyword starting at every position;
+    the shorter keywords starting there are read off the trie. Keywords inside
+    or overlapping other keywords, like 'scan' in 'port scan', are therefore
+    all found, as with separate substring checks. By default keywords match
+    anywhere in the text, like the original substring checks; with
+    word_boundaries=True they must start and end on a word boundary, which
+    suits large lists of IOC terms.
+    """
+
+    def __init__(self, keywords=None, threshold=1.0, word_boundaries=False):
+        """
+        Initialize the keyword matcher
+
+        Args:
+            keywords: List of keywords, or dictionary mapping keywords to weights
+                      (default: DEFAULT_ANOMALY_KEYWORDS, each with weight 1.0)
+            threshold: Total weight of matched keywords needed to flag an anomaly
+            word_boundaries: Whether keywords must match whole words only
+        """
+        if keywords is None:
+            keywords = DEFAULT_ANOMALY_KEYWORDS
+        if not isinstance(keywords, dict):
+            keywords = {keyword: 1.0 for keyword in keywords}
+
+        self.weights = {}
+        for keyword, weight in keywords.items():
+            keyword = ' '.join(str(keyword).lower().split())
+            if keyword:
+                self.weights[keyword] = float(weight)
+
+        self.keywords = list(self.weights)
+        self.threshold = threshold
+        self.word_boundaries = word_boundaries
+
+        self._trie = {}
+        for keyword in self.keywords:
+            node = self._trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        # Zero-width, so matches starting inside an earlier match are found too
+        pattern = '(' + (_trie_pattern(self._trie) or '(?!)') + ')'
+        if word_boundaries:
+            pattern = r'(?<!\w)(?=' + pattern + r'(?!\w))'
+        else:
+            pattern = '(?=' + pattern + ')'
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path, threshold=1.0, word_boundaries=False):
+        """
+        Load keywords and their weights from a config file
+
+        JSON files may contain a list of keywords, a dictionary mapping keywords
+        to weights, or an object with 'keywords' and optional 'threshold' and
+        'word_boundaries' keys.
+        Any other file is read as plain text with one 'keyword' or
+        'keyword,weight' entry per line; blank lines and lines starting with '#'
+        are ignored.
+
+        Args:
+            path: Path to the keyword config file
+            threshold: Default total weight needed to flag an anomaly
+            word_boundaries: Default for whether keywords must match whole words only
+
+        Returns:
+            A KeywordMatcher for the loaded keywords
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Keyword file not found: {path}")
+
+        if path.lower().endswith('.json'):
+            with open(path) as f:
+                config = json.load(f)
+            if isinstance(config, dict) and 'keywords' in config:
+                threshold = config.get('threshold', threshold)
+                word_boundaries = config.get('word_boundaries', word_boundaries)
+                config = config['keywords']
+            return cls(config, threshold=threshold, word_boundaries=word_boundaries)
+
+        keywords = {}
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                keyword, _, weight = line.rpartition(',')
+                try:
+                    keywords[keyword or line] = float(weight) if keyword else 1.0
+                except ValueError:
+                    keywords[line] = 1.0
+        return cls(keywords, threshold=threshold, word_boundaries=word_boundaries)
+
+    def match(self, log_text):
+        """
+        Find the keywords present in a log line
+
+        Args:
+            log_text: The log text to search
+
+        Returns:
+            List of distinct matched keywords in order of first appearance
+        """
+        text = str(log_text)
+        found = {}
+        for match in self.pattern.finditer(text):
+            # Every keyword starting here is a prefix of the longest one
+            start = match.start()
+            longest = match.group(1).lower()
+            node = self._trie
+            for end, char in enumerate(longest, 1):
+                node = node.get(char)
+                if node is None:
+                    break
+                if '' in node and (end == len(longest) or not self.word_boundaries
+                                   or not _is_word_char(text[start + end])):
+                    found.setdefault(longest[:end], None)
+        return list(found)
+
+    def score(self, matched_keywords):
+        """
+        Sum the weights of matched keywords
+
+        Args:
+            matched_keywords: List of keywords returned by match
+
+        Returns:
+            Total weight of the matched keywords
+        """
+        return sum(self.weights.get(keyword, 0.0) for keyword in matched_keywords)
+
+    def is_anomaly(self, matched_keywords):
+        """
+        Decide whether the matched keywords are enough to flag an anomaly
+
+        Args:
+            matched_keywords: List of keywords returned by match
+
+        Returns:
+            True if the total weight reaches the threshold
+        """
+        return bool(matched_keywords) and self.score(matched_keywords) >= self.threshold
+
+    def match_series(self, log_series):
+        """
+        Find the keywords present in every log of a pandas Series
+
+        Args:
+            log_series: pandas Series of log texts
+
+        Returns:
+            pandas Series of lists of distinct matched keywords
+        """
+        return log_series.fillna('').astype(str).map(self.match)
+
+    def anomaly_series(self, log_series):
+        """
+        Flag anomalies for every log of a pandas Series
+
+        Args:
+            log_series: pandas Series of log texts
+
+        Returns:
+            Tuple of (boolean Series of anomaly flags, Series of matched keyword lists)
+        """
+        matches = self.match_series(log_series)
+        flags = matches.map(self.is_anomaly).astype(bool)
+        return flags, matches
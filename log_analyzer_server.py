@@ -0,0 +1,500 @@
+import json
+import time
+import signal
+import asyncio
+import traceback
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from model_backends import BACKENDS
+from log_analyzer_tool import MAX_LENGTH_PROFILES, WINDOW_AGGREGATIONS, LogAnalyzerTool, parse_max_length
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+def _percentile(sorted_values, percent):
+    """
+    Linearly interpolated percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class ServerMetrics:
+    """
+    Request, batch and latency counters reported by the /metrics endpoint
+    """
+
+    def __init__(self, latency_window=10000, registry=None):
+        """
+        Initialize the counters
+
+        Args:
+            latency_window: Number of most recent request latencies kept for percentiles
+            registry: MetricsRegistry that request counts and latencies are also recorded in (optional)
+        """
+        self.registry = registry
+        self.start_time = time.time()
+        self.requests = {}
+        self.errors = 0
+        self.logs = 0
+        self.batches = 0
+        self.batched_logs = 0
+        self.max_batch_logs = 0
+        self.inference_seconds = 0.0
+        self.latencies = deque(maxlen=latency_window)
+
+    def record_request(self, path, status, seconds):
+        """
+        Record a finished HTTP request
+
+        Args:
+            path: Request path
+            status: HTTP status code of the response
+            seconds: Time from reading the request to sending the response
+        """
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if status >= 400:
+            self.errors += 1
+        if path in ('/predict', '/predict_batch') and status == 200:
+            self.latencies.append(seconds)
+        if self.registry is not None:
+            self.registry.increment('http_requests_total', labels={'path': path, 'status': status})
+            self.registry.observe('http_request_seconds', seconds, {'path': path})
+
+    def record_batch(self, num_logs, seconds):
+        """
+        Record one micro-batch sent through the analyzer
+
+        Args:
+            num_logs: Number of logs in the micro-batch
+            seconds: Time spent classifying it
+        """
+        self.batches += 1
+        self.batched_logs += num_logs
+        self.max_batch_logs = max(self.max_batch_logs, num_logs)
+        self.inference_seconds += seconds
+
+    def snapshot(self):
+        """
+        Get the current counters
+
+        Returns:
+            Dictionary of request counts, batch sizes and latency percentiles
+        """
+        latencies = sorted(self.latencies)
+        return {
+            'uptime_seconds': time.time() - self.start_time,
+            'requests': dict(self.requests),
+            'errors': self.errors,
+            'logs_classified': self.logs,
+            'batches': self.batches,
+            'mean_batch_logs': self.batched_logs / self.batches if self.batches else 0.0,
+            'max_batch_logs': self.max_batch_logs,
+            'inference_seconds': self.inference_seconds,
+            'latency_ms': {
+                'p50': _percentile(latencies, 50) * 1000,
+                'p90': _percentile(latencies, 90) * 1000,
+                'p99': _percentile(latencies, 99) * 1000,
+                'max': latencies[-1] * 1000 if latencies else 0.0,
+            },
+        }
+
+
+class MicroBatcher:
+    """
+    Merge concurrent prediction requests into micro-batches
+
+    The first waiting request opens a batch; requests arriving within
+    max_wait_ms join it until it holds max_batch_size logs. Each batch is
+    classified with a single predict_batch call on a dedicated inference
+    thread, so the event loop keeps accepting requests, which queue up for
+    the next batch, while the model runs.
+    """
+
+    def __init__(self, analyzer, metrics, max_batch_size=256, max_wait_ms=5.0):
+        """
+        Initialize the micro-batcher
+
+        Args:
+            analyzer: LogAnalyzerTool used for predictions
+            metrics: ServerMetrics to record batches in
+            max_batch_size: Maximum number of logs merged into one batch
+            max_wait_ms: Longest time a request waits for others to join its batch
+        """
+        self.analyzer = analyzer
+        self.metrics = metrics
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+
+    def start(self):
+        """
+        Start the batching task on the running event loop
+        """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the batching task and the inference thread
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    def queue_depth(self):
+        """
+        Get the number of requests waiting for a batch
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, log_texts):
+        """
+        Classify logs as part of the next micro-batch
+
+        Args:
+            log_texts: List of log texts
+
+        Returns:
+            List of prediction dictionaries in the same order as log_texts
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((log_texts, future))
+        return await future
+
+    async def _run(self):
+        """
+        Collect queued requests into batches and classify them
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            num_logs = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+
+            while num_logs < self.max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                items.append(item)
+                num_logs += len(item[0])
+
+            log_texts = [log_text for texts, _ in items for log_text in texts]
+            start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(self._executor, self.analyzer.predict_batch, log_texts)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(log_texts), time.perf_counter() - start)
+
+            offset = 0
+            for texts, future in items:
+                if not future.done():
+                    future.set_result(predictions[offset:offset + len(texts)])
+                offset += len(texts)
+
+
+class AnalysisServer:
+    """
+    HTTP/JSON service that keeps one LogAnalyzerTool warm
+
+    Endpoints:
+        POST /predict        {"log": "..."}         -> prediction
+        POST /predict_batch  {"logs": ["...", ...]} -> {"predictions": [...]}
+        GET  /health                                -> service status
+        GET  /metrics                               -> request, batch and latency counters
+        GET  /metrics/prometheus                    -> the same plus analyzer hot-path metrics, as Prometheus text
+    """
+
+    def __init__(self, analyzer, host='127.0.0.1', port=8765, max_batch_size=256, max_wait_ms=5.0,
+                 max_body_bytes=10 * 1024 * 1024):
+        """
+        Initialize the server
+
+        Args:
+            analyzer: LogAnalyzerTool used for predictions
+            host: Interface to listen on
+            port: Port to listen on
+            max_batch_size: Maximum number of logs merged into one micro-batch
+            max_wait_ms: Longest time a request waits for others to join its micro-batch
+            max_body_bytes: Largest request body accepted
+        """
+        self.analyzer = analyzer
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.metrics = ServerMetrics(registry=analyzer.metrics)
+        self.batcher = MicroBatcher(analyzer, self.metrics, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def serve(self, stop_event=None):
+        """
+        Accept connections until stop_event is set
+
+        Args:
+            stop_event: asyncio.Event that shuts the server down when set (default: run forever)
+        """
+        stop_event = stop_event or asyncio.Event()
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f'Log analyzer service listening on http://{self.host}:{self.port}')
+        try:
+            async with server:
+                await stop_event.wait()
+        finally:
+            await self.batcher.stop()
+        print('Log analyzer service stopped')
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serve HTTP/1.1 requests on one connection, keeping it alive between requests
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                start = time.perf_counter()
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                path = urlsplit(target).path
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > self.max_body_bytes:
+                    status = 413 if length > 0 else 400
+                    await self._respond(writer, status, {'error': 'Invalid or too large request body'}, keep_alive=False)
+                    self.metrics.record_request(path, status, time.perf_counter() - start)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self._dispatch(method, path, body)
+                await self._respond(writer, status, payload, keep_alive)
+                self.metrics.record_request(path, status, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        """
+        Route a request to its handler
+
+        Returns:
+            Tuple of (HTTP status code, JSON-serializable response payload)
+        """
+        routes = {
+            '/predict': ('POST', self._predict),
+            '/predict_batch': ('POST', self._predict_batch),
+            '/health': ('GET', self._health),
+            '/metrics': ('GET', self._metrics),
+            '/metrics/prometheus': ('GET', self._prometheus_metrics),
+        }
+        if path not in routes:
+            return 404, {'error': f'Unknown endpoint {path}'}
+        expected_method, handler = routes[path]
+        if method != expected_method:
+            return 405, {'error': f'{path} only accepts {expected_method}'}
+
+        try:
+            return await handler(body)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            print(f'Error handling {path}: {str(e)}')
+            traceback.print_exc()
+            return 500, {'error': str(e)}
+
+    def _parse_body(self, body, field):
+        """
+        Decode a JSON request body and extract one field from it
+        """
+        try:
+            payload = json.loads(body or b'{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON: {str(e)}')
+        if not isinstance(payload, dict) or field not in payload:
+            raise ValueError(f'Request body must be a JSON object with a "{field}" field')
+        return payload[field]
+
+    async def _predict(self, body):
+        log_text = self._parse_body(body, 'log')
+        if not isinstance(log_text, str):
+            raise ValueError('"log" must be a string')
+        predictions = await self.batcher.submit([log_text])
+        self.metrics.logs += 1
+        return 200, predictions[0]
+
+    async def _predict_batch(self, body):
+        log_texts = self._parse_body(body, 'logs')
+        if not isinstance(log_texts, list) or not all(isinstance(log_text, str) for log_text in log_texts):
+            raise ValueError('"logs" must be a list of strings')
+        predictions = await self.batcher.submit(log_texts) if log_texts else []
+        self.metrics.logs += len(log_texts)
+        return 200, {'predictions': predictions}
+
+    async def _health(self, body):
+        return 200, {
+            'status': 'ok' if self.analyzer.model_loaded or not self.analyzer.use_model else 'degraded',
+            'model_loaded': self.analyzer.model_loaded,
+            'backend': self.analyzer.backend,
+            'uptime_seconds': time.time() - self.metrics.start_time,
+            'queue_depth': self.batcher.queue_depth(),
+        }
+
+    async def _metrics(self, body):
+        metrics = self.metrics.snapshot()
+        metrics['queue_depth'] = self.batcher.queue_depth()
+        cache_stats = self.analyzer.get_cache_stats()
+        if cache_stats:
+            metrics['prediction_cache'] = cache_stats
+        template_stats = self.analyzer.get_template_stats()
+        if template_stats:
+            metrics['templates'] = template_stats
+        cascade_stats = self.analyzer.get_cascade_stats()
+        if cascade_stats:
+            metrics['cascade'] = cascade_stats
+        metrics['analyzer'] = self.analyzer.metrics.snapshot()
+        return 200, metrics
+
+    async def _prometheus_metrics(self, body):
+        return 200, self.analyzer.metrics.to_prometheus()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        """
+        Write a JSON response, or a plain text one if the payload is a string
+        """
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = json.dumps(payload).encode('utf-8')
+            content_type = 'application/json'
+        headers = [
+            f'HTTP/1.1 {status} {HTTP_REASONS.get(status, "")}',
+            f'Content-Type: {content_type}',
+            f'Content-Length: {len(body)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}',
+        ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+def main():
+    """
+    Main function to run the log analyzer service
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve log classification over HTTP with a warm model')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--model', default='AI/main-federated-roberta-model', help='Path to model directory')
+    parser.add_argument('--hybrid', action='store_true', help='Use hybrid model+heuristic approach')
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of logs per model forward pass')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='Maximum number of logs merged into one micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='Longest time a request waits for others to join its micro-batch')
+    parser.add_argument('--cache-size', type=int, default=10000, help='Number of log templates whose predictions are cached in memory (0 disables)')
+    parser.add_argument('--cache-path', help='Path to a SQLite file for a persistent prediction cache')
+    parser.add_argument('--keywords', help='Path to a JSON or text file of weighted anomaly keywords for the heuristic')
+    parser.add_argument('--cascade', help='Path to a calibrated cascade directory; confident logs skip the model')
+    parser.add_argument('--templates', action='store_true', help='Mine log templates and classify each template once')
+    parser.add_argument('--template-state', help='JSON file mined templates are loaded from and saved to (implies --templates)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for model inference')
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend')
+    parser.add_argument('--max-length', type=parse_max_length, help=f"Tokens per model input: {', '.join(MAX_LENGTH_PROFILES)} or a number (default: the model's limit)")
+    parser.add_argument('--window-aggregation', choices=WINDOW_AGGREGATIONS, default='max', help='How the window predictions of a long log are combined')
+    parser.add_argument('--heuristic-only', action='store_true', help='Skip the model and classify with keyword heuristics only')
+
+    args = parser.parse_args()
+
+    # Load the model and start any inference workers before serving the first request
+    analyzer = LogAnalyzerTool(
+        model_path=args.model,
+        use_hybrid_approach=args.hybrid,
+        batch_size=args.batch_size,
+        cache_size=args.cache_size,
+        cache_path=args.cache_path,
+        keywords_path=args.keywords,
+        workers=args.workers,
+        backend=args.backend,
+        lazy_load=False,
+        use_model=not args.heuristic_only,
+        cascade_path=args.cascade,
+        mine_templates=args.templates,
+        template_state_path=args.template_state,
+        max_length=args.max_length,
+        window_aggregation=args.window_aggregation
+    )
+    if analyzer.model_loaded and analyzer.workers > 1:
+        analyzer._get_worker_pool(fork=True)
+
+    server = AnalysisServer(
+        analyzer,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms
+    )
+
+    async def run():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop_event.set)
+            except (NotImplementedError, AttributeError, ValueError):
+                pass  # Not supported on Windows; Ctrl+C still raises KeyboardInterrupt
+        await server.serve(stop_event)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        analyzer.close()
+
+
+if __name__ == '__main__':
+    main()
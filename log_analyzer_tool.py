@@ -1,20 +1,144 @@
 import os
 import sys
 import csv
+import copy
 import json
-import pandas as pd
-import psycopg2
-from psycopg2.extras import execute_values
-import torch
-from transformers import RobertaTokenizer, RobertaForSequenceClassification, logging
+import math
+import time
+
+# Reference point for --profile-startup
+_process_start = time.perf_counter()
+
+import threading
+import multiprocessing
 import traceback
+from contextlib import contextmanager
+
+from analyzer_metrics import MetricsRegistry, ProgressReporter
+from keyword_matcher import KeywordMatcher
+from model_backends import BACKENDS
+from prediction_cache import PredictionCache
+
+# torch, transformers, pandas and psycopg2 are imported where they are first
+# needed, so that --help and heuristic-only runs start without loading them.
+
+# Model directories resolved in this process, keyed by (working directory, requested path)
+_resolved_model_paths = {}
+
+# Analyzer used by the worker processes of the inference pool
+_worker_analyzer = None
+
+# Rows classified between progress updates in analyze_csv
+PROGRESS_SLICE_ROWS = 10000
+
+# Named --max-length profiles, in tokens including the model's special tokens
+MAX_LENGTH_PROFILES = {'short': 64, 'medium': 128, 'full': 512}
+
+# Ways the window predictions of a long log can be combined
+WINDOW_AGGREGATIONS = ['max', 'mean']
+
+def parse_max_length(value):
+    """
+    Turn a --max-length profile name or token count into a token count
+    
+    Args:
+        value: A name from MAX_LENGTH_PROFILES or a number of tokens
+        
+    Returns:
+        Maximum number of tokens per forward pass sequence
+    """
+    if value in MAX_LENGTH_PROFILES:
+        return MAX_LENGTH_PROFILES[value]
+    max_length = int(value)
+    if max_length < 8:
+        raise ValueError(f"max length must be at least 8 tokens, got {max_length}")
+    return max_length
+
+def _init_inference_worker(analyzer_kwargs, num_threads):
+    """
+    Prepare a worker process of the inference pool
+    
+    Forked workers inherit the already loaded analyzer from the parent process;
+    spawned workers load their own copy of the model, whose safetensors weights
+    are memory-mapped and shared through the OS page cache.
+    
+    Args:
+        analyzer_kwargs: Keyword arguments to create an analyzer with if none was inherited
+        num_threads: Number of torch intra-op threads this worker may use
+    """
+    import torch
+    
+    global _worker_analyzer
+    torch.set_num_threads(num_threads)
+    if _worker_analyzer is None:
+        _worker_analyzer = LogAnalyzerTool(**analyzer_kwargs)
+
+def _forward_in_worker(batches):
+    """
+    Run a group of padded batches through the model inside a pool worker
+    
+    The forward pass timings are returned with the outputs, since metrics
+    recorded in the worker would stay in its own copy of the registry.
+    """
+    timings = []
+    return _worker_analyzer._forward_batches(batches, timings), timings
+
+def resolve_model_path(model_path):
+    """
+    Find the model directory, trying a list of alternative locations if needed
+    
+    The result is cached for the lifetime of the process.
+    
+    Args:
+        model_path: Requested path to the model directory
+        
+    Returns:
+        Path to an existing model directory
+    """
+    cache_key = (os.getcwd(), model_path)
+    if cache_key in _resolved_model_paths:
+        return _resolved_model_paths[cache_key]
+    
+    resolved_path = model_path
+    if not os.path.exists(model_path):
+        print(f"Model directory not found: {model_path}")
+        
+        # Try some alternative paths
+        alternative_paths = [
+            os.path.join(os.getcwd(), model_path),
+            os.path.join(os.getcwd(), 'AI', 'main-federated-roberta-model'),
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AI', 'main-federated-roberta-model'),
+            'AI/main-federated-roberta-model',
+            './AI/main-federated-roberta-model',
+            '../AI/main-federated-roberta-model',
+            'AI/roberta-log-model',  # Try other models
+            'AI/bert-log-model',
+            'AI/bgl-roberta-model',
+            'AI/hdfs_roberta_model',
+            'AI/bgl-bert-base-model'
+        ]
+        
+        for alt_path in alternative_paths:
+            if os.path.exists(alt_path):
+                print(f"Found model at alternative path: {alt_path}")
+                resolved_path = alt_path
+                break
+        else:
+            raise FileNotFoundError("Model directory not found at any path")
+    
+    _resolved_model_paths[cache_key] = resolved_path
+    return resolved_path
 
-# Set transformers logging to show only errors
-logging.set_verbosity_error()
 
 class LogAnalyzerTool:
     def __init__(self, model_path='AI/main-federated-roberta-model', 
-                 db_config=None, use_hybrid_approach=False):
+                 db_config=None, use_hybrid_approach=False, batch_size=32,
+                 cache_size=10000, cache_path=None, keywords_path=None, workers=1,
+                 backend='torch', lazy_load=True, use_model=True,
+                 db_batch_size=50000, copy_format='csv', incremental=False, metrics=None,
+                 cascade_path=None, mine_templates=False, template_state_path=None, async_db=False,
+                 db_spool_dir='db_spool', detect_sequences=False, escalate_sequences=False,
+                 max_length=None, window_overlap=None, max_windows=16, window_aggregation='max'):
         """
         Initialize the Log Analyzer tool
         
@@ -22,7 +146,46 @@ class LogAnalyzerTool:
             model_path: Path to the RoBERTa model directory
             db_config: Database configuration dictionary
             use_hybrid_approach: Whether to use hybrid model+heuristic approach (default: False)
+            batch_size: Number of logs per model forward pass (default: 32)
+            cache_size: Number of log templates whose predictions are kept in memory (0 disables)
+            cache_path: Path to a SQLite file for a persistent prediction cache (optional)
+            keywords_path: Path to a JSON or text file of weighted anomaly keywords (optional)
+            workers: Number of processes used for model inference (default: 1)
+            backend: Inference backend: 'torch', 'torch-int8' or 'onnx' (default: 'torch')
+            lazy_load: Whether to defer loading the model until the first prediction (default: True)
+            use_model: Whether to use the model at all; False runs heuristic-only (default: True)
+            db_batch_size: Number of rows per COPY and commit when saving to the database (default: 50000)
+            copy_format: COPY framing used when saving to the database, 'csv' or 'binary' (default: 'csv')
+            incremental: Whether to skip rows already saved to the database and upsert results (default: False)
+            metrics: MetricsRegistry to record hot-path timings and counters in (default: a new registry)
+            cascade_path: Path to a calibrated cascade directory; confident logs are then decided
+                          by the cache, keyword and linear stages and only the rest reach the model (optional)
+            mine_templates: Whether to mine Drain templates and classify each template once (default: False)
+            template_state_path: JSON file the mined templates are loaded from and saved to, keeping
+                                 template ids stable across runs; implies mine_templates (optional)
+            async_db: Whether save_to_database hands results to a background DatabaseSink instead of
+                      waiting for the insert (default: False)
+            db_spool_dir: Directory where results are kept while the database is unavailable (default: 'db_spool')
+            detect_sequences: Whether to flag rate spikes, template bursts and rare template transitions
+                              per device and user in a 'sequence_flags' result field (default: False)
+            escalate_sequences: Whether lines with sequence flags are reported as anomalies; implies
+                                detect_sequences (default: False)
+            max_length: Tokens per model input, as a number or a MAX_LENGTH_PROFILES name; longer logs
+                        are split into overlapping windows (default: the model's limit, 512 for RoBERTa)
+            window_overlap: Tokens shared by consecutive windows of a long log (default: a quarter of max_length)
+            max_windows: Most windows classified per log; longer logs get windows spread evenly over
+                         their length (default: 16)
+            window_aggregation: How window predictions are combined: 'max' reports the log as anomalous
+                                if any window is, 'mean' averages the anomaly probabilities (default: 'max')
         """
+        init_start = time.perf_counter()
+        
+        # Time spent in each startup phase, in seconds
+        self.startup_timings = {}
+        
+        # Counters and latency histograms for the analysis hot paths
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        
         # Set default database config if none provided
         if db_config is None:
             self.db_config = {
@@ -35,46 +198,138 @@ class LogAnalyzerTool:
         else:
             self.db_config = db_config
         
+        # Bulk loading settings for save_to_database
+        self.db_batch_size = db_batch_size
+        self.copy_format = copy_format
+        
+        # Skip rows whose fingerprint is already in the database and upsert the rest
+        self.incremental = incremental
+        
+        # Background database writer - created on the first save when async_db is set
+        self.async_db = async_db
+        self.db_spool_dir = db_spool_dir
+        self._db_sink = None
+        
         # Flag to determine if we should use hybrid model+heuristic approach
         self.use_hybrid_approach = use_hybrid_approach
         
         # Set model path
         self.model_path = model_path
         
-        # Flag to track if model is loaded successfully
+        # Number of logs sent through the model in a single forward pass
+        self.batch_size = max(1, int(batch_size))
+        
+        # Prediction cache settings - the cache itself is created once the model is loaded
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.prediction_cache = None
+        
+        # Inference backend used for forward passes
+        self.backend = backend
+        self._forward_logits = None
+        
+        # Long logs are split into overlapping windows of at most max_length tokens,
+        # capped at the model's own limit once it is loaded
+        if window_aggregation not in WINDOW_AGGREGATIONS:
+            raise ValueError(f"Unknown window aggregation: {window_aggregation}")
+        self.max_length = parse_max_length(max_length) if max_length is not None else None
+        self.window_overlap = window_overlap
+        self.max_windows = max(1, int(max_windows))
+        self.window_aggregation = window_aggregation
+        
+        # Inference worker processes - the pool is created on first use
+        self.workers = max(1, int(workers))
+        self._worker_pool = None
+        self._thread_local = threading.local()
+        self._worker_kwargs = {
+            'model_path': model_path,
+            'db_config': db_config,
+            'batch_size': batch_size,
+            'cache_size': 0,
+            'backend': backend,
+            'lazy_load': False,
+            'max_length': max_length,
+        }
+        
+        # Flags to track whether the model should be, has been tried to be, and is loaded
+        self.use_model = use_model
+        self._model_load_attempted = not use_model
         self.model_loaded = False
+        self.device = None
+        
+        # Compile the anomaly keywords for the heuristic into a single matcher
+        with self._time_phase('keywords'):
+            if keywords_path:
+                self.keyword_matcher = KeywordMatcher.from_file(keywords_path)
+                print(f"Loaded {len(self.keyword_matcher.keywords)} anomaly keywords from {keywords_path}")
+            else:
+                self.keyword_matcher = KeywordMatcher()
+            self.anomaly_keywords = self.keyword_matcher.keywords
         
-        # Debug information
-        print(f"Python version: {sys.version}")
-        print(f"Current directory: {os.getcwd()}")
-        print(f"Starting model path: {model_path}")
+        # Online template miner - each template is classified once and its verdict shared by every member line
+        self.template_miner = None
+        self.template_state_path = template_state_path
+        if mine_templates or template_state_path:
+            from template_miner import DrainTemplateMiner
+            
+            # Anomaly keywords must match exactly, so e.g. 'failed' and 'succeeded' lines are never merged
+            self.template_miner = DrainTemplateMiner(is_protected=lambda token: bool(self.keyword_matcher.match(token)))
+            if template_state_path and os.path.exists(template_state_path):
+                self.template_miner.load(template_state_path)
+                print(f"Loaded {len(self.template_miner.clusters)} log templates from {template_state_path}")
         
-        # Check if path exists before proceeding
-        if not os.path.exists(model_path):
-            print(f"WARNING: Initial model path does not exist: {model_path}")
+        # Windowed per-device and per-user detector run over the results in order
+        self.sequence_detector = None
+        self.escalate_sequences = escalate_sequences
+        if detect_sequences or escalate_sequences:
+            from sequence_detector import SequenceDetector
+            self.sequence_detector = SequenceDetector()
         
-        # Set up device (GPU if available, else CPU)
+        # Calibrated cheap stages that decide confident logs before the model
+        self.cascade = None
+        self.cascade_stats = {}
+        if cascade_path:
+            with self._time_phase('cascade'):
+                from cascade import CascadeModel
+                self.cascade = CascadeModel.load(cascade_path)
+            print(f"Loaded cascade from {cascade_path} (linear stage decides below {self.cascade.normal_threshold:.3f} "
+                  f"and above {self.cascade.anomaly_threshold:.3f}, keyword stage {'on' if self.cascade.use_keywords else 'off'})")
+        
+        if not use_model:
+            print("Model disabled. System will use heuristic-only analysis.")
+            self.use_hybrid_approach = True  # Force hybrid approach to use heuristic fallback
+        elif not lazy_load:
+            self._ensure_model_loaded()
+        
+        self.startup_timings['init'] = time.perf_counter() - init_start
+    
+    @contextmanager
+    def _time_phase(self, phase):
+        """
+        Record how long a startup phase takes in self.startup_timings
+        
+        Args:
+            phase: Name of the phase
+        """
+        start = time.perf_counter()
         try:
-            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            print(f"Using device: {self.device}")
-            print(f"PyTorch version: {torch.__version__}")
-            
-            if self.device.type == 'cuda':
-                print(f"CUDA device name: {torch.cuda.get_device_name(0)}")
-                print(f"CUDA version: {torch.version.cuda}")
-                
-        except Exception as e:
-            print(f"Error setting up device: {str(e)}")
-            self.device = torch.device("cpu")
-            print("Falling back to CPU")
+            yield
+        finally:
+            self.startup_timings[phase] = self.startup_timings.get(phase, 0.0) + time.perf_counter() - start
+    
+    def _ensure_model_loaded(self):
+        """
+        Load the model the first time it is needed
         
-        # Define anomaly keywords for heuristic
-        self.anomaly_keywords = [
-            'failed', 'failure', 'error', 'denied', 'unauthorized', 'suspicious',
-            'violation', 'attack', 'multiple', 'unusual', 'malware', 'virus',
-            'blocked', 'scan', 'breach', 'compromise', 'brute force', 'port scan',
-            'detection', 'detected', 'critical', 'down', 'outage', 'timeout'
-        ]
+        If loading fails, diagnostics are printed and the analyzer continues in
+        heuristic-only mode.
+        
+        Returns:
+            True if the model is loaded, False otherwise
+        """
+        if self._model_load_attempted:
+            return self.model_loaded
+        self._model_load_attempted = True
         
         # Try to load the model
         try:
@@ -87,6 +342,9 @@ class LogAnalyzerTool:
             print("\nDIAGNOSTIC INFORMATION:")
             
             try:
+                print(f"Python version: {sys.version}")
+                print(f"Current directory: {os.getcwd()}")
+                
                 # Check transformers version
                 import transformers
                 print(f"Transformers version: {transformers.__version__}")
@@ -97,6 +355,9 @@ class LogAnalyzerTool:
                     print(f"Contents: {os.listdir(self.model_path)}")
                 else:
                     print(f"Model directory does not exist at: {self.model_path}")
+                    print(f"Directory contents: {os.listdir('.')}")
+                    if os.path.exists('AI'):
+                        print(f"AI directory contents: {os.listdir('AI')}")
                 
                 # Check for common issues
                 print("\nPossible issues:")
@@ -110,121 +371,165 @@ class LogAnalyzerTool:
             print("\nContinuing in heuristic-only mode...")
             self.model_loaded = False
             self.use_hybrid_approach = True  # Force hybrid approach to use heuristic fallback
+        
+        return self.model_loaded
     
     def _load_model(self):
         """
         Load the tokenizer and model from the specified path
         """
-        # Check if model directory exists
-        if not os.path.exists(self.model_path):
-            print(f"Model directory not found: {self.model_path}")
-            print(f"Current directory: {os.getcwd()}")
-            print(f"Directory contents: {os.listdir('.')}")
-            if os.path.exists('AI'):
-                print(f"AI directory contents: {os.listdir('AI')}")
-            
-            # Try some alternative paths
-            alternative_paths = [
-                os.path.join(os.getcwd(), self.model_path),
-                os.path.join(os.getcwd(), 'AI', 'main-federated-roberta-model'),
-                os.path.join(os.path.dirname(__file__), 'AI', 'main-federated-roberta-model'),
-                'AI/main-federated-roberta-model',
-                './AI/main-federated-roberta-model',
-                '../AI/main-federated-roberta-model',
-                'AI/roberta-log-model',  # Try other models
-                'AI/bert-log-model',
-                'AI/bgl-roberta-model',
-                'AI/hdfs_roberta_model',
-                'AI/bgl-bert-base-model'
-            ]
-            
-            for alt_path in alternative_paths:
-                if os.path.exists(alt_path):
-                    print(f"Found model at alternative path: {alt_path}")
-                    self.model_path = alt_path
-                    break
-            
-            if not os.path.exists(self.model_path):
-                raise FileNotFoundError(f"Model directory not found at any path")
-        
-        # Try to load model
-        print(f"Loading model from {self.model_path}...")
+        # Find the model directory, reusing the path resolved earlier in this process
+        with self._time_phase('resolve_model_path'):
+            self.model_path = resolve_model_path(self.model_path)
         
-        # Verify model directory contents
-        print(f"Model directory contents: {os.listdir(self.model_path)}")
+            # Check for essential files
+            essential_files = ['config.json', 'model.safetensors']
+            for file in essential_files:
+                if not os.path.exists(os.path.join(self.model_path, file)):
+                    raise FileNotFoundError(f"Essential file '{file}' missing from model directory")
         
-        # Check for essential files
-        essential_files = ['config.json', 'model.safetensors']
-        for file in essential_files:
-            if not os.path.exists(os.path.join(self.model_path, file)):
-                raise FileNotFoundError(f"Essential file '{file}' missing from model directory")
+        with self._time_phase('import_torch'):
+            import torch
+            from transformers import RobertaTokenizer, RobertaTokenizerFast, RobertaForSequenceClassification, logging
+            
+            # Set transformers logging to show only errors
+            logging.set_verbosity_error()
         
-        # Try loading tokenizer first
-        print("Loading tokenizer...")
+        # Set up device (GPU if available, else CPU)
         try:
-            self.tokenizer = RobertaTokenizer.from_pretrained(self.model_path)
-            print("Tokenizer loaded successfully")
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            if self.device.type == 'cuda':
+                print(f"Using device: {self.device} ({torch.cuda.get_device_name(0)})")
         except Exception as e:
-            print(f"Failed to load tokenizer: {str(e)}")
-            traceback.print_exc()
-            raise
+            print(f"Error setting up device: {str(e)}")
+            self.device = torch.device("cpu")
+            print("Falling back to CPU")
+        
+        print(f"Loading model from {self.model_path}...")
+        
+        # Try loading tokenizer first, preferring the Rust-backed fast tokenizer
+        with self._time_phase('load_tokenizer'):
+            try:
+                self.tokenizer = RobertaTokenizerFast.from_pretrained(self.model_path)
+            except Exception as e:
+                print(f"Fast tokenizer unavailable ({str(e)}), falling back to the Python tokenizer")
+                try:
+                    self.tokenizer = RobertaTokenizer.from_pretrained(self.model_path)
+                except Exception as e:
+                    print(f"Failed to load tokenizer: {str(e)}")
+                    traceback.print_exc()
+                    raise
         
         # Then try loading model
-        print("Loading model...")
-        try:
-            self.model = RobertaForSequenceClassification.from_pretrained(self.model_path)
-            self.model.to(self.device)
-            self.model.eval()
-            self.model_loaded = True
-            print("Model loaded successfully")
-        except Exception as e:
-            print(f"Failed to load model: {str(e)}")
-            traceback.print_exc()
-            raise
+        with self._time_phase('load_model'):
+            try:
+                from model_backends import load_backend
+                
+                self.model = RobertaForSequenceClassification.from_pretrained(self.model_path)
+                self.model.to(self.device)
+                self.model.eval()
+                self._forward_logits = load_backend(self.backend, self.model, self.model_path, self.device)
+                self._resolve_window_settings()
+                self.model_loaded = True
+                print(f"Model loaded successfully ({self.backend} backend, {self.device})")
+            except Exception as e:
+                print(f"Failed to load model: {str(e)}")
+                traceback.print_exc()
+                raise
+        
+        # Cache model predictions per log template for this model version
+        if self.cache_size or self.cache_path:
+            self.prediction_cache = PredictionCache(
+                max_size=self.cache_size or 0,
+                cache_path=self.cache_path,
+                namespace=self._model_cache_namespace()
+            )
         
         print(f"Using {'hybrid' if self.use_hybrid_approach else 'model-only'} approach")
     
+    def _resolve_window_settings(self):
+        """
+        Fit the requested max length and window overlap to the loaded tokenizer and model
+        """
+        # RoBERTa position ids start after the padding index, so two positions are never used
+        limit = self.tokenizer.model_max_length
+        positions = getattr(self.model.config, 'max_position_embeddings', None)
+        if positions:
+            limit = min(limit, positions - 2)
+        if self.max_length is None:
+            self.max_length = limit
+        elif self.max_length > limit:
+            print(f"Max length {self.max_length} exceeds the model's limit, using {limit} tokens")
+            self.max_length = limit
+        
+        # Special tokens the tokenizer wraps a single log in, e.g. <s> ... </s>
+        wrapped = self.tokenizer('log')['input_ids']
+        bare = self.tokenizer('log', add_special_tokens=False)['input_ids']
+        prefix_length = next(i for i in range(len(wrapped)) if wrapped[i:i + len(bare)] == bare)
+        self._special_prefix = list(wrapped[:prefix_length])
+        self._special_suffix = list(wrapped[prefix_length + len(bare):])
+        
+        # Tokens of a window left for the log itself, and how far each window moves on
+        self._window_tokens = self.max_length - len(self._special_prefix) - len(self._special_suffix)
+        overlap = self.max_length // 4 if self.window_overlap is None else int(self.window_overlap)
+        self.window_overlap = min(max(0, overlap), self._window_tokens // 2)
+    
+    def _model_cache_namespace(self):
+        """
+        Identify the loaded model so cached predictions are not shared between models
+        
+        Returns:
+            String built from the model path, the size and modification time of its
+            weights, the inference backend and the windowing settings
+        """
+        weights = os.stat(os.path.join(self.model_path, 'model.safetensors'))
+        return (f"{os.path.abspath(self.model_path)}:{weights.st_size}:{int(weights.st_mtime)}:{self.backend}"
+                f":{self.max_length}:{self.window_overlap}:{self.max_windows}:{self.window_aggregation}")
+    
+    def get_cache_stats(self):
+        """
+        Get hit/miss statistics for the prediction cache
+        
+        Returns:
+            Dictionary of cache statistics, or None if the cache is disabled
+        """
+        if self.prediction_cache is None:
+            return None
+        return self.prediction_cache.stats()
+    
+    def get_cascade_stats(self):
+        """
+        Get the number and fraction of logs decided by each cascade stage
+        
+        Returns:
+            Dictionary with per-stage counts and fractions and the reduction in
+            model calls, or None if no cascade is loaded
+        """
+        if self.cascade is None:
+            return None
+        from cascade import CASCADE_STAGES
+        
+        counts = {stage: self.cascade_stats.get(stage, 0) for stage in CASCADE_STAGES}
+        total = sum(counts.values())
+        return {
+            'total': total,
+            'counts': counts,
+            'fractions': {stage: count / total if total else 0.0 for stage, count in counts.items()},
+            'model_call_reduction': total / counts['model'] if counts['model'] else float(total),
+        }
+    
     def ensure_db_table_exists(self):
         """
         Ensure that the logs table exists in the database
         
+        The check runs once per process; later calls return immediately.
+        
         Returns:
             True if successful, False otherwise
         """
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cur = conn.cursor()
-            
-            # Check if table exists
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'logs'
-                );
-            """)
-            
-            table_exists = cur.fetchone()[0]
-            
-            if not table_exists:
-                print("Logs table does not exist. Creating it...")
-                # Create the logs table
-                cur.execute("""
-                    CREATE TABLE logs (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        device_name VARCHAR(255),
-                        device_mac VARCHAR(255),
-                        device_ip VARCHAR(255),
-                        log TEXT,
-                        status VARCHAR(50),
-                        time TIMESTAMP
-                    );
-                """)
-                conn.commit()
-                print("Logs table created successfully.")
-            
-            cur.close()
-            conn.close()
+            from db_loader import ensure_logs_table
+            ensure_logs_table(self.db_config)
             return True
             
         except Exception as e:
@@ -241,6 +546,20 @@ class LogAnalyzerTool:
         Returns:
             A list of dictionaries containing analysis results
         """
+        return self.analyze_csv_frame(csv_file_path).to_dict('records')
+    
+    def analyze_csv_frame(self, csv_file_path):
+        """
+        Analyze logs from a CSV file, keeping the results columnar
+        
+        Args:
+            csv_file_path: Path to the CSV file containing logs
+            
+        Returns:
+            DataFrame of the CSV rows with status, confidence and method columns added
+        """
+        import pandas as pd
+        
         try:
             # Read the CSV file
             print(f'Reading CSV file: {csv_file_path}')
@@ -253,39 +572,238 @@ class LogAnalyzerTool:
                 if col not in df.columns:
                     raise ValueError(f'CSV file must contain a "{col}" column')
                     
-            results = []
+            # Drop rows that an earlier run already saved
+            if self.incremental:
+                df = self._filter_new_rows(df)
+            
+            # Classify all log entries in length-bucketed batches, a slice at a time so progress can be reported
+            print(f'Processing log entries in batches of {self.batch_size}...')
+            progress = ProgressReporter(total=len(df))
+            frames = []
+            for start in range(0, len(df), PROGRESS_SLICE_ROWS):
+                frame = self.analyze_frame(df.iloc[start:start + PROGRESS_SLICE_ROWS])
+                progress.update(len(frame), int((frame['status'] == 'anomaly').sum()))
+                frames.append(frame)
+            frame = pd.concat(frames) if frames else self.analyze_frame(df)
+            
+            progress.finish()
+            print('Analysis complete')
+            return frame
+        
+        except Exception as e:
+            print(f'Error analyzing CSV: {str(e)}')
+            traceback.print_exc()
+            raise
+    
+    def analyze_frame(self, df):
+        """
+        Classify the logs in a DataFrame without building a dictionary per row
+        
+        The 'log' column is classified as one batch and the predictions are
+        attached as new columns, so the data stays columnar from the CSV
+        reader to the output writers.
+        
+        Args:
+            df: DataFrame with a 'log' column and optional metadata columns
+            
+        Returns:
+            DataFrame with the metadata columns, 'log', and 'status',
+            'confidence' and 'method' columns
+        """
+        if 'log' not in df.columns:
+            raise ValueError('DataFrame must contain a "log" column')
+        predictions = self.predict_batch(df['log'].tolist())
+        return self._attach_predictions(df, predictions)
+    
+    def analyze_csv_stream(self, csv_file_path, output_path=None, chunk_size=10000, save_db=False,
+                           output_format='jsonl'):
+        """
+        Analyze logs from a CSV file chunk by chunk with bounded memory
+        
+        Each chunk is classified and written out before the next one is read,
+        so peak memory depends on chunk_size rather than on the size of the file.
+        
+        Args:
+            csv_file_path: Path to the CSV file containing logs
+            output_path: Path to save results to (optional)
+            chunk_size: Number of CSV rows to read and classify at a time
+            save_db: Whether to save each chunk's results to the database
+            output_format: 'jsonl' for a JSON Lines file or 'columnar' for a
+                           memory-mapped columnar store directory
             
-            # Process each log entry
-            print('Processing log entries...')
-            for index, row in df.iterrows():
-                log_text = row['log']
-                print(f'Analyzing log: {log_text[:30]}...')
+        Returns:
+            Dictionary with the number of rows processed, anomalies detected
+            and records inserted into the database
+        """
+        import pandas as pd
+        from result_store import open_result_writer
+        
+        summary = {'rows': 0, 'anomalies': 0, 'db_inserted': 0}
+        writer = None
+        
+        try:
+            print(f'Streaming CSV file: {csv_file_path} (chunk size: {chunk_size})')
+            progress = ProgressReporter()
+            if output_path:
+                writer = open_result_writer(output_path, output_format)
+            
+            for chunk in pd.read_csv(csv_file_path, chunksize=chunk_size):
+                # Check if the required columns exist
+                if 'log' not in chunk.columns:
+                    raise ValueError('CSV file must contain a "log" column')
                 
-                # Extract available metadata
-                metadata = {col: row[col] for col in df.columns if col != 'log'}
+                if self.incremental:
+                    chunk = self._filter_new_rows(chunk)
                 
-                # Get prediction from model
-                prediction = self.predict(log_text)
+                # Classify the chunk and write its results out straight away
+                frame = self.analyze_frame(chunk)
                 
-                # Create result dictionary
-                result = {
-                    **metadata,
-                    'log': log_text,
-                    'status': prediction['label'],
-                    'confidence': prediction['score'],
-                    'method': prediction.get('method', 'unknown')
-                }
+                if writer:
+                    with self.metrics.timer('output_write_seconds', {'format': output_format}):
+                        writer.write(frame)
+                    self.metrics.increment('output_rows_total', len(frame), {'format': output_format})
+                if save_db:
+                    summary['db_inserted'] += self.save_to_database(frame)
                 
-                print(f'Result: {prediction["label"]} (confidence: {prediction["score"]:.4f}, method: {prediction.get("method", "unknown")})')
-                results.append(result)
+                anomalies = int((frame['status'] == 'anomaly').sum())
+                summary['rows'] += len(frame)
+                summary['anomalies'] += anomalies
+                progress.update(len(frame), anomalies)
             
+            progress.finish()
+            if output_path:
+                print(f'Results saved to {output_path}')
             print('Analysis complete')
-            return results
+            return summary
         
         except Exception as e:
             print(f'Error analyzing CSV: {str(e)}')
             traceback.print_exc()
             raise
+        
+        finally:
+            if writer:
+                writer.close()
+    
+    def _filter_new_rows(self, df):
+        """
+        Fingerprint the rows of a DataFrame and drop those already in the database
+        
+        Each row's index label, its CSV row number, is hashed into its fingerprint
+        as db_loader.frame_to_rows does, so repeated identical lines stay distinct.
+        
+        Args:
+            df: DataFrame with a 'log' column and optional device and time columns
+            
+        Returns:
+            DataFrame of the rows not yet saved, with a 'fingerprint' column added
+        """
+        from db_loader import FINGERPRINT_FIELDS, row_fingerprint, existing_fingerprints
+        
+        columns = [df[field].tolist() if field in df.columns else [None] * len(df) for field in FINGERPRINT_FIELDS]
+        fingerprints = [row_fingerprint(*values, position=position)
+                        for values, position in zip(zip(*columns), df.index.tolist())]
+        df = df.assign(fingerprint=fingerprints)
+        
+        existing = existing_fingerprints(self.db_config, fingerprints)
+        if existing:
+            df = df[~df['fingerprint'].isin(existing)]
+            print(f'Skipping {len(fingerprints) - len(df)} log entries already in the database')
+        return df
+    
+    def _attach_predictions(self, df, predictions):
+        """
+        Add prediction columns to a DataFrame
+        
+        Args:
+            df: DataFrame with a 'log' column and optional metadata columns
+            predictions: List of prediction dictionaries in the same order as df
+            
+        Returns:
+            New DataFrame with the metadata columns, 'log', 'status', 'confidence' and 'method'
+        """
+        columns = [column for column in df.columns if column != 'log'] + ['log']
+        # Keep the index: for CSV rows it is the row number their fingerprints are built from
+        frame = df[columns].copy()
+        frame['status'] = [prediction['label'] for prediction in predictions]
+        frame['confidence'] = [prediction['score'] for prediction in predictions]
+        frame['method'] = [prediction.get('method', 'unknown') for prediction in predictions]
+        if predictions and 'template_id' in predictions[0]:
+            frame['template_id'] = [prediction['template_id'] for prediction in predictions]
+            frame['template_params'] = [prediction['template_params'] for prediction in predictions]
+        if self.sequence_detector is not None:
+            with self.metrics.timer('sequence_seconds'):
+                flags = self.sequence_detector.flag_frame(frame)
+            frame['sequence_flags'] = flags
+            if self.escalate_sequences:
+                escalated = (frame['sequence_flags'] != '') & (frame['status'] != 'anomaly')
+                frame.loc[escalated, 'status'] = 'anomaly'
+                frame.loc[escalated, 'method'] = 'sequence'
+            self._count_sequence_flags(flags)
+        return frame
+    
+    def _build_results_from_records(self, records, predictions):
+        """
+        Combine log records with their predictions
+        
+        Args:
+            records: List of dictionaries with a 'log' key and optional metadata keys
+            predictions: List of prediction dictionaries in the same order as records
+            
+        Returns:
+            A list of dictionaries containing analysis results
+        """
+        results = []
+        for record, prediction in zip(records, predictions):
+            record = dict(record)
+            log_text = record.pop('log')
+            result = {
+                **record,
+                'log': log_text,
+                'status': prediction['label'],
+                'confidence': prediction['score'],
+                'method': prediction.get('method', 'unknown')
+            }
+            if 'template_id' in prediction:
+                result['template_id'] = prediction['template_id']
+                result['template_params'] = prediction['template_params']
+            results.append(result)
+        
+        if self.sequence_detector is not None:
+            with self.metrics.timer('sequence_seconds'):
+                flags = self.sequence_detector.flag_records(results)
+            for result, line_flags in zip(results, flags):
+                result['sequence_flags'] = line_flags
+                if line_flags and self.escalate_sequences and result['status'] != 'anomaly':
+                    result['status'] = 'anomaly'
+                    result['method'] = 'sequence'
+            self._count_sequence_flags(flags)
+        return results
+    
+    def _count_sequence_flags(self, flags):
+        """
+        Count the sequence flags of a batch by kind, e.g. 'rate_spike'
+        """
+        counts = {}
+        for line_flags in flags:
+            if line_flags:
+                for flag in line_flags.split(','):
+                    kind = flag.split(':')[0]
+                    counts[kind] = counts.get(kind, 0) + 1
+        for kind, count in counts.items():
+            self.metrics.increment('sequence_flags_total', count, {'flag': kind})
+    
+    def get_sequence_stats(self):
+        """
+        Get the sequence detector's statistics
+        
+        Returns:
+            Dictionary with the lines observed, late lines not judged, keys tracked and flags raised by kind,
+            or None if detection is off
+        """
+        if self.sequence_detector is None:
+            return None
+        return self.sequence_detector.stats()
     
     def predict(self, log_text):
         """
@@ -297,44 +815,322 @@ class LogAnalyzerTool:
         Returns:
             Dictionary with prediction label, confidence score and method used
         """
+        return self.predict_batch([log_text], batch_size=1)[0]
+    
+    def predict_batch(self, log_texts, batch_size=None):
+        """
+        Make predictions for a list of log entries using the model or hybrid approach
+        
+        Args:
+            log_texts: List of log texts to analyze
+            batch_size: Number of logs per forward pass (default: self.batch_size)
+            
+        Returns:
+            List of dictionaries with prediction label, confidence score and method
+            used, in the same order as log_texts
+        """
+        return self.finish_batch(self.prepare_batch(log_texts, batch_size))
+    
+    def prepare_batch(self, log_texts, batch_size=None):
+        """
+        Do the CPU-side work for a batch of predictions: keyword heuristics,
+        cache lookups and tokenization
+        
+        This is the first half of predict_batch; finish_batch runs the forward
+        passes. Keeping them separate lets a pipeline tokenize the next batch
+        while the model is busy with the current one.
+        
+        Args:
+            log_texts: List of log texts to analyze
+            batch_size: Number of logs per forward pass (default: self.batch_size)
+            
+        Returns:
+            Dictionary describing the prepared batch, to be passed to finish_batch
+        """
+        log_texts = list(log_texts)
+        if batch_size is None:
+            batch_size = self.batch_size
+        
+        # Load the model on first use
+        self._ensure_model_loaded()
+        
+        start = time.perf_counter()
+        
+        # Only classify one line per template that has no verdict yet
+        templates = None
+        if self.template_miner is not None:
+            templates = self._mine_templates(log_texts)
+            log_texts = templates['texts']
+        
+        prepared = {
+            'log_texts': log_texts,
+            'heuristic_results': None,
+            'model_inputs': None,
+            'error': None,
+        }
+        if templates is not None:
+            prepared['templates'] = templates
+        
         try:
+            # Let the cascade's cheap stages decide what they can before the model
+            if self.model_loaded and self.cascade is not None:
+                prepared['cascade'] = self._prepare_cascade(log_texts, batch_size)
+            
             # If model is not loaded or we're using hybrid approach, check heuristic first
-            if not self.model_loaded or self.use_hybrid_approach:
-                heuristic_result = self._predict_with_keywords(log_text)
+            elif not self.model_loaded or self.use_hybrid_approach:
+                with self.metrics.timer('heuristic_seconds'):
+                    prepared['heuristic_results'] = self._predict_batch_with_keywords(log_texts)
+            
+            if self.model_loaded and 'cascade' not in prepared:
+                prepared['model_inputs'] = self._prepare_model_inputs(log_texts, batch_size)
                 
-                # If model is not loaded, return heuristic result
-                if not self.model_loaded:
+        except Exception as e:
+            print(f'Error in model prediction: {str(e)}')
+            traceback.print_exc()
+            prepared['error'] = e
+        
+        prepared['prepare_seconds'] = time.perf_counter() - start
+        return prepared
+    
+    def finish_batch(self, prepared):
+        """
+        Run the forward passes for a batch returned by prepare_batch and
+        combine model and heuristic results
+        
+        Args:
+            prepared: Dictionary returned by prepare_batch
+            
+        Returns:
+            List of dictionaries with prediction label, confidence score and method
+            used, in the same order as the prepared log texts
+        """
+        start = time.perf_counter()
+        results = self._combine_predictions(prepared)
+        if 'templates' in prepared:
+            results = self._broadcast_template_verdicts(prepared['templates'], results)
+        
+        self.metrics.observe('prediction_batch_seconds', prepared.get('prepare_seconds', 0.0) + time.perf_counter() - start)
+        method_counts = {}
+        for result in results:
+            method_counts[result['method']] = method_counts.get(result['method'], 0) + 1
+        for method, count in method_counts.items():
+            self.metrics.increment('predictions_total', count, {'method': method})
+        return results
+    
+    def _combine_predictions(self, prepared):
+        """
+        Run the model on a prepared batch and pick the model or heuristic result for each log
+        
+        Args:
+            prepared: Dictionary returned by prepare_batch
+            
+        Returns:
+            List of prediction dictionaries, in the same order as the prepared log texts
+        """
+        log_texts = prepared['log_texts']
+        heuristic_results = prepared['heuristic_results']
+        
+        try:
+            if prepared['error'] is not None and heuristic_results is None:
+                raise prepared['error']
+            
+            if 'cascade' in prepared:
+                return self._finish_cascade(prepared['cascade'])
+            
+            # If model is not loaded, return heuristic results
+            if not self.model_loaded:
+                for heuristic_result in heuristic_results:
                     heuristic_result['method'] = 'heuristic (model not loaded)'
-                    return heuristic_result
+                return heuristic_results
             
-            # If we're not using the hybrid approach, return the model result
+            # If we're not using the hybrid approach, return the model results
             if not self.use_hybrid_approach:
-                model_result = self._predict_with_model(log_text)
-                model_result['method'] = 'model'
-                return model_result
-                
+                model_results = self._run_model(prepared['model_inputs'])
+                for model_result in model_results:
+                    model_result['method'] = 'model'
+                return model_results
+            
             # Use the hybrid approach
             try:
-                model_result = self._predict_with_model(log_text)
-                
+                if prepared['error'] is not None:
+                    raise prepared['error']
+                model_results = self._run_model(prepared['model_inputs'])
+            except Exception as e:
+                print(f"Model prediction failed: {e}. Falling back to heuristic.")
+                for heuristic_result in heuristic_results:
+                    heuristic_result['method'] = 'heuristic (fallback)'
+                return heuristic_results
+            
+            results = []
+            for heuristic_result, model_result in zip(heuristic_results, model_results):
                 # If the model seems to be predicting the same for everything, 
                 # use the heuristic instead
                 if model_result['score'] > 0.85:
                     heuristic_result['method'] = 'hybrid (favoring heuristic)'
-                    return heuristic_result
+                    results.append(heuristic_result)
                 else:
                     model_result['method'] = 'hybrid (favoring model)'
-                    return model_result
-                
-            except Exception as e:
-                print(f"Model prediction failed: {e}. Falling back to heuristic.")
-                heuristic_result['method'] = 'heuristic (fallback)'
-                return heuristic_result
+                    results.append(model_result)
+            return results
             
         except Exception as e:
             print(f'Error in prediction: {str(e)}')
             traceback.print_exc()
-            return {"label": "unknown", "score": 0.0, "method": "error"}
+            return [{"label": "unknown", "score": 0.0, "method": "error"} for _ in log_texts]
+    
+    def _mine_templates(self, log_texts):
+        """
+        Assign logs to templates and pick one line for each template still needing a verdict
+        
+        Args:
+            log_texts: List of log texts to analyze
+            
+        Returns:
+            Dictionary with the (cluster, parameters) of every log, the clusters to
+            classify and one representative log text for each
+        """
+        with self.metrics.timer('template_mining_seconds'):
+            mined = self.template_miner.add_logs(log_texts)
+        
+        representatives = {}
+        for (cluster, _), log_text in zip(mined, log_texts):
+            if cluster.verdict is None and cluster.cluster_id not in representatives:
+                representatives[cluster.cluster_id] = (cluster, log_text)
+        
+        self.metrics.increment('template_lines_total', len(log_texts))
+        self.metrics.increment('template_classifications_total', len(representatives))
+        return {
+            'mined': mined,
+            'clusters': [cluster for cluster, _ in representatives.values()],
+            'texts': [log_text for _, log_text in representatives.values()],
+        }
+    
+    def _broadcast_template_verdicts(self, templates, results):
+        """
+        Store the verdicts of newly classified templates and give every log its template's verdict
+        
+        Args:
+            templates: Dictionary returned by _mine_templates
+            results: Predictions for templates['texts'], in the same order
+            
+        Returns:
+            List of prediction dictionaries for every mined log, with 'template_id' and 'template_params'
+        """
+        new_verdicts = {}
+        for cluster, result in zip(templates['clusters'], results):
+            # Failed predictions are not kept, so the template is classified again next time
+            if result.get('method') != 'error':
+                cluster.verdict = result
+            new_verdicts[cluster.cluster_id] = result
+        
+        broadcast = []
+        for cluster, params in templates['mined']:
+            verdict = cluster.verdict or new_verdicts.get(cluster.cluster_id) or {"label": "unknown", "score": 0.0, "method": "error"}
+            broadcast.append({**verdict, 'template_id': cluster.cluster_id, 'template_params': params})
+        return broadcast
+    
+    def get_template_stats(self, top=10):
+        """
+        Get counts of the mined templates
+        
+        Args:
+            top: Number of the largest templates to list
+            
+        Returns:
+            Dictionary with the number of templates and lines, the number of
+            template classifications and the largest templates, or None if
+            template mining is off
+        """
+        if self.template_miner is None:
+            return None
+        counters = self.metrics.snapshot()['counters']
+        return {
+            'templates': len(self.template_miner.clusters),
+            'lines': counters.get('template_lines_total', {}).get('', 0),
+            'classifications': counters.get('template_classifications_total', {}).get('', 0),
+            'top': self.template_miner.templates(top),
+        }
+    
+    def _prepare_cascade(self, log_texts, batch_size):
+        """
+        Decide logs with the cascade's cheap stages and tokenize the rest for the model
+        
+        Stages run cheapest-first: a model verdict cached for the log's template,
+        the keyword heuristic, then the hashed n-gram linear model.
+        
+        Args:
+            log_texts: List of log texts to analyze
+            batch_size: Number of logs per forward pass
+            
+        Returns:
+            Dictionary with the decided results, the stage of each, the indices of
+            escalated logs and their model inputs
+        """
+        results = [None] * len(log_texts)
+        stages = [None] * len(log_texts)
+        remaining = list(range(len(log_texts)))
+        
+        if self.prediction_cache is not None:
+            with self.metrics.timer('cache_lookup_seconds'):
+                keys = [self.prediction_cache.key_for(log_text) for log_text in log_texts]
+                cached = self.prediction_cache.get_many(keys)
+            for i, key in enumerate(keys):
+                if key in cached:
+                    results[i] = dict(cached[key])
+                    stages[i] = 'cache'
+            remaining = [i for i in remaining if results[i] is None]
+            self.metrics.increment('cache_hits_total', len(log_texts) - len(remaining))
+            self.metrics.increment('cache_misses_total', len(remaining))
+        
+        with self.metrics.timer('cascade_seconds'):
+            cheap_results, cheap_stages = self.cascade.classify([log_texts[i] for i in remaining], self.keyword_matcher)
+        escalated = []
+        for i, result, stage in zip(remaining, cheap_results, cheap_stages):
+            if result is None:
+                escalated.append(i)
+            else:
+                results[i] = result
+                stages[i] = stage
+        
+        return {
+            'results': results,
+            'stages': stages,
+            'escalated': escalated,
+            'escalated_texts': [log_texts[i] for i in escalated],
+            'model_inputs': self._prepare_model_inputs([log_texts[i] for i in escalated], batch_size,
+                                                       lookup_cache=False) if escalated else None,
+        }
+    
+    def _finish_cascade(self, cascade_batch):
+        """
+        Run the model on the logs the cascade escalated and merge all stages' results
+        
+        Args:
+            cascade_batch: Dictionary returned by _prepare_cascade
+            
+        Returns:
+            List of prediction dictionaries in input order, with 'cascade (<stage>)' methods
+        """
+        results = cascade_batch['results']
+        stages = cascade_batch['stages']
+        escalated = cascade_batch['escalated']
+        
+        if escalated:
+            try:
+                model_results = self._run_model(cascade_batch['model_inputs'])
+                stage = 'model'
+            except Exception as e:
+                print(f"Model prediction failed: {e}. Falling back to heuristic.")
+                model_results = self._predict_batch_with_keywords(cascade_batch['escalated_texts'])
+                stage = 'heuristic fallback'
+            for i, model_result in zip(escalated, model_results):
+                results[i] = model_result
+                stages[i] = stage
+        
+        for result, stage in zip(results, stages):
+            result['method'] = f'cascade ({stage})'
+            self.cascade_stats[stage] = self.cascade_stats.get(stage, 0) + 1
+        return results
     
     def _predict_with_model(self, log_text):
         """
@@ -346,35 +1142,419 @@ class LogAnalyzerTool:
         Returns:
             Dictionary with prediction label and confidence score
         """
+        return self._predict_batch_with_model([log_text], batch_size=1)[0]
+    
+    def _predict_batch_with_model(self, log_texts, batch_size):
+        """
+        Make predictions for a list of logs using the RoBERTa model
+        
+        Args:
+            log_texts: List of log texts to analyze
+            batch_size: Number of logs per forward pass
+            
+        Returns:
+            List of dictionaries with prediction label and confidence score,
+            in the same order as log_texts
+        """
         if not self.model_loaded:
             raise RuntimeError("Model is not loaded. Cannot make prediction.")
+        
+        return self._run_model(self._prepare_model_inputs(log_texts, batch_size))
+    
+    def _prepare_model_inputs(self, log_texts, batch_size, lookup_cache=True):
+        """
+        Look logs up in the prediction cache and tokenize the rest into batches
+        
+        When the prediction cache is enabled, logs are looked up by template
+        first and only one log per distinct uncached template is tokenized.
+        Templates another batch is already classifying (e.g. in a concurrent
+        pipeline tokenizer thread) are not tokenized again; _run_model picks
+        up their predictions from the cache.
+        Logs longer than max_length tokens are split into overlapping windows.
+        The sequences to run are sorted by token length and split into batches
+        so that each batch is only padded to its own longest sequence.
+        
+        Args:
+            log_texts: List of log texts to analyze
+            batch_size: Number of logs per forward pass
+            lookup_cache: Whether to look the logs up in the prediction cache and count hits and misses;
+                          False when the caller already did (their predictions are still stored)
             
+        Returns:
+            Dictionary with cache keys, cached predictions and tokenized batches
+        """
+        model_inputs = {
+            'count': len(log_texts),
+            'keys': None,
+            'predictions': {},
+            'pending_keys': [],
+            'waiting': {},
+            'batch_size': batch_size,
+            'batch_indices': [],
+            'batches': [],
+            'window_owners': None,
+        }
+        
+        texts_to_run = log_texts
+        if self.prediction_cache is not None:
+            with self.metrics.timer('cache_lookup_seconds'):
+                keys = [self.prediction_cache.key_for(log_text) for log_text in log_texts]
+                if lookup_cache:
+                    predictions, _, in_flight = self.prediction_cache.claim_many(keys)
+                else:
+                    predictions, in_flight = {}, set()
+                
+                # Pick one log per uncached template to send through the model, leaving
+                # templates another batch is classifying to that batch
+                pending = {}
+                waiting = {}
+                hits = 0
+                waiting_lines = 0
+                for key, log_text in zip(keys, log_texts):
+                    if key in predictions:
+                        hits += 1
+                    elif key in in_flight:
+                        waiting.setdefault(key, log_text)
+                        waiting_lines += 1
+                    elif key not in pending:
+                        pending[key] = log_text
+            
+            # Waiting lines are counted once their template's prediction is looked up again
+            if lookup_cache:
+                self.metrics.increment('cache_hits_total', hits)
+                self.metrics.increment('cache_misses_total', len(log_texts) - hits - waiting_lines)
+            model_inputs['keys'] = keys
+            model_inputs['predictions'] = predictions
+            model_inputs['pending_keys'] = list(pending)
+            model_inputs['waiting'] = waiting
+            texts_to_run = list(pending.values())
+        
+        if not texts_to_run:
+            return model_inputs
+        
+        # Tokenize all log texts without padding, splitting long ones into windows
         try:
-            # Tokenize the log text
-            inputs = self.tokenizer(log_text, return_tensors="pt", truncation=True, padding=True)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            with self.metrics.timer('tokenize_seconds'):
+                input_ids, window_owners = self._tokenize_windows(texts_to_run)
+        except Exception:
+            if self.prediction_cache is not None:
+                self.prediction_cache.release(model_inputs['pending_keys'])
+            raise
+        if window_owners is not None:
+            model_inputs['window_owners'] = window_owners
+        
+        # Group sequences of similar length together to minimise padding
+        order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+        model_inputs['batch_indices'] = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        model_inputs['batches'] = [
+            {
+                'input_ids': [input_ids[i] for i in indices],
+                'attention_mask': [[1] * len(input_ids[i]) for i in indices],
+            }
+            for indices in model_inputs['batch_indices']
+        ]
+        return model_inputs
+    
+    def _tokenize_windows(self, log_texts):
+        """
+        Tokenize logs into sequences of at most max_length tokens
+        
+        A log that does not fit is split into windows that overlap by
+        window_overlap tokens, so nothing past the limit is dropped and a
+        pattern on a window boundary is still seen whole by one window. Logs
+        needing more than max_windows windows get that many, spread evenly
+        from the start to the end of the log.
+        
+        Args:
+            log_texts: List of log texts to tokenize
             
-            # Get model prediction
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                
-            # Get probabilities
-            probs = torch.nn.functional.softmax(outputs.logits, dim=-1)[0]
+        Returns:
+            Tuple of the list of token id lists (with special tokens) and, if any
+            log was split, the index of the log each sequence belongs to (else None)
+        """
+        prefix = self._special_prefix
+        suffix = self._special_suffix
+        window_tokens = self._window_tokens
+        step = window_tokens - self.window_overlap
+        
+        token_ids = self._get_tokenizer()(log_texts, verbose=False)['input_ids']
+        if all(len(ids) <= self.max_length for ids in token_ids):
+            return token_ids, None
+        
+        input_ids = []
+        window_owners = []
+        windowed_logs = 0
+        for i, ids in enumerate(token_ids):
+            if len(ids) <= self.max_length:
+                input_ids.append(ids)
+                window_owners.append(i)
+                continue
             
-            # Get the predicted class (CORRECTED: 0 = anomaly, 1 = normal)
-            predicted_class = torch.argmax(probs).item()
-            confidence = probs[predicted_class].item()
+            # Split the log's own tokens, then wrap every window in the special tokens again
+            ids = ids[len(prefix):len(ids) - len(suffix)]
+            starts = list(range(0, len(ids) - self.window_overlap, step))
+            if len(starts) > self.max_windows:
+                last = len(starts) - 1
+                starts = [starts[round(j * last / max(1, self.max_windows - 1))] for j in range(self.max_windows)]
+            for start in starts:
+                input_ids.append(prefix + ids[start:start + window_tokens] + suffix)
+                window_owners.append(i)
+            windowed_logs += 1
+        
+        self.metrics.increment('windowed_logs_total', windowed_logs)
+        self.metrics.increment('log_windows_total', len(input_ids) - len(token_ids) + windowed_logs)
+        return input_ids, window_owners
+    
+    def _get_tokenizer(self):
+        """
+        Get a tokenizer that is safe to use from the current thread
+        
+        Fast tokenizers update their truncation settings on every call, so
+        threads other than the main thread get their own copy.
+        
+        Returns:
+            The tokenizer for the current thread
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self.tokenizer
+        if getattr(self._thread_local, 'tokenizer', None) is None:
+            self._thread_local.tokenizer = copy.deepcopy(self.tokenizer)
+        return self._thread_local.tokenizer
+    
+    def _run_model(self, model_inputs):
+        """
+        Run the RoBERTa model over batches prepared by _prepare_model_inputs
+        
+        Args:
+            model_inputs: Dictionary returned by _prepare_model_inputs
             
-            # Return the result - labels are swapped in this model
-            return {
-                "label": "normal" if predicted_class == 1 else "anomaly",
-                "score": confidence
-            }
+        Returns:
+            List of dictionaries with prediction label and confidence score,
+            in the same order as the prepared log texts
+        """
+        try:
+            batches = model_inputs['batches']
+            with self.metrics.timer('forward_seconds'):
+                if self.workers > 1 and len(batches) > 1:
+                    batch_outputs = self._forward_batches_parallel(batches)
+                else:
+                    batch_outputs = self._forward_batches(batches)
+            
+            # Put the results back in their original positions - labels are swapped in this model
+            results = [None] * sum(len(indices) for indices in model_inputs['batch_indices'])
+            for indices, batch_output in zip(model_inputs['batch_indices'], batch_outputs):
+                for i, (predicted_class, confidence) in zip(indices, batch_output):
+                    results[i] = {
+                        "label": "normal" if predicted_class == 1 else "anomaly",
+                        "score": confidence
+                    }
+            
+            if model_inputs['window_owners'] is not None:
+                results = self._combine_windows(results, model_inputs['window_owners'])
             
         except Exception as e:
             print(f'Error in model prediction: {str(e)}')
             traceback.print_exc()
+            if model_inputs['keys'] is not None:
+                self.prediction_cache.release(model_inputs['pending_keys'])
             raise
+        
+        if model_inputs['keys'] is None:
+            return results
+        
+        # Store the new predictions and broadcast them to every log with the same template
+        predictions = model_inputs['predictions']
+        new_predictions = dict(zip(model_inputs['pending_keys'], results))
+        if new_predictions:
+            self.prediction_cache.put_many(new_predictions)
+            predictions.update(new_predictions)
+        if model_inputs['waiting']:
+            predictions.update(self._collect_waiting(model_inputs))
+        
+        return [dict(predictions[key]) for key in model_inputs['keys']]
+    
+    def _collect_waiting(self, model_inputs):
+        """
+        Get the predictions of templates another batch was classifying when this one was prepared
+        
+        They are normally in the cache by now. Ones that are not (the other
+        batch failed or has not run yet) are classified here.
+        
+        Args:
+            model_inputs: Dictionary returned by _prepare_model_inputs
+            
+        Returns:
+            Dictionary mapping the waiting cache keys to prediction dictionaries
+        """
+        waiting = model_inputs['waiting']
+        waiting_keys = [key for key in model_inputs['keys'] if key in waiting]
+        found = self.prediction_cache.get_many(waiting_keys)
+        hits = sum(1 for key in waiting_keys if key in found)
+        self.metrics.increment('cache_hits_total', hits)
+        self.metrics.increment('cache_misses_total', len(waiting_keys) - hits)
+        
+        missing = [key for key in waiting if key not in found]
+        if missing:
+            inputs = self._prepare_model_inputs([waiting[key] for key in missing], model_inputs['batch_size'],
+                                                lookup_cache=False)
+            found.update(zip(missing, self._run_model(inputs)))
+        return found
+    
+    def _combine_windows(self, window_results, window_owners):
+        """
+        Combine the predictions of each log's windows into one prediction per log
+        
+        Args:
+            window_results: List of prediction dictionaries, one per window
+            window_owners: Index of the log each window belongs to, in ascending order
+            
+        Returns:
+            List of prediction dictionaries, one per log
+        """
+        grouped = []
+        for owner, result in zip(window_owners, window_results):
+            if owner == len(grouped):
+                grouped.append([])
+            grouped[owner].append(result)
+        
+        results = []
+        for windows in grouped:
+            if len(windows) == 1:
+                results.append(windows[0])
+                continue
+            
+            anomaly_probs = [result['score'] if result['label'] == 'anomaly' else 1 - result['score'] for result in windows]
+            if self.window_aggregation == 'max':
+                anomaly_prob = max(anomaly_probs)
+            else:
+                anomaly_prob = sum(anomaly_probs) / len(anomaly_probs)
+            
+            if anomaly_prob >= 0.5:
+                results.append({"label": "anomaly", "score": anomaly_prob})
+            else:
+                results.append({"label": "normal", "score": 1 - anomaly_prob})
+        return results
+    
+    def _forward_batches(self, batches, timings=None):
+        """
+        Run tokenized batches through the model
+        
+        Args:
+            batches: List of dictionaries with unpadded 'input_ids' and 'attention_mask' lists
+            timings: List to append the seconds of each forward pass to instead of
+                     recording them in the metrics (optional)
+            
+        Returns:
+            List with one list of (predicted class, confidence) tuples per batch
+        """
+        import torch
+        
+        batch_outputs = []
+        with torch.inference_mode():
+            for batch in batches:
+                start = time.perf_counter()
+                
+                # Pad the batch to its longest sequence only
+                inputs = self.tokenizer.pad(batch, padding=True, return_tensors="pt")
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+                
+                # Get model predictions and probabilities
+                logits = self._forward_logits(inputs)
+                probs = torch.nn.functional.softmax(logits, dim=-1)
+                
+                # Get the predicted classes (CORRECTED: 0 = anomaly, 1 = normal)
+                confidences, predicted_classes = torch.max(probs, dim=-1)
+                batch_outputs.append(list(zip(predicted_classes.tolist(), confidences.tolist())))
+                if timings is None:
+                    self.metrics.observe('forward_batch_seconds', time.perf_counter() - start)
+                else:
+                    timings.append(time.perf_counter() - start)
+        
+        return batch_outputs
+    
+    def _forward_batches_parallel(self, batches):
+        """
+        Run tokenized batches through the model across the worker pool
+        
+        Consecutive batches are grouped into tasks and the pool returns them in
+        submission order, so every batch is padded and evaluated exactly as it
+        would be in a single process.
+        
+        Args:
+            batches: List of dictionaries with unpadded 'input_ids' and 'attention_mask' lists
+            
+        Returns:
+            List with one list of (predicted class, confidence) tuples per batch
+        """
+        pool = self._get_worker_pool()
+        
+        # Several tasks per worker keep the processes busy when batch costs differ
+        group_size = max(1, math.ceil(len(batches) / (self.workers * 4)))
+        tasks = [batches[start:start + group_size] for start in range(0, len(batches), group_size)]
+        
+        batch_outputs = []
+        for task_output, timings in pool.map(_forward_in_worker, tasks):
+            batch_outputs.extend(task_output)
+            for seconds in timings:
+                self.metrics.observe('forward_batch_seconds', seconds)
+        return batch_outputs
+    
+    def _get_worker_pool(self, fork=False):
+        """
+        Create the inference worker pool on first use
+        
+        Forked workers would inherit any locks held by other threads, such as
+        the metrics, database sink or follower threads, so the process is only
+        forked when the caller creates the pool before starting any of them.
+        Otherwise the workers are started with forkserver or spawn and load
+        their own copy of the model.
+        
+        Args:
+            fork: Whether the process may be forked, i.e. it has not started threads of its own yet
+        
+        Returns:
+            A multiprocessing pool with self.workers processes
+        """
+        global _worker_analyzer
+        
+        if self._worker_pool is None:
+            # Split the CPU cores between workers so they don't oversubscribe them
+            num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+            
+            start_methods = multiprocessing.get_all_start_methods()
+            if fork and 'fork' in start_methods:
+                # Fork after the model is loaded so workers share its weights copy-on-write
+                context = multiprocessing.get_context('fork')
+                _worker_analyzer = self
+            elif 'forkserver' in start_methods:
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context('spawn')
+            
+            print(f"Starting {self.workers} inference workers ({context.get_start_method()}, {num_threads} threads each)...")
+            self._worker_pool = context.Pool(
+                processes=self.workers,
+                initializer=_init_inference_worker,
+                initargs=(self._worker_kwargs, num_threads)
+            )
+        
+        return self._worker_pool
+    
+    def close(self):
+        """
+        Shut down the inference worker pool, close the prediction cache and save the mined templates
+        
+        Results still queued for the database are written (or spooled) first.
+        """
+        self.close_db_sink()
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+            self._worker_pool.join()
+            self._worker_pool = None
+        if self.prediction_cache is not None:
+            self.prediction_cache.close()
+        if self.template_miner is not None and self.template_state_path:
+            self.template_miner.save(self.template_state_path)
     
     def _predict_with_keywords(self, log_text):
         """
@@ -384,98 +1564,176 @@ class LogAnalyzerTool:
             log_text: The log text to analyze
             
         Returns:
-            Dictionary with prediction label and confidence score
+            Dictionary with prediction label, confidence score and matched keywords
         """
-        log_text_lower = log_text.lower()
+        matched_keywords = self.keyword_matcher.match(log_text)
         
-        # Check for anomaly keywords
-        for keyword in self.anomaly_keywords:
-            if keyword in log_text_lower:
-                return {"label": "anomaly", "score": 0.8}
+        if self.keyword_matcher.is_anomaly(matched_keywords):
+            return {"label": "anomaly", "score": 0.8, "keywords": matched_keywords}
         
         # If no keywords found, return normal
-        return {"label": "normal", "score": 0.7}
+        return {"label": "normal", "score": 0.7, "keywords": matched_keywords}
+    
+    def _predict_batch_with_keywords(self, log_texts):
+        """
+        Make predictions for a list of logs using keyword-based heuristics
+        
+        Args:
+            log_texts: List of log texts to analyze
+            
+        Returns:
+            List of dictionaries with prediction label, confidence score and
+            matched keywords, in the same order as log_texts
+        """
+        import pandas as pd
+        
+        flags, matches = self.keyword_matcher.anomaly_series(pd.Series(log_texts, dtype=object))
+        return [
+            {"label": "anomaly", "score": 0.8, "keywords": matched_keywords} if is_anomaly
+            else {"label": "normal", "score": 0.7, "keywords": matched_keywords}
+            for is_anomaly, matched_keywords in zip(flags.tolist(), matches.tolist())
+        ]
     
     def save_to_json(self, results, output_path):
         """
         Save analysis results to a JSON file
         
         Args:
-            results: List of result dictionaries
+            results: List of result dictionaries, or a DataFrame from analyze_frame
             output_path: Path to save the JSON file
         """
         try:
-            with open(output_path, 'w') as f:
-                json.dump(results, f, indent=2)
+            with self.metrics.timer('output_write_seconds', {'format': 'json'}):
+                if hasattr(results, 'to_dict'):
+                    results = results.to_dict('records')
+                with open(output_path, 'w') as f:
+                    json.dump(results, f, indent=2)
+            self.metrics.increment('output_rows_total', len(results), {'format': 'json'})
             print(f'Results saved to {output_path}')
             return True
         except Exception as e:
             print(f'Error saving results to JSON: {str(e)}')
             return False
     
+    def save_to_jsonl(self, results, output_path):
+        """
+        Save analysis results to a JSON Lines file (one result per line)
+        
+        Args:
+            results: List of result dictionaries, or a DataFrame from analyze_frame
+            output_path: Path to save the JSON Lines file
+        """
+        try:
+            from result_store import JsonLinesWriter
+            
+            with self.metrics.timer('output_write_seconds', {'format': 'jsonl'}):
+                writer = JsonLinesWriter(output_path)
+                try:
+                    writer.write(results)
+                finally:
+                    writer.close()
+            self.metrics.increment('output_rows_total', len(results), {'format': 'jsonl'})
+            print(f'Results saved to {output_path}')
+            return True
+        except Exception as e:
+            print(f'Error saving results to JSON Lines: {str(e)}')
+            return False
+    
+    def save_to_columnar(self, results, output_path):
+        """
+        Save analysis results to a memory-mapped columnar store
+        
+        Args:
+            results: List of result dictionaries, or a DataFrame from analyze_frame
+            output_path: Directory to write the store to
+        """
+        try:
+            from result_store import ColumnarResultWriter
+            
+            with self.metrics.timer('output_write_seconds', {'format': 'columnar'}):
+                writer = ColumnarResultWriter(output_path)
+                try:
+                    writer.write(results)
+                finally:
+                    writer.close()
+            self.metrics.increment('output_rows_total', len(results), {'format': 'columnar'})
+            print(f'Results saved to {output_path}')
+            return True
+        except Exception as e:
+            print(f'Error saving results to columnar store: {str(e)}')
+            return False
+    
     def save_to_database(self, results):
         """
         Save analysis results to the database
         
+        Rows are loaded with COPY FROM STDIN in batches of self.db_batch_size,
+        each committed separately, over a pooled connection. In incremental
+        mode rows are upserted on their fingerprint instead.
+        
+        With async_db the results are queued for a background DatabaseSink
+        and this returns at once. Otherwise, if the database can't be
+        reached the results are written to the spool directory, to be
+        replayed by the next sink or by 'python db_sink.py'.
+        
         Args:
-            results: List of result dictionaries
+            results: List of result dictionaries, or a DataFrame from analyze_frame
             
         Returns:
-            Number of records inserted
+            Number of records inserted, or with async_db the number queued
         """
+        if self.async_db:
+            return self._get_db_sink().put(results)
+        
         try:
-            # Ensure the table exists
-            self.ensure_db_table_exists()
-            
-            # Connect to the database
-            conn = psycopg2.connect(**self.db_config)
-            cur = conn.cursor()
-            
-            # Prepare data for insertion
-            data_to_insert = []
-            for result in results:
-                # Extract fields or use defaults
-                user_id = result.get('user_id', 1)  # Default to user_id 1 if not provided
-                device_name = result.get('device_name')
-                device_mac = result.get('device_mac')
-                device_ip = result.get('device_ip')
-                log_text = result.get('log')
-                status = result.get('status')
-                log_time = result.get('time')
-                
-                # Add to data to insert
-                data_to_insert.append((
-                    user_id, device_name, device_mac, device_ip, log_text, status, log_time
-                ))
-            
-            # Insert data
-            execute_values(
-                cur,
-                """
-                INSERT INTO logs (user_id, device_name, device_mac, device_ip, log, status, time)
-                VALUES %s
-                RETURNING id
-                """,
-                data_to_insert
-            )
-            
-            # Get the inserted IDs
-            inserted_ids = [row[0] for row in cur.fetchall()]
-            
-            # Commit the transaction
-            conn.commit()
+            from db_loader import BulkLoader
             
-            # Close the connection
-            cur.close()
-            conn.close()
-            
-            print(f'Inserted {len(inserted_ids)} records into the database')
-            return len(inserted_ids)
+            loader = BulkLoader(self.db_config, batch_size=self.db_batch_size, copy_format=self.copy_format,
+                                upsert=self.incremental)
+            with self.metrics.timer('db_insert_seconds'):
+                inserted = loader.load(results)
+            self.metrics.increment('db_rows_total', inserted)
+            return inserted
             
         except Exception as e:
             print(f'Error saving to database: {str(e)}')
-            traceback.print_exc()
+            if getattr(e, 'pgcode', None) == '23505':  # unique_violation on the fingerprint index
+                print('Some of these log entries are already in the database; use --incremental to skip them')
+            else:
+                traceback.print_exc()
+            
+            from db_sink import TRANSIENT_ERRORS, results_to_rows, spool_rows
+            if isinstance(e, TRANSIENT_ERRORS):
+                try:
+                    path = spool_rows(self.db_spool_dir, results_to_rows(results))
+                    print(f'Saved the results to {path}; they are replayed once the database is back')
+                except Exception as spool_error:
+                    print(f'Error spooling results: {str(spool_error)}')
             return 0
+    
+    def _get_db_sink(self):
+        """
+        Start the background database sink on first use
+        """
+        if self._db_sink is None:
+            from db_sink import DatabaseSink
+            
+            self._db_sink = DatabaseSink(self.db_config, batch_size=self.db_batch_size, copy_format=self.copy_format,
+                                         upsert=self.incremental, spool_dir=self.db_spool_dir, metrics=self.metrics)
+        return self._db_sink
+    
+    def close_db_sink(self):
+        """
+        Write or spool everything queued for the database and stop the background sink
+        
+        Returns:
+            The sink's statistics, or None if no sink was started
+        """
+        if self._db_sink is None:
+            return None
+        stats = self._db_sink.close()
+        self._db_sink = None
+        return stats
 
 def main():
     """
@@ -483,29 +1741,254 @@ def main():
     """
     import argparse
     parser = argparse.ArgumentParser(description='Analyze logs and store results')
-    parser.add_argument('--csv', required=True, help='Path to CSV file with logs')
-    parser.add_argument('--json', help='Path to save JSON results', default='analysis_results.json')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help='Path to CSV file with logs')
+    source.add_argument('--follow', nargs='+', metavar='PATH', help='Tail one or more growing log files (.csv or plain text/syslog) and save new entries to the database continuously')
+    parser.add_argument('--json', help='Path to save JSON results (default: analysis_results.json, or the analysis_results '
+                                       'directory for columnar output; in --follow mode, JSON Lines are appended only if given)')
+    parser.add_argument('--output-format', choices=['json', 'jsonl', 'columnar'],
+                        help="Format of the --json output: 'json' (indented array, default for whole-file analysis), "
+                             "'jsonl' (one result per line, default for --stream and --pipeline) or "
+                             "'columnar' (memory-mapped column store directory)")
     parser.add_argument('--model', default='AI/main-federated-roberta-model', help='Path to model directory')
     parser.add_argument('--save-db', action='store_true', help='Save results to database')
+    parser.add_argument('--db-batch-size', type=int, default=50000, help='Number of rows per COPY and commit when saving to the database')
+    parser.add_argument('--copy-format', choices=['csv', 'binary'], default='csv', help='COPY framing used when saving to the database')
+    parser.add_argument('--incremental', action='store_true', help='Skip rows already saved to the database and upsert the new results (implies --save-db)')
+    parser.add_argument('--async-db', action='store_true', help='Save to the database from a background thread that retries and spools to disk while the database is down (implies --save-db)')
+    parser.add_argument('--db-spool-dir', default='db_spool', help='Directory where results wait while the database is unavailable')
     parser.add_argument('--hybrid', action='store_true', help='Use hybrid model+heuristic approach')
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of logs per model forward pass')
+    parser.add_argument('--stream', action='store_true', help='Analyze the CSV in chunks with bounded memory and write JSON Lines output')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Number of CSV rows per chunk in --stream and --pipeline modes')
+    parser.add_argument('--pipeline', action='store_true', help='Analyze the CSV with concurrent read/tokenize/inference/write stages and write JSON Lines output')
+    parser.add_argument('--tokenizer-threads', type=int, default=2, help='Number of tokenizer threads in --pipeline mode')
+    parser.add_argument('--queue-size', type=int, default=4, help='Maximum number of chunks queued between stages in --pipeline mode')
+    parser.add_argument('--cache-size', type=int, default=10000, help='Number of log templates whose predictions are cached in memory (0 disables)')
+    parser.add_argument('--cache-path', help='Path to a SQLite file for a persistent prediction cache')
+    parser.add_argument('--keywords', help='Path to a JSON or text file of weighted anomaly keywords for the heuristic')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for model inference')
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend: fp32 torch, dynamically quantized torch-int8, or ONNX Runtime')
+    parser.add_argument('--max-length', type=parse_max_length, help=f"Tokens per model input: {', '.join(f'{name} ({tokens})' for name, tokens in MAX_LENGTH_PROFILES.items())} or a number (default: the model's limit); longer logs are split into overlapping windows")
+    parser.add_argument('--window-overlap', type=int, help='Tokens shared by consecutive windows of a long log (default: a quarter of --max-length)')
+    parser.add_argument('--max-windows', type=int, default=16, help='Most windows classified per long log')
+    parser.add_argument('--window-aggregation', choices=WINDOW_AGGREGATIONS, default='max', help="Combine window predictions by the most anomalous window ('max') or the average ('mean')")
+    parser.add_argument('--heuristic-only', action='store_true', help='Skip the model and classify with keyword heuristics only')
+    parser.add_argument('--profile-startup', action='store_true', help='Report the time spent in each startup phase')
+    parser.add_argument('--metrics-file', help='Write hot-path counters and latency histograms to this file in the Prometheus text format when the run ends')
+    parser.add_argument('--metrics-port', type=int, help='Serve hot-path metrics in the Prometheus text format on this port while running')
+    parser.add_argument('--verbose', action='store_true', help='Print a table of hot-path timings when the run ends')
+    parser.add_argument('--validate-backend', action='store_true', help='Compare --backend against the fp32 torch model on the --csv file and exit')
+    parser.add_argument('--templates', action='store_true', help='Mine Drain log templates and classify each template once, storing template ids and parameters with the results')
+    parser.add_argument('--template-state', help='JSON file mined templates are loaded from and saved to, keeping template ids stable across runs (implies --templates)')
+    parser.add_argument('--sequences', action='store_true', help='Flag rate spikes, template bursts and rare template transitions per device and user in a sequence_flags field')
+    parser.add_argument('--escalate-sequences', action='store_true', help='Report lines with sequence flags as anomalies (implies --sequences)')
+    parser.add_argument('--cascade', help='Path to a calibrated cascade directory; confident logs are decided by cheap stages and only the rest reach the model')
+    parser.add_argument('--calibrate-cascade', metavar='OUTPUT_DIR', help="Train and calibrate a cascade on the --csv file (using its 'label' column if present), save it to OUTPUT_DIR and exit")
+    parser.add_argument('--target-precision', type=float, default=0.99, help='Minimum agreement of cascade cheap-stage decisions with the reference labels when calibrating')
+    parser.add_argument('--checkpoint', default='follow_checkpoint.json', help='Path of the JSON file holding byte offsets in --follow mode')
+    parser.add_argument('--follow-batch-size', type=int, default=1000, help='Number of new lines that triggers a flush in --follow mode')
+    parser.add_argument('--follow-interval', type=float, default=2.0, help='Longest time in seconds a new line waits before it is flushed in --follow mode')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between checks for new lines in --follow mode')
     
     args = parser.parse_args()
+    main_start = time.perf_counter()
+    if args.validate_backend and not args.csv:
+        parser.error('--validate-backend requires --csv')
+    if args.calibrate_cascade and not args.csv:
+        parser.error('--calibrate-cascade requires --csv')
+    if args.incremental or args.async_db:
+        args.save_db = True
+    if args.output_format is None:
+        args.output_format = 'jsonl' if (args.stream or args.pipeline or args.follow) else 'json'
+    if args.json is None and not args.follow:
+        args.json = 'analysis_results' if args.output_format == 'columnar' else 'analysis_results.json'
+    if args.output_format == 'json' and (args.stream or args.pipeline or args.follow):
+        parser.error("--stream, --pipeline and --follow write incrementally; use --output-format jsonl or columnar")
+    if args.output_format == 'columnar' and args.follow:
+        parser.error("--follow appends JSON Lines; --output-format columnar is not supported")
+    
+    # Measure the accuracy cost of a faster backend on a held-out CSV
+    if args.validate_backend:
+        from model_backends import validate_backend
+        report = validate_backend(args.model, args.csv, args.backend, batch_size=args.batch_size)
+        print(f"\nBackend validation ({report['backend']} vs {report['reference_backend']}, {report['rows']} logs):")
+        print(f"  Label agreement: {report['label_agreement']:.2%}")
+        print(f"  Confidence difference: mean {report['mean_confidence_diff']:.4f}, max {report['max_confidence_diff']:.4f}")
+        print(f"  Time: {report['reference_seconds']:.2f}s vs {report['backend_seconds']:.2f}s (speedup: {report['speedup']:.2f}x)")
+        if 'backend_accuracy' in report:
+            print(f"  Accuracy: {report['reference_accuracy']:.2%} vs {report['backend_accuracy']:.2%}")
+        return
+    
+    # Train a cascade's cheap stages and calibrate their thresholds on a labelled CSV
+    if args.calibrate_cascade:
+        from cascade import calibrate_cascade
+        report = calibrate_cascade(args.model, args.csv, args.calibrate_cascade, target_precision=args.target_precision,
+                                   keywords_path=args.keywords, batch_size=args.batch_size, backend=args.backend)
+        print(f"\nCascade calibration ({report['holdout_rows']} held-out logs, reference: {report['reference']}):")
+        print(f"  Linear stage: normal at or below {report['normal_threshold']:.4f}, anomaly at or above {report['anomaly_threshold']:.4f}")
+        print(f"  Keyword stage: {'on' if report['use_keywords'] else 'off'} (precision {report['keyword_precision']:.2%})")
+        print("  Stage fractions: " + ', '.join(f"{stage} {fraction:.1%}" for stage, fraction in report['stage_fractions'].items()))
+        print(f"  Model calls cut by {report['model_call_reduction']:.1f}x")
+        print(f"  Accuracy: model {report['model_accuracy']:.2%}, cascade {report['cascade_accuracy']:.2%} "
+              f"(agreement with model {report['model_agreement']:.2%})")
+        print(f"Cascade saved to {args.calibrate_cascade}")
+        return
     
     # Initialize the analyzer
     analyzer = LogAnalyzerTool(
         model_path=args.model,
-        use_hybrid_approach=args.hybrid
+        use_hybrid_approach=args.hybrid,
+        batch_size=args.batch_size,
+        cache_size=args.cache_size,
+        cache_path=args.cache_path,
+        keywords_path=args.keywords,
+        workers=args.workers,
+        backend=args.backend,
+        use_model=not args.heuristic_only,
+        db_batch_size=args.db_batch_size,
+        copy_format=args.copy_format,
+        incremental=args.incremental,
+        cascade_path=args.cascade,
+        mine_templates=args.templates,
+        template_state_path=args.template_state,
+        async_db=args.async_db,
+        db_spool_dir=args.db_spool_dir,
+        detect_sequences=args.sequences,
+        escalate_sequences=args.escalate_sequences,
+        max_length=args.max_length,
+        window_overlap=args.window_overlap,
+        max_windows=args.max_windows,
+        window_aggregation=args.window_aggregation
     )
+    analysis_start = time.perf_counter()
+    
+    # Start any inference workers before the metrics, database sink and follower threads
+    if analyzer.workers > 1 and analyzer._ensure_model_loaded():
+        analyzer._get_worker_pool(fork=True)
+    
+    if args.metrics_port:
+        from analyzer_metrics import start_metrics_server
+        start_metrics_server(analyzer.metrics, args.metrics_port)
+    
+    # Tail live log files until interrupted
+    if args.follow:
+        import signal
+        from log_follower import LogFollower
+        
+        follower = LogFollower(
+            analyzer,
+            args.follow,
+            checkpoint_path=args.checkpoint,
+            batch_size=args.follow_batch_size,
+            batch_seconds=args.follow_interval,
+            poll_interval=args.poll_interval,
+            output_path=args.json
+        )
+        signal.signal(signal.SIGINT, lambda signum, frame: follower.stop())
+        if hasattr(signal, 'SIGTERM'):
+            signal.signal(signal.SIGTERM, lambda signum, frame: follower.stop())
+        follower.run()
+    
+    # Run the CSV through concurrent pipeline stages
+    elif args.pipeline:
+        from analysis_pipeline import AnalysisPipeline
+        
+        pipeline = AnalysisPipeline(
+            analyzer,
+            chunk_size=args.chunk_size,
+            tokenizer_threads=args.tokenizer_threads,
+            queue_size=args.queue_size,
+            output_path=args.json,
+            output_format=args.output_format,
+            save_db=args.save_db
+        )
+        summary = pipeline.run(args.csv)
+        print("\nPipeline stages:")
+        for name, stage in summary['stages'].items():
+            print(f"  {name:<10} {stage['rows']:>10} rows  {stage['busy_seconds']:8.2f}s busy  "
+                  f"{stage['busy_rows_per_second']:>12,.0f} rows/sec  max queue depth {stage['max_queue_depth']}")
+    
+    # Stream the CSV file chunk by chunk, writing results as we go
+    elif args.stream:
+        analyzer.analyze_csv_stream(
+            args.csv,
+            output_path=args.json,
+            chunk_size=args.chunk_size,
+            save_db=args.save_db,
+            output_format=args.output_format
+        )
+    else:
+        # Analyze the CSV file
+        frame = analyzer.analyze_csv_frame(args.csv)
+        
+        # Save results in the requested format
+        if args.output_format == 'columnar':
+            analyzer.save_to_columnar(frame, args.json)
+        elif args.output_format == 'jsonl':
+            analyzer.save_to_jsonl(frame, args.json)
+        else:
+            analyzer.save_to_json(frame, args.json)
+        
+        # Save to database if requested
+        if args.save_db:
+            analyzer.save_to_database(frame)
+    
+    # Wait for the background database writes, so the timings below include them
+    analyzer.close_db_sink()
+    
+    cache_stats = analyzer.get_cache_stats()
+    if cache_stats:
+        print(f"Prediction cache: {cache_stats['memory_hits']} memory hits, "
+              f"{cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses "
+              f"(hit rate: {cache_stats['hit_rate']:.1%})")
+    
+    template_stats = analyzer.get_template_stats(top=5)
+    if template_stats:
+        print(f"Log templates: {template_stats['templates']} mined from {template_stats['lines']} lines, "
+              f"{template_stats['classifications']} classified "
+              f"({template_stats['lines'] / max(1, template_stats['classifications']):.1f} lines per classification)")
+        for template in template_stats['top']:
+            print(f"  #{template['id']:<6} {template['count']:>10}  {template['template']}")
+    
+    sequence_stats = analyzer.get_sequence_stats()
+    if sequence_stats:
+        print(f"Sequence detection: {sequence_stats['lines']} lines over {sequence_stats['keys']} device and user keys")
+        if sequence_stats['late_lines']:
+            print(f"  {sequence_stats['late_lines']} lines arrived too far out of time order to be judged")
+        for flag, count in sorted(sequence_stats['flags'].items()):
+            print(f"  {flag:<30} {count:>10}")
+    
+    window_counters = analyzer.metrics.snapshot()['counters']
+    if 'windowed_logs_total' in window_counters:
+        print(f"Long logs: {sum(window_counters['windowed_logs_total'].values())} longer than {analyzer.max_length} tokens "
+              f"split into {sum(window_counters['log_windows_total'].values())} windows")
+    
+    cascade_stats = analyzer.get_cascade_stats()
+    if cascade_stats:
+        print("Cascade stages: " + ', '.join(f"{stage} {fraction:.1%}" for stage, fraction in cascade_stats['fractions'].items())
+              + f" (model calls cut by {cascade_stats['model_call_reduction']:.1f}x)")
     
-    # Analyze the CSV file
-    results = analyzer.analyze_csv(args.csv)
+    # The timing table is for people looking at performance, who asked for metrics one way or another
+    timings = analyzer.metrics.timing_summary()
+    if timings and (args.verbose or args.metrics_file or args.metrics_port):
+        print("\nHot path timings:")
+        for name, count, total, mean, longest in timings:
+            print(f"  {name:<45} {count:>8} calls  {total:8.3f}s total  {mean * 1000:9.2f}ms mean  {longest * 1000:9.2f}ms max")
+    if args.metrics_file:
+        analyzer.metrics.write_prometheus(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
     
-    # Save results to JSON
-    analyzer.save_to_json(results, args.json)
+    analyzer.close()
     
-    # Save to database if requested
-    if args.save_db:
-        analyzer.save_to_database(results)
+    if args.profile_startup:
+        print("\nStartup profile:")
+        print(f"  {'imports':<20} {main_start - _process_start:8.3f}s")
+        for phase, seconds in analyzer.startup_timings.items():
+            print(f"  {phase:<20} {seconds:8.3f}s")
+        model_seconds = sum(analyzer.startup_timings.get(phase, 0.0)
+                            for phase in ('resolve_model_path', 'import_torch', 'load_tokenizer', 'load_model'))
+        print(f"  {'analysis':<20} {time.perf_counter() - analysis_start - model_seconds:8.3f}s (excluding model loading)")
 
 if __name__ == '__main__':
     main()
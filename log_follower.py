@@ -0,0 +1,457 @@
+import os
+import re
+import csv
+import json
+import time
+import threading
+import traceback
+from datetime import datetime
+
+# Classic syslog line: "Mar  3 14:02:11 hostname message"
+SYSLOG_PATTERN = re.compile(r'^([A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2}) (\S+) (.*)$')
+
+# Largest chunk read from a file in one poll
+MAX_READ_BYTES = 8 * 1024 * 1024
+
+# Checkpoint key of the JSON Lines output state; file keys are absolute paths, so it can't clash
+OUTPUT_CHECKPOINT_KEY = '_output'
+
+
+def parse_syslog_line(line, now=None):
+    """
+    Turn a plain-text log line into a log entry
+
+    Classic syslog lines are split into time, device name and message;
+    any other line becomes the log text, stamped with the time it was read.
+
+    Args:
+        line: Log line without its trailing newline
+        now: Time the line was read, used for the year of syslog timestamps and for unparsed lines
+
+    Returns:
+        Dictionary with 'log', 'time' and, for syslog lines, 'device_name'
+    """
+    now = now or datetime.now()
+    match = SYSLOG_PATTERN.match(line)
+    if match:
+        try:
+            timestamp = datetime.strptime(f'{now.year} {match.group(1)}', '%Y %b %d %H:%M:%S')
+            return {
+                'device_name': match.group(2),
+                'time': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'log': match.group(3),
+            }
+        except ValueError:
+            pass
+    return {'time': now.strftime('%Y-%m-%d %H:%M:%S'), 'log': line}
+
+
+class FollowedFile:
+    """
+    One file being tailed, tracked by identity (device and inode) and byte offset
+
+    The offset only ever points just past a complete line, so a partially
+    written last line is picked up once it is finished. If the file is
+    truncated in place the offset goes back to the start; if it is rotated
+    (the path now names a different file) the rest of the old file is read
+    first and the follower switches to the new file once that is flushed.
+
+    Each entry is fingerprinted with the file identity and the byte offset of
+    its line, so repeated identical lines are stored once each. Lines
+    without a timestamp of their own are stamped with the time the first of
+    them was read after the last checkpoint. That read time is saved before
+    their batch is written, so if the run stops before the offsets are
+    checkpointed, the lines read again get the same time and fingerprint and
+    the upsert does not duplicate them.
+    """
+
+    def __init__(self, path, state=None):
+        """
+        Initialize the followed file
+
+        Args:
+            path: Path of the file to tail
+            state: Checkpoint state from a previous run (optional)
+        """
+        self.path = path
+        self.is_csv = path.lower().endswith('.csv')
+        self.state = dict(state or {})
+        self.file = None
+        self.identity = None
+        self.offset = 0
+        self.header = None
+        self.rotated = False
+        self.read_time = None
+        self.saved = self.state
+
+    def checkpoint(self):
+        """
+        Get the state to save so a restart resumes after the last flushed line
+
+        Returns:
+            Dictionary with the file identity, byte offset and CSV header
+        """
+        if self.identity is None:
+            return self.state
+        return {'device': self.identity[0], 'inode': self.identity[1], 'offset': self.offset, 'header': self.header}
+
+    def pending_checkpoint(self):
+        """
+        Get the state to save before a batch is written
+
+        Returns:
+            The last saved state plus the read time of the lines read since then
+        """
+        state = dict(self.saved)
+        if self.read_time is not None:
+            state['read_time'] = self.read_time.isoformat()
+        return state
+
+    def mark_saved(self):
+        """
+        Record that every line read so far has been saved
+        """
+        self.saved = self.checkpoint()
+        self.read_time = None
+
+    def _open(self):
+        """
+        Open the file, resuming from the checkpoint if it still names the same file
+
+        Returns:
+            True if the file is open
+        """
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.offset = 0
+        self.header = None
+        self.rotated = False
+
+        self.read_time = None
+
+        saved = self.state
+        if (saved.get('device'), saved.get('inode')) == self.identity and saved.get('offset', 0) <= stat.st_size:
+            self.offset = saved.get('offset', 0)
+            self.header = saved.get('header')
+            if saved.get('read_time'):
+                # A batch was being saved when the last run stopped; stamp its lines the same way
+                self.read_time = datetime.fromisoformat(saved['read_time'])
+        self.state = {}
+        self.saved = self.checkpoint()
+        return True
+
+    def switch(self):
+        """
+        Move on from a rotated file to the file now at the path
+        """
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.identity = None
+        self.rotated = False
+        self.read_time = None
+        self.saved = self.state
+
+    def close(self):
+        """
+        Close the open file
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _path_identity(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def poll(self):
+        """
+        Read the complete lines written since the last poll
+
+        Returns:
+            List of (byte offset, line) pairs, the lines decoded and without line endings
+        """
+        if self.rotated or (self.file is None and not self._open()):
+            return []
+
+        size = os.fstat(self.file.fileno()).st_size
+        if size < self.offset:
+            # Truncated in place (e.g. copytruncate): start again from the beginning
+            print(f'{self.path} was truncated; reading from the start')
+            self.offset = 0
+            self.header = None
+
+        moved = self._path_identity() != self.identity
+
+        self.file.seek(self.offset)
+        data = self.file.read(MAX_READ_BYTES)
+        end = data.rfind(b'\n') + 1
+        if moved and len(data) < MAX_READ_BYTES:
+            # The file was rotated away and nothing more will be written to it:
+            # take everything including an unterminated last line
+            end = len(data)
+            self.rotated = True
+            print(f'{self.path} was rotated; switching to the new file')
+        elif end == 0 and len(data) == MAX_READ_BYTES:
+            # A single line longer than the read size; take it in pieces
+            end = len(data)
+
+        lines = []
+        start = 0
+        while start < end:
+            line_end = data.find(b'\n', start, end)
+            if line_end < 0:
+                line_end = end
+            lines.append((self.offset + start, data[start:line_end].rstrip(b'\r').decode('utf-8', errors='replace')))
+            start = line_end + 1
+        self.offset += end
+
+        if self.is_csv and lines and self.header is None:
+            self.header = next(csv.reader([lines.pop(0)[1]]))
+        lines = [(offset, line) for offset, line in lines if line.strip()]
+        if lines and self.read_time is None:
+            self.read_time = datetime.now().replace(microsecond=0)
+        return lines
+
+    def to_entries(self, lines):
+        """
+        Turn lines read from this file into log entries
+
+        Args:
+            lines: (byte offset, line) pairs returned by poll
+
+        Returns:
+            List of dictionaries with a 'log' key, a 'fingerprint' and any metadata columns
+        """
+        from db_loader import FINGERPRINT_FIELDS, row_fingerprint
+
+        entries = []
+        for offset, line in lines:
+            if self.is_csv:
+                values = next(csv.reader([line]))
+                entry = {column: (value if value != '' else None) for column, value in zip(self.header, values)}
+                if entry.get('log') is None:
+                    continue
+                if entry.get('user_id') and entry['user_id'].isdigit():
+                    entry['user_id'] = int(entry['user_id'])
+            else:
+                entry = parse_syslog_line(line, self.read_time)
+            position = f'{self.identity[0]}:{self.identity[1]}:{offset}'
+            entry['fingerprint'] = row_fingerprint(*(entry.get(field) for field in FINGERPRINT_FIELDS),
+                                                   position=position)
+            entries.append(entry)
+        return entries
+
+
+class LogFollower:
+    """
+    Tail growing log files and analyze new lines continuously
+
+    New lines are collected from every file and classified in micro-batches,
+    flushed when batch_size lines are waiting or the oldest waiting line is
+    batch_seconds old. Each flush is written to the logs table and then the
+    byte offset of every file is checkpointed, so a restart resumes right
+    after the last line that was saved. A batch that cannot be saved is kept
+    and retried, and reading pauses once batch_size lines are waiting.
+
+    Before a batch is written, the read times of its lines and the size of
+    the JSON Lines output are checkpointed. A batch read again after a
+    crash is upserted under the same fingerprints, and whatever it had
+    already appended to the output file is cut off before it is written
+    again.
+    """
+
+    def __init__(self, analyzer, paths, checkpoint_path='follow_checkpoint.json', batch_size=1000,
+                 batch_seconds=2.0, poll_interval=0.5, save_db=True, output_path=None):
+        """
+        Initialize the follower
+
+        Args:
+            analyzer: LogAnalyzerTool used for predictions and database settings
+            paths: List of file paths to tail (.csv files are read as CSV with a header line)
+            checkpoint_path: Path of the JSON file holding byte offsets between runs
+            batch_size: Number of waiting lines that triggers a flush
+            batch_seconds: Age of the oldest waiting line that triggers a flush
+            poll_interval: Seconds to sleep when no file has new lines
+            save_db: Whether to write results to the logs table
+            output_path: Path of a JSON Lines file to append results to (optional)
+        """
+        self.analyzer = analyzer
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = max(1, int(batch_size))
+        self.batch_seconds = batch_seconds
+        self.poll_interval = poll_interval
+        self.save_db = save_db
+        self.output_path = output_path
+
+        saved = self._load_checkpoint()
+        self.files = [FollowedFile(path, saved.get(os.path.abspath(path))) for path in paths]
+        self._truncate_output(saved.get(OUTPUT_CHECKPOINT_KEY))
+
+        self.pending = []
+        self.pending_since = None
+        self.output_size = None
+        self.summary = {'rows': 0, 'anomalies': 0, 'db_inserted': 0, 'batches': 0}
+        self.stop_event = threading.Event()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Could not read checkpoint {self.checkpoint_path}: {str(e)}; starting from the beginning')
+            return {}
+
+    def _save_checkpoint(self, pending=False):
+        """
+        Save the file offsets, or before a batch is written, the state needed to write it again
+        """
+        if pending:
+            state = {os.path.abspath(followed.path): followed.pending_checkpoint() for followed in self.files}
+            if self.output_size is not None:
+                state[OUTPUT_CHECKPOINT_KEY] = {'path': os.path.abspath(self.output_path), 'size': self.output_size}
+        else:
+            state = {os.path.abspath(followed.path): followed.checkpoint() for followed in self.files}
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _truncate_output(self, state):
+        """
+        Cut off results an interrupted batch appended to the output file
+        """
+        if not state or not self.output_path or os.path.abspath(self.output_path) != state.get('path'):
+            return
+        try:
+            if os.path.getsize(self.output_path) > state['size']:
+                print(f'Removing the results of an unfinished batch from {self.output_path}')
+                with open(self.output_path, 'r+b') as f:
+                    f.truncate(state['size'])
+        except FileNotFoundError:
+            pass
+
+    def run(self):
+        """
+        Follow the files until stop() is called, then flush what is left
+
+        Returns:
+            Dictionary with rows processed, anomalies detected, records inserted and batches flushed
+        """
+        print(f'Following {len(self.files)} file(s): {", ".join(f.path for f in self.files)} '
+              f'(flush every {self.batch_size} lines or {self.batch_seconds}s)')
+        self.analyzer._ensure_model_loaded()
+
+        try:
+            while not self.stop_event.is_set():
+                read_any = False
+
+                # Stop reading while a failed batch is being retried
+                if len(self.pending) < self.batch_size:
+                    for followed in self.files:
+                        lines = followed.poll()
+                        if lines:
+                            read_any = True
+                            if self.pending_since is None:
+                                self.pending_since = time.time()
+                            self.pending.extend(followed.to_entries(lines))
+
+                        # Flush the rest of a rotated file before moving on to the new one
+                        if followed.rotated and self.flush():
+                            followed.switch()
+                            self._save_checkpoint()
+
+                if self.pending and (len(self.pending) >= self.batch_size
+                                     or time.time() - self.pending_since >= self.batch_seconds):
+                    if not self.flush():
+                        self.stop_event.wait(self.poll_interval)
+                        continue
+
+                if not read_any:
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            self.flush()
+            for followed in self.files:
+                followed.close()
+
+        print(f'Stopped following: {self.summary["rows"]} log entries in {self.summary["batches"]} batches '
+              f'({self.summary["anomalies"]} anomalies)')
+        return dict(self.summary)
+
+    def stop(self):
+        """
+        Ask the follower to flush and stop; safe to call from a signal handler or another thread
+        """
+        self.stop_event.set()
+
+    def flush(self):
+        """
+        Classify and save the waiting lines, then checkpoint the file offsets
+
+        Returns:
+            True if nothing is left waiting
+        """
+        if not self.pending:
+            return True
+
+        from db_loader import BulkLoader
+        from result_store import JsonLinesWriter
+
+        try:
+            if self.output_path and self.output_size is None:
+                self.output_size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+            self._save_checkpoint(pending=True)
+
+            entries = self.pending
+            predictions = self.analyzer.predict_batch([entry['log'] for entry in entries])
+            results = self.analyzer._build_results_from_records(entries, predictions)
+
+            if self.save_db:
+                # Upsert so a batch saved just before a crash isn't duplicated when it is read again
+                loader = BulkLoader(self.analyzer.db_config, batch_size=self.analyzer.db_batch_size,
+                                    copy_format=self.analyzer.copy_format, upsert=True)
+                with self.analyzer.metrics.timer('db_insert_seconds'):
+                    inserted = loader.load(results)
+                self.analyzer.metrics.increment('db_rows_total', inserted)
+                self.summary['db_inserted'] += inserted
+            if self.output_path:
+                with self.analyzer.metrics.timer('output_write_seconds', {'format': 'jsonl'}):
+                    # Drop anything a failed attempt at this batch appended
+                    self._truncate_output({'path': os.path.abspath(self.output_path), 'size': self.output_size})
+                    writer = JsonLinesWriter(self.output_path, append=True)
+                    try:
+                        writer.write(results)
+                    finally:
+                        writer.close()
+                self.analyzer.metrics.increment('output_rows_total', len(results), {'format': 'jsonl'})
+        except Exception as e:
+            print(f'Error saving followed log batch, will retry: {str(e)}')
+            traceback.print_exc()
+            return False
+
+        lag = time.time() - self.pending_since
+        self.pending = []
+        self.pending_since = None
+        self.output_size = None
+        for followed in self.files:
+            followed.mark_saved()
+        self._save_checkpoint()
+
+        anomalies = sum(1 for r in results if r['status'] == 'anomaly')
+        self.summary['rows'] += len(results)
+        self.summary['anomalies'] += anomalies
+        self.summary['batches'] += 1
+        print(f'Processed {len(results)} new log entries ({anomalies} anomalies, lag {lag:.1f}s)')
+        return True
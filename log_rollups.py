@@ -0,0 +1,187 @@
+import os
+import datetime
+
+from db_loader import CONFIDENCE_BINS, ensure_logs_table, pooled_connection
+
+# Columns the status counts can be grouped by
+GROUP_COLUMNS = ('bucket', 'user_id', 'device_name', 'status')
+
+# Statuses counted as anomalies; the capitalized one is the web app's spelling
+ANOMALY_STATUSES = ('anomaly', 'Anomaly')
+
+
+def _pick_granularity(start, end):
+    """
+    Use the daily rollups when the time range starts and ends on whole days, the hourly ones otherwise
+    """
+    for value in (start, end):
+        if isinstance(value, datetime.datetime) and value.time() != datetime.time(0):
+            return 'hour'
+    return 'day'
+
+
+def _where(granularity, start=None, end=None, user_id=None, device_name=None, status=None):
+    """
+    Build the WHERE clause and parameters shared by the rollup queries
+    """
+    clauses = ['granularity = %s']
+    params = [granularity]
+    if start is not None:
+        # Count every bucket overlapping the range, including the one start falls in
+        clauses.append(f"bucket >= date_trunc('{granularity}', %s::timestamp)")
+        params.append(start)
+    if end is not None:
+        clauses.append('bucket < %s')
+        params.append(end)
+    if user_id is not None:
+        clauses.append('user_id = %s')
+        params.append(user_id)
+    if device_name is not None:
+        clauses.append('device_name = ANY(%s)')
+        params.append([device_name] if isinstance(device_name, str) else list(device_name))
+    if status is not None:
+        clauses.append('status = ANY(%s)')
+        params.append([status] if isinstance(status, str) else list(status))
+    return ' AND '.join(clauses), params
+
+
+def status_counts(db_config, group_by=('status',), start=None, end=None, granularity=None,
+                  user_id=None, device_name=None, status=None):
+    """
+    Count stored log rows from the rollup tables
+
+    Reads one row per bucket and group instead of scanning the logs table.
+    Rows without a time are not counted. Bounds are rounded to the rollup
+    granularity: every bucket that overlaps [start, end) is counted whole.
+
+    Args:
+        db_config: Database configuration dictionary
+        group_by: Columns to group by, from 'bucket', 'user_id', 'device_name' and 'status'
+        start: Start of the time range (optional)
+        end: End of the time range, exclusive (optional)
+        granularity: 'hour' or 'day' (default: 'day' if start and end fall on midnight)
+        user_id: Only count rows of this user (optional)
+        device_name: Only count rows of this device, or of any device in a list (optional)
+        status: Only count rows with this status, or any status in a list (optional)
+
+    Returns:
+        List of dictionaries with the group_by columns and 'count', in bucket order
+        when grouping by bucket and largest count first otherwise
+    """
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    for column in group_by:
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Can't group by {column!r}; use one of {', '.join(GROUP_COLUMNS)}")
+
+    granularity = granularity or _pick_granularity(start, end)
+    where, params = _where(granularity, start, end, user_id, device_name, status)
+    select = ', '.join(group_by + ['SUM(count)::bigint'])
+    sql = f"SELECT {select} FROM log_status_rollups WHERE {where}"
+    if group_by:
+        order = 'bucket' if 'bucket' in group_by else f'{len(group_by) + 1} DESC'
+        sql += f" GROUP BY {', '.join(group_by)} HAVING SUM(count) <> 0 ORDER BY {order}"
+
+    ensure_logs_table(db_config)
+    with pooled_connection(db_config) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        conn.commit()
+    return [dict(zip(group_by + ['count'], row)) for row in rows if row[-1] is not None]
+
+
+def anomaly_count(db_config, start=None, end=None, user_id=None, device_name=None):
+    """
+    Count the stored anomalies from the rollup tables
+
+    Args:
+        db_config: Database configuration dictionary
+        start: Start of the time range (optional)
+        end: End of the time range, exclusive (optional)
+        user_id: Only count anomalies of this user (optional)
+        device_name: Only count anomalies of this device, or of any device in a list (optional)
+
+    Returns:
+        Number of anomalies
+    """
+    counts = status_counts(db_config, group_by=(), start=start, end=end, user_id=user_id,
+                           device_name=device_name, status=ANOMALY_STATUSES)
+    return counts[0]['count'] if counts else 0
+
+
+def confidence_histogram(db_config, start=None, end=None, granularity=None, device_name=None, status=None):
+    """
+    Get the distribution of prediction confidences from the rollup tables
+
+    Args:
+        db_config: Database configuration dictionary
+        start: Start of the time range (optional)
+        end: End of the time range, exclusive (optional)
+        granularity: 'hour' or 'day' (default: 'day' if start and end fall on midnight)
+        device_name: Only count rows of this device, or of any device in a list (optional)
+        status: Only count rows with this status, or any status in a list (optional)
+
+    Returns:
+        List of CONFIDENCE_BINS counts; bin i holds confidences in [i / CONFIDENCE_BINS, (i + 1) / CONFIDENCE_BINS)
+    """
+    granularity = granularity or _pick_granularity(start, end)
+    where, params = _where(granularity, start, end, device_name=device_name, status=status)
+
+    ensure_logs_table(db_config)
+    with pooled_connection(db_config) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT confidence_bin, SUM(count)::bigint FROM log_confidence_rollups "
+                        f"WHERE {where} GROUP BY confidence_bin", params)
+            rows = cur.fetchall()
+        conn.commit()
+
+    histogram = [0] * CONFIDENCE_BINS
+    for confidence_bin, count in rows:
+        histogram[confidence_bin] = count
+    return histogram
+
+
+def main():
+    """
+    Print anomaly summaries from the rollup tables
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize stored log statuses from the rollup tables')
+    parser.add_argument('--by', nargs='*', choices=GROUP_COLUMNS, default=['status'], help='Columns to group the counts by')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, help='Start of the time range (ISO format)')
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat, help='End of the time range, exclusive (ISO format)')
+    parser.add_argument('--granularity', choices=['hour', 'day'], help='Rollup granularity (default: day unless a bound is not midnight)')
+    parser.add_argument('--user-id', type=int, help='Only count logs of this user')
+    parser.add_argument('--device', nargs='+', help='Only count logs of these devices')
+    parser.add_argument('--status', nargs='+', help='Only count logs with these statuses')
+    parser.add_argument('--top', type=int, default=20, help='Number of groups to print')
+    parser.add_argument('--histogram', action='store_true', help='Also print the confidence histogram')
+
+    args = parser.parse_args()
+
+    db_config = {
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': os.environ.get('DB_NAME', 'log_analyzer'),
+        'password': os.environ.get('DB_PASSWORD', 'logai'),
+        'port': os.environ.get('DB_PORT', 5432),
+    }
+
+    counts = status_counts(db_config, group_by=args.by, start=args.since, end=args.until, granularity=args.granularity,
+                           user_id=args.user_id, device_name=args.device, status=args.status)
+    print(f'Anomalies: {anomaly_count(db_config, args.since, args.until, args.user_id, args.device):,}')
+    for row in counts[:args.top]:
+        group = ', '.join(f'{column}={row[column]}' for column in args.by)
+        print(f"  {group or 'all'}: {row['count']:,}")
+    if len(counts) > args.top:
+        print(f'  ... {len(counts) - args.top} more groups')
+
+    if args.histogram:
+        histogram = confidence_histogram(db_config, args.since, args.until, args.granularity, args.device, args.status)
+        print('Confidence histogram:')
+        for index, count in enumerate(histogram):
+            print(f'  {index / CONFIDENCE_BINS:.1f}-{(index + 1) / CONFIDENCE_BINS:.1f}: {count:,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import os
+import time
+
+# Inference backends that can be selected with --backend
+BACKENDS = ['torch', 'torch-int8', 'onnx']
+
+
+def load_backend(name, model, model_path, device):
+    """
+    Build a forward function for the selected inference backend
+
+    Args:
+        name: Backend name, one of BACKENDS
+        model: The loaded fp32 RobertaForSequenceClassification model
+        model_path: Path to the model directory (used to cache the ONNX export)
+        device: torch device the model was loaded on
+
+    Returns:
+        Function taking a dictionary of padded input tensors and returning a logits tensor
+    """
+    import torch
+
+    if name == 'torch':
+        return lambda inputs: model(**inputs).logits
+
+    if name == 'torch-int8':
+        if device.type != 'cpu':
+            raise ValueError("The torch-int8 backend only runs on CPU")
+        print("Applying dynamic int8 quantization to linear layers...")
+        quantized_model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized_model.eval()
+        return lambda inputs: quantized_model(**inputs).logits
+
+    if name == 'onnx':
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime: pip install onnxruntime")
+
+        onnx_path = export_onnx(model, model_path)
+        print(f"Starting ONNX Runtime session for {onnx_path}...")
+        session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        input_names = {model_input.name for model_input in session.get_inputs()}
+
+        def forward(inputs):
+            feed = {k: v.cpu().numpy() for k, v in inputs.items() if k in input_names}
+            logits = session.run(['logits'], feed)[0]
+            return torch.from_numpy(logits).to(device)
+
+        return forward
+
+    raise ValueError(f"Unknown backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+
+
+def get_onnx_path(model_path):
+    """
+    Get the path of the cached ONNX export for a model directory
+
+    Args:
+        model_path: Path to the model directory
+
+    Returns:
+        Path to model.onnx in a '<model directory>-onnx' directory next to the model
+    """
+    return os.path.join(os.path.normpath(model_path) + '-onnx', 'model.onnx')
+
+
+def export_onnx(model, model_path):
+    """
+    Export the model to ONNX, reusing a cached export if it is newer than the weights
+
+    Args:
+        model: The loaded fp32 RobertaForSequenceClassification model
+        model_path: Path to the model directory
+
+    Returns:
+        Path to the ONNX file
+    """
+    import torch
+
+    onnx_path = get_onnx_path(model_path)
+    weights_path = os.path.join(model_path, 'model.safetensors')
+
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(weights_path):
+        return onnx_path
+
+    print(f"Exporting model to ONNX at {onnx_path}...")
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+
+    cpu_model = model.to('cpu')
+    sample_inputs = {
+        'input_ids': torch.ones((2, 8), dtype=torch.long),
+        'attention_mask': torch.ones((2, 8), dtype=torch.long),
+    }
+    export_kwargs = {}
+    if 'dynamo' in torch.onnx.export.__code__.co_varnames:
+        export_kwargs['dynamo'] = False
+
+    with torch.inference_mode():
+        torch.onnx.export(
+            cpu_model,
+            (sample_inputs['input_ids'], sample_inputs['attention_mask']),
+            onnx_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'},
+            },
+            opset_version=14,
+            **export_kwargs
+        )
+    print("ONNX export complete")
+    return onnx_path
+
+
+def validate_backend(model_path, csv_file_path, backend, batch_size=32, reference_backend='torch'):
+    """
+    Compare a backend's predictions against the fp32 torch model on a held-out CSV
+
+    Args:
+        model_path: Path to the model directory
+        csv_file_path: Path to a CSV file with a 'log' column; if it also has a
+                       'label' column of 'anomaly'/'normal' values, accuracy is reported too
+        backend: Backend to validate
+        batch_size: Number of logs per forward pass
+        reference_backend: Backend to compare against (default: fp32 torch)
+
+    Returns:
+        Dictionary with label agreement, confidence differences, timings and speedup
+    """
+    import pandas as pd
+    from log_analyzer_tool import LogAnalyzerTool
+
+    df = pd.read_csv(csv_file_path)
+    if 'log' not in df.columns:
+        raise ValueError('CSV file must contain a "log" column')
+    log_texts = df['log'].tolist()
+
+    runs = {}
+    for name in (reference_backend, backend):
+        analyzer = LogAnalyzerTool(model_path=model_path, batch_size=batch_size, cache_size=0, backend=name, lazy_load=False)
+        if not analyzer.model_loaded:
+            raise RuntimeError(f"Could not load the model with the {name} backend")
+        start = time.perf_counter()
+        runs[name] = (analyzer.predict_batch(log_texts), time.perf_counter() - start)
+        analyzer.close()
+
+    reference, reference_seconds = runs[reference_backend]
+    candidate, candidate_seconds = runs[backend]
+
+    confidence_diffs = [abs(r['score'] - c['score']) for r, c in zip(reference, candidate)]
+    report = {
+        'backend': backend,
+        'reference_backend': reference_backend,
+        'rows': len(log_texts),
+        'label_agreement': sum(r['label'] == c['label'] for r, c in zip(reference, candidate)) / max(1, len(log_texts)),
+        'mean_confidence_diff': sum(confidence_diffs) / max(1, len(confidence_diffs)),
+        'max_confidence_diff': max(confidence_diffs, default=0.0),
+        'reference_seconds': reference_seconds,
+        'backend_seconds': candidate_seconds,
+        'speedup': reference_seconds / candidate_seconds if candidate_seconds else 0.0,
+    }
+
+    if 'label' in df.columns:
+        labels = df['label'].astype(str).str.lower().tolist()
+        report['reference_accuracy'] = sum(r['label'] == l for r, l in zip(reference, labels)) / max(1, len(labels))
+        report['backend_accuracy'] = sum(c['label'] == l for c, l in zip(candidate, labels)) / max(1, len(labels))
+
+    return report
@@ -0,0 +1,245 @@
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Patterns used to turn a raw log line into a template. MAC addresses, IP
+# addresses and hex identifiers are masked before plain numbers so that their
+# digits are not masked piecemeal.
+TEMPLATE_PATTERNS = [
+    (re.compile(r'\b(?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}\b'), '<MAC>'),
+    (re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d{1,5})?\b'), '<IP>'),
+    (re.compile(r'\b[0-9A-Fa-f]{8}-(?:[0-9A-Fa-f]{4}-){3}[0-9A-Fa-f]{12}\b'), '<ID>'),
+    (re.compile(r'\b0[xX][0-9A-Fa-f]+\b'), '<HEX>'),
+    (re.compile(r'\b(?=[0-9A-Fa-f]*\d)(?=[0-9A-Fa-f]*[A-Fa-f])[0-9A-Fa-f]{8,}\b'), '<HEX>'),
+    (re.compile(r'\b\d+(?:\.\d+)*'), '<NUM>'),
+]
+
+
+def mask_log_template(log_text):
+    """
+    Turn a log line into a template by masking its variable parts
+
+    Args:
+        log_text: The raw log text
+
+    Returns:
+        The log text with MACs, IPs, hex ids and numbers replaced by placeholders
+    """
+    template = str(log_text)
+    for pattern, placeholder in TEMPLATE_PATTERNS:
+        template = pattern.sub(placeholder, template)
+    return ' '.join(template.split())
+
+
+class PredictionCache:
+    """
+    Two-tier cache of model predictions keyed on normalized log templates
+
+    The memory tier is an LRU dictionary. The optional disk tier is a SQLite
+    file that persists predictions between runs. Keys include a namespace
+    (normally the model path and version) so that predictions from one model
+    are never returned for another.
+    """
+
+    def __init__(self, max_size=10000, cache_path=None, namespace=''):
+        """
+        Initialize the prediction cache
+
+        Args:
+            max_size: Maximum number of templates kept in memory (0 disables the memory tier)
+            cache_path: Path to a SQLite file used as a persistent tier (optional)
+            namespace: String identifying the model the predictions belong to
+        """
+        self.max_size = max(0, int(max_size))
+        self.cache_path = cache_path
+        self.namespace = namespace
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+
+        # Missing keys a caller has claimed to predict and not stored yet
+        self._in_flight = set()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_path:
+            cache_dir = os.path.dirname(os.path.abspath(cache_path))
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk = sqlite3.connect(cache_path, check_same_thread=False)
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS predictions (
+                    key TEXT PRIMARY KEY,
+                    label TEXT,
+                    score REAL
+                )
+            """)
+            self._disk.commit()
+
+    def key_for(self, log_text):
+        """
+        Build the cache key for a log line
+
+        Args:
+            log_text: The raw log text
+
+        Returns:
+            Hex digest of the namespace and the log's template
+        """
+        template = mask_log_template(log_text)
+        return hashlib.sha1(f'{self.namespace}\x00{template}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Look up several cache keys at once
+
+        Hits and misses are counted per key given, so a key repeated for
+        several log lines counts once for each of them.
+
+        Args:
+            keys: Iterable of keys returned by key_for
+
+        Returns:
+            Dictionary mapping each key that was found to a prediction dictionary
+        """
+        return self._get_many(keys, claim=False)[0]
+
+    def claim_many(self, keys):
+        """
+        Look up several cache keys and claim the missing ones for the caller to predict
+
+        A missing key that another caller has already claimed is returned as
+        in flight rather than claimed again, and is not counted as a hit or a
+        miss yet: the caller should look it up with get_many once that
+        prediction has had time to be stored, instead of predicting it a
+        second time. Claims end when put_many stores the key or release is
+        called.
+
+        Args:
+            keys: Iterable of keys returned by key_for
+
+        Returns:
+            Tuple of (dictionary mapping each key that was found to a prediction dictionary,
+            set of keys claimed by this call, set of missing keys claimed by another caller)
+        """
+        return self._get_many(keys, claim=True)
+
+    def release(self, keys):
+        """
+        Drop the claims on keys whose predictions will not be stored, e.g. after a failed forward pass
+
+        Args:
+            keys: Iterable of keys claimed with claim_many
+        """
+        with self._lock:
+            self._in_flight.difference_update(keys)
+
+    def _get_many(self, keys, claim):
+        """
+        Look up keys, counting hits and misses per key given, and optionally claim the missing ones
+        """
+        found = {}
+        missing = []
+        occurrences = {}
+        for key in keys:
+            occurrences[key] = occurrences.get(key, 0) + 1
+
+        with self._lock:
+            for key, count in occurrences.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = dict(self._memory[key])
+                    self.memory_hits += count
+                else:
+                    missing.append(key)
+
+            if self._disk is not None and missing:
+                # SQLite limits the number of host parameters per statement
+                for start in range(0, len(missing), 500):
+                    keys_chunk = missing[start:start + 500]
+                    placeholders = ','.join('?' * len(keys_chunk))
+                    rows = self._disk.execute(
+                        f'SELECT key, label, score FROM predictions WHERE key IN ({placeholders})',
+                        keys_chunk
+                    ).fetchall()
+                    for key, label, score in rows:
+                        found[key] = {"label": label, "score": score}
+                        self._remember(key, found[key])
+                        self.disk_hits += occurrences[key]
+
+            claimed = set()
+            in_flight = set()
+            for key in missing:
+                if key in found:
+                    continue
+                if claim and key in self._in_flight:
+                    in_flight.add(key)
+                else:
+                    claimed.add(key)
+                    self.misses += occurrences[key]
+            if claim:
+                self._in_flight.update(claimed)
+
+        return found, claimed if claim else set(), in_flight
+
+    def put_many(self, predictions):
+        """
+        Store several predictions at once
+
+        Args:
+            predictions: Dictionary mapping cache keys to prediction dictionaries
+        """
+        with self._lock:
+            for key, prediction in predictions.items():
+                self._remember(key, prediction)
+            self._in_flight.difference_update(predictions)
+
+            if self._disk is not None and predictions:
+                self._disk.executemany(
+                    'INSERT OR REPLACE INTO predictions (key, label, score) VALUES (?, ?, ?)',
+                    [(key, p['label'], p['score']) for key, p in predictions.items()]
+                )
+                self._disk.commit()
+
+    def _remember(self, key, prediction):
+        """
+        Add a prediction to the memory tier, evicting the least recently used entry
+        """
+        if self.max_size == 0:
+            return
+        self._memory[key] = {"label": prediction['label'], "score": prediction['score']}
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """
+        Get hit/miss statistics for the cache
+
+        Returns:
+            Dictionary with hit and miss counts, hit rate and memory tier size
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'persistent': self._disk is not None,
+            }
+
+    def close(self):
+        """
+        Close the disk tier, if any
+        """
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
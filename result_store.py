@@ -0,0 +1,493 @@
+import os
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+# Output formats accepted by open_result_writer and --output-format
+OUTPUT_FORMATS = ['json', 'jsonl', 'columnar']
+
+# Low-cardinality text columns stored as int32 codes into a dictionary
+DICTIONARY_COLUMNS = ('device_name', 'device_mac', 'device_ip', 'status', 'method')
+
+# Storage kind of the other known result columns; anything else is stored as text
+COLUMN_KINDS = {
+    'user_id': 'int64',
+    'template_id': 'int64',
+    'confidence': 'float32',
+    'time': 'datetime',
+}
+
+# Files holding a column of each storage kind, by extension
+COLUMN_FILE_EXTENSIONS = {
+    'dictionary': ('codes',),
+    'float32': ('f32',),
+    'int64': ('i64',),
+    'datetime': ('i64',),
+    'string': ('data', 'offsets', 'valid'),
+}
+
+STORE_VERSION = 1
+NULL_INT = np.iinfo(np.int64).min
+NULL_CODE = -1
+
+
+def _is_null(value):
+    """
+    Check whether a result value is missing (None or NaN)
+    """
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def iter_records(results):
+    """
+    Iterate over results as dictionaries
+
+    Args:
+        results: List of result dictionaries, or a DataFrame with one column per field
+
+    Returns:
+        Iterator of result dictionaries
+    """
+    if not hasattr(results, 'columns'):
+        return iter(results)
+    names = list(results.columns)
+    columns = [results[name].tolist() for name in names]
+    return (dict(zip(names, row)) for row in zip(*columns))
+
+
+def _string_value(value):
+    """
+    Text stored for a string column value; lists such as template parameters are stored as JSON
+    """
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _column_kind(name):
+    if name in DICTIONARY_COLUMNS:
+        return 'dictionary'
+    return COLUMN_KINDS.get(name, 'string')
+
+
+def _remove_store(path):
+    """
+    Delete the files of the result store in a directory, refusing to touch a directory holding anything else
+
+    Only the column files listed in the store's meta.json and meta.json itself
+    are removed, so other files next to the store are kept.
+
+    Args:
+        path: Existing directory
+    """
+    if not os.listdir(path):
+        return
+    meta_path = os.path.join(path, 'meta.json')
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        columns = meta['columns']
+        file_names = [f'{name}.{extension}' for name, kind in columns.items()
+                      for extension in COLUMN_FILE_EXTENSIONS[kind]]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError(f"{path} is not empty and does not hold a result store; "
+                         f"choose a new or empty directory for columnar output")
+    for name in file_names + ['meta.json']:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class ColumnarResultWriter:
+    """
+    Append analysis results to a memory-mappable columnar store
+
+    The store is a directory holding one flat binary file per column and a
+    meta.json describing them. Device, MAC, IP, status and method columns are
+    dictionary-encoded as int32 codes, confidence is float32, time is int64
+    nanoseconds and user_id is int64; other columns such as the log text are
+    stored as UTF-8 bytes with int64 end offsets and a validity byte per row.
+    Every call to write appends to the column files and rewrites meta.json,
+    so results can be written chunk by chunk and the store is readable after
+    each chunk.
+    """
+
+    def __init__(self, path):
+        """
+        Create an empty store, replacing any store already at path
+
+        Args:
+            path: Directory to write the store to; it must be new, empty or hold a store
+
+        Raises:
+            ValueError: If path is a file or a non-empty directory without a store
+        """
+        self.path = path
+        if os.path.isdir(path):
+            _remove_store(path)
+        elif os.path.exists(path):
+            raise ValueError(f"{path} is a file; columnar output needs a directory path")
+        else:
+            os.makedirs(path)
+
+        self.rows = 0
+        self.columns = {}
+        self.dictionaries = {}
+        self._codes = {}
+        self._string_ends = {}
+        self._files = {}
+        self._write_meta()
+
+    def _file(self, name):
+        if name not in self._files:
+            self._files[name] = open(os.path.join(self.path, name), 'ab')
+        return self._files[name]
+
+    def _add_column(self, name):
+        """
+        Start a new column, filling it with nulls for the rows already written
+        """
+        kind = _column_kind(name)
+        self.columns[name] = kind
+        if kind == 'dictionary':
+            self.dictionaries[name] = []
+            self._codes[name] = {}
+        elif kind == 'string':
+            self._string_ends[name] = 0
+        if self.rows:
+            self._append(name, [None] * self.rows)
+
+    def _append(self, name, values):
+        """
+        Append values to one column's files
+        """
+        kind = self.columns[name]
+
+        if kind == 'dictionary':
+            # Factorize the chunk, then map its distinct values onto the store's codes
+            codes = self._codes[name]
+            dictionary = self.dictionaries[name]
+            chunk_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+            mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+            mapping[-1] = NULL_CODE
+            for i, value in enumerate(uniques):
+                value = str(value)
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(dictionary)
+                    dictionary.append(value)
+                mapping[i] = code
+            encoded = mapping[chunk_codes]
+            self._file(f'{name}.codes').write(encoded.tobytes())
+
+        elif kind == 'float32':
+            array = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float32)
+            self._file(f'{name}.f32').write(array.tobytes())
+
+        elif kind == 'int64':
+            numbers = pd.to_numeric(pd.Series(values), errors='coerce')
+            array = np.where(numbers.isna(), NULL_INT, numbers.fillna(0).astype(np.int64)).astype(np.int64)
+            self._file(f'{name}.i64').write(array.tobytes())
+
+        elif kind == 'datetime':
+            times = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce')
+            if getattr(times.dt, 'tz', None) is not None:
+                times = times.dt.tz_convert(None)
+            array = times.values.astype('datetime64[ns]').view(np.int64)
+            self._file(f'{name}.i64').write(array.tobytes())
+
+        else:
+            if hasattr(values, 'tolist'):
+                values = values.tolist()
+            valid = np.array([not _is_null(value) for value in values], dtype=np.uint8)
+            encoded = [_string_value(value).encode('utf-8') if ok else b'' for value, ok in zip(values, valid)]
+            lengths = np.fromiter((len(item) for item in encoded), dtype=np.int64, count=len(encoded))
+            ends = self._string_ends[name] + np.cumsum(lengths)
+            self._file(f'{name}.data').write(b''.join(encoded))
+            if len(ends):
+                self._string_ends[name] = int(ends[-1])
+            self._file(f'{name}.offsets').write(ends.tobytes())
+            self._file(f'{name}.valid').write(valid.tobytes())
+
+    def write_columns(self, columns, num_rows):
+        """
+        Append a chunk of results given as columns
+
+        Args:
+            columns: Dictionary mapping column names to lists, arrays or Series of num_rows values
+            num_rows: Number of rows in the chunk
+        """
+        if not num_rows:
+            return
+        for name in columns:
+            if name not in self.columns:
+                self._add_column(name)
+        for name in self.columns:
+            self._append(name, columns[name] if name in columns else [None] * num_rows)
+        self.rows += num_rows
+
+        for f in self._files.values():
+            f.flush()
+        self._write_meta()
+
+    def write(self, results):
+        """
+        Append a chunk of results
+
+        A DataFrame is written column by column without building a dictionary per row.
+
+        Args:
+            results: List of result dictionaries, or a DataFrame from LogAnalyzerTool.analyze_frame
+        """
+        if hasattr(results, 'columns'):
+            self.write_columns({name: results[name] for name in results.columns}, len(results))
+            return
+        names = list(dict.fromkeys(name for result in results for name in result))
+        self.write_columns({name: [result.get(name) for result in results] for name in names}, len(results))
+
+    def _write_meta(self):
+        meta = {
+            'version': STORE_VERSION,
+            'rows': self.rows,
+            'columns': self.columns,
+            'dictionaries': self.dictionaries,
+        }
+        temp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        """
+        Close the column files
+        """
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class JsonLinesWriter:
+    """
+    Append analysis results to a JSON Lines file, one result per line
+    """
+
+    def __init__(self, path, append=False):
+        """
+        Open the output file
+
+        Args:
+            path: Path of the JSON Lines file
+            append: Whether to keep existing lines instead of truncating the file
+        """
+        self.path = path
+        self.file = open(path, 'a' if append else 'w')
+
+    def write(self, results):
+        """
+        Append a chunk of results, given as a list of dictionaries or a DataFrame
+        """
+        self.file.writelines(json.dumps(result) + '\n' for result in iter_records(results))
+
+    def close(self):
+        self.file.close()
+
+
+def open_result_writer(path, output_format='jsonl'):
+    """
+    Open an incremental writer for analysis results
+
+    Args:
+        path: Output file (jsonl) or directory (columnar)
+        output_format: 'jsonl' or 'columnar'
+
+    Returns:
+        Writer with write(results) and close() methods
+    """
+    if output_format == 'columnar':
+        return ColumnarResultWriter(path)
+    if output_format == 'jsonl':
+        return JsonLinesWriter(path)
+    raise ValueError(f"Incremental output requires 'jsonl' or 'columnar', not '{output_format}'")
+
+
+class ColumnarResultReader:
+    """
+    Read a columnar result store through memory maps
+
+    Columns are only mapped when first used, and filters compare the mapped
+    dictionary codes directly, so selecting the anomalies of one device
+    touches just the status and device_name codes rather than the whole file.
+    """
+
+    def __init__(self, path):
+        """
+        Open a store written by ColumnarResultWriter
+
+        Args:
+            path: Directory of the store
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported result store version: {meta.get('version')}")
+
+        self.rows = meta['rows']
+        self.columns = meta['columns']
+        self.dictionaries = meta['dictionaries']
+        self._maps = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self, file_name, dtype):
+        if file_name not in self._maps:
+            if self.rows == 0:
+                self._maps[file_name] = np.empty(0, dtype=dtype)
+            else:
+                file_path = os.path.join(self.path, file_name)
+                count = self.rows if not file_name.endswith('.data') else os.path.getsize(file_path)
+                if count == 0:
+                    self._maps[file_name] = np.empty(0, dtype=dtype)
+                else:
+                    self._maps[file_name] = np.memmap(file_path, dtype=dtype, mode='r', shape=(count,))
+        return self._maps[file_name]
+
+    def column(self, name):
+        """
+        Get the raw memory-mapped array of a fixed-width column
+
+        Args:
+            name: Column name
+
+        Returns:
+            int32 codes for dictionary columns, float32 for confidence, int64 for
+            user_id and time (nanoseconds); string columns are not fixed-width
+        """
+        kind = self.columns[name]
+        if kind == 'dictionary':
+            return self._map(f'{name}.codes', np.int32)
+        if kind == 'float32':
+            return self._map(f'{name}.f32', np.float32)
+        if kind in ('int64', 'datetime'):
+            return self._map(f'{name}.i64', np.int64)
+        raise ValueError(f"Column '{name}' is a string column; use values() instead")
+
+    def _code_mask(self, name, wanted):
+        """
+        Build a boolean mask of rows whose dictionary value is one of wanted
+        """
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        dictionary = self.dictionaries.get(name, [])
+        codes = [dictionary.index(value) for value in wanted if value in dictionary]
+        return np.isin(self.column(name), codes)
+
+    def select(self, status=None, device_name=None, start_time=None, end_time=None):
+        """
+        Find the rows matching the given filters
+
+        Args:
+            status: Status value or list of values (e.g. 'anomaly')
+            device_name: Device name or list of names
+            start_time: Earliest time to include (anything pandas can parse)
+            end_time: Latest time to include
+
+        Returns:
+            numpy array of matching row indices
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        if status is not None:
+            mask &= self._code_mask('status', status)
+        if device_name is not None:
+            mask &= self._code_mask('device_name', device_name)
+        if start_time is not None or end_time is not None:
+            times = self.column('time')
+            mask &= times != NULL_INT
+            if start_time is not None:
+                mask &= times >= pd.Timestamp(start_time).value
+            if end_time is not None:
+                mask &= times <= pd.Timestamp(end_time).value
+        return np.flatnonzero(mask)
+
+    def values(self, name, indices=None):
+        """
+        Decode the values of one column
+
+        Args:
+            name: Column name
+            indices: Row indices to decode (default: every row)
+
+        Returns:
+            List of Python values, with None for missing values
+        """
+        if indices is None:
+            indices = np.arange(self.rows)
+        kind = self.columns[name]
+
+        if kind == 'dictionary':
+            dictionary = self.dictionaries[name]
+            return [dictionary[code] if code != NULL_CODE else None for code in self.column(name)[indices].tolist()]
+        if kind == 'float32':
+            return [None if math.isnan(value) else value for value in self.column(name)[indices].tolist()]
+        if kind == 'int64':
+            return [None if value == NULL_INT else value for value in self.column(name)[indices].tolist()]
+        if kind == 'datetime':
+            return [None if value == NULL_INT else pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+                    for value in self.column(name)[indices].tolist()]
+
+        ends = self._map(f'{name}.offsets', np.int64)
+        valid = self._map(f'{name}.valid', np.uint8)
+        data = self._map(f'{name}.data', np.uint8)
+        values = []
+        for i in np.asarray(indices).tolist():
+            if not valid[i]:
+                values.append(None)
+                continue
+            start = int(ends[i - 1]) if i > 0 else 0
+            values.append(data[start:int(ends[i])].tobytes().decode('utf-8'))
+        return values
+
+    def rows_as_dicts(self, indices=None, columns=None):
+        """
+        Materialize selected rows as result dictionaries
+
+        Args:
+            indices: Row indices (default: every row)
+            columns: Column names to include (default: all)
+
+        Returns:
+            List of result dictionaries
+        """
+        columns = columns or list(self.columns)
+        decoded = {name: self.values(name, indices) for name in columns}
+        count = len(next(iter(decoded.values()))) if decoded else 0
+        return [{name: decoded[name][i] for name in columns} for i in range(count)]
+
+
+def main():
+    """
+    Query a columnar result store from the command line
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Filter a columnar analysis result store')
+    parser.add_argument('store', help='Path to the result store directory')
+    parser.add_argument('--status', help='Only rows with this status (e.g. anomaly)')
+    parser.add_argument('--device', help='Only rows from this device name')
+    parser.add_argument('--start', help='Only rows at or after this time')
+    parser.add_argument('--end', help='Only rows at or before this time')
+    parser.add_argument('--limit', type=int, default=20, help='Maximum number of rows to print (0 prints only the count)')
+
+    args = parser.parse_args()
+
+    reader = ColumnarResultReader(args.store)
+    indices = reader.select(status=args.status, device_name=args.device, start_time=args.start, end_time=args.end)
+    print(f'{len(indices)} of {len(reader)} rows match')
+    for row in reader.rows_as_dicts(indices[:args.limit]) if args.limit else []:
+        print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+import math
+import time
+import zlib
+import datetime
+from array import array
+from collections import OrderedDict
+
+from prediction_cache import mask_log_template
+
+# Result fields a line's counters are kept under; each present value is its own key
+DEFAULT_KEY_FIELDS = ('device_ip', 'device_mac', 'device_name', 'user_id')
+
+# Flags added to a line's 'sequence_flags'
+FLAG_RATE_SPIKE = 'rate_spike'
+FLAG_TEMPLATE_BURST = 'template_burst'
+FLAG_RARE_TRANSITION = 'rare_transition'
+
+# Rescale a forward-decay sketch once its weights grow past e**RESCALE_EXPONENT
+RESCALE_EXPONENT = 40.0
+
+
+def _mix(first, second):
+    """
+    Combine two integers into a 64-bit hash; unlike hash() of strings it is the same in every process
+    """
+    value = ((first * 0x9E3779B97F4A7C15) ^ second) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+def _key_hash(key):
+    """
+    Hash a (field, value) key to 64 bits
+    """
+    data = repr(key).encode('utf-8')
+    return zlib.crc32(data) | (zlib.crc32(data, 0x5BD1E995) << 32)
+
+
+class DecayingCountMinSketch:
+    """
+    Count-min sketch of exponentially decayed counts
+
+    Uses forward decay: an item seen at time t adds exp(λ(t - landmark)) to
+    its counters, and estimates are scaled back by exp(-λ(now - landmark)),
+    so an update or query touches only `depth` counters however old the
+    sketch is. The counters are rescaled, and the landmark moved, once the
+    weights get large. Estimates never undercount; with width w they
+    overcount by at most e/w of the total decayed count with probability
+    1 - e**-depth. Without a half life the counts don't decay.
+    """
+
+    def __init__(self, width=1 << 16, depth=4, half_life=None):
+        """
+        Initialize an empty sketch
+
+        Args:
+            width: Number of counters per row
+            depth: Number of rows (hash functions)
+            half_life: Seconds after which a count has halved (default: no decay)
+        """
+        self.width = width
+        self.depth = depth
+        self.decay_rate = math.log(2) / half_life if half_life else 0.0
+        self.landmark = None
+        self.rows = [array('d', bytes(8 * width)) for _ in range(depth)]
+
+    def _indices(self, item_hash):
+        # Double hashing: row i uses h1 + i * h2
+        h1 = item_hash & 0xFFFFFFFF
+        h2 = ((item_hash >> 32) & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def _weight(self, timestamp):
+        if not self.decay_rate:
+            return 1.0
+        if self.landmark is None:
+            self.landmark = timestamp
+        # Much older occurrences weigh next to nothing; clamping keeps the weight from underflowing to zero
+        exponent = max(self.decay_rate * (timestamp - self.landmark), -RESCALE_EXPONENT)
+        if exponent > RESCALE_EXPONENT:
+            scale = math.exp(-exponent)
+            for row in self.rows:
+                for index, value in enumerate(row):
+                    if value:
+                        row[index] = value * scale
+            self.landmark = timestamp
+            exponent = 0.0
+        return math.exp(exponent)
+
+    def add(self, item_hash, timestamp=0.0, count=1.0):
+        """
+        Count an item and return its new estimate
+
+        Args:
+            item_hash: 64-bit hash of the item
+            timestamp: Time of the occurrence, in seconds
+            count: Amount to add
+
+        Returns:
+            Decayed count estimate of the item at timestamp, including this occurrence
+        """
+        weight = self._weight(timestamp)
+        estimate = None
+        for row, index in zip(self.rows, self._indices(item_hash)):
+            value = row[index] + count * weight
+            row[index] = value
+            estimate = value if estimate is None or value < estimate else estimate
+        return estimate / weight
+
+    def estimate(self, item_hash, timestamp=0.0):
+        """
+        Get the decayed count estimate of an item
+
+        Args:
+            item_hash: 64-bit hash of the item
+            timestamp: Time to decay the count to, in seconds
+
+        Returns:
+            Estimated count
+        """
+        weight = self._weight(timestamp)
+        return min(row[index] for row, index in zip(self.rows, self._indices(item_hash))) / weight
+
+
+class _KeyState:
+    """
+    Streaming state of one device or user: two decayed event rates and the last template seen
+    """
+
+    __slots__ = ('key_hash', 'first_seen', 'last_seen', 'fast', 'slow', 'last_template')
+
+    def __init__(self, key, timestamp):
+        self.key_hash = _key_hash(key)
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.fast = 0.0
+        self.slow = 0.0
+        self.last_template = None
+
+
+class SequenceDetector:
+    """
+    Flag log lines that are only suspicious as part of a pattern
+
+    Lines are observed in order and keyed by each of their device IP, MAC,
+    name and user id. For every key the detector keeps two exponentially
+    decayed event rates, over a short and a long half life, in constant
+    memory. Counts per key and template share two decayed count-min
+    sketches, and template transitions of each device share a third, so
+    memory does not grow with the number of templates. A line gets:
+
+    - rate_spike:<field> when its key's short-term rate jumps to
+      spike_factor times its long-term rate;
+    - template_burst:<field> when the same happens for its template alone
+      (e.g. a burst of "Failed login attempt" from one IP);
+    - rare_transition when, on its device, the previous line's template is
+      common but rarely followed by this line's template.
+
+    Rates use the lines' own timestamps (or the arrival time when a line has
+    none), so replayed files are judged as they happened. The rates assume
+    lines arrive in time order: flag_records and flag_frame observe each
+    batch sorted by time, and a line older than its key's latest line by more
+    than reorder_tolerance seconds (e.g. from an earlier batch) is counted at
+    its own time but not judged. Keys are only judged after warmup_seconds of
+    history, and at most max_keys keys are tracked, dropping the least
+    recently seen.
+    """
+
+    def __init__(self, key_fields=DEFAULT_KEY_FIELDS, short_half_life=60.0, long_half_life=3600.0,
+                 spike_factor=5.0, min_events=10, warmup_seconds=600.0, transition_half_life=86400.0,
+                 rare_probability=0.01, min_transition_support=50, max_keys=100000, sketch_width=1 << 16,
+                 sketch_depth=4, reorder_tolerance=60.0):
+        """
+        Initialize the detector
+
+        Args:
+            key_fields: Result fields whose values are tracked as keys
+            short_half_life: Half life in seconds of the short-term rates
+            long_half_life: Half life in seconds of the long-term (baseline) rates
+            spike_factor: Ratio of short-term to long-term rate that counts as a spike
+            min_events: Minimum decayed number of recent events before a spike is flagged
+            warmup_seconds: History a key needs before its rates are judged
+            transition_half_life: Half life in seconds of the template transition counts
+            rare_probability: Transition probability below which a transition is rare
+            min_transition_support: Minimum count of the previous template before its transitions are judged
+            max_keys: Maximum number of keys tracked at once
+            sketch_width: Counters per row of each count-min sketch
+            sketch_depth: Rows of each count-min sketch
+            reorder_tolerance: Seconds a line may be older than its key's latest line and still be judged
+        """
+        self.key_fields = tuple(key_fields)
+        self.short_half_life = short_half_life
+        self.long_half_life = long_half_life
+        self.spike_factor = spike_factor
+        self.min_events = min_events
+        self.warmup_seconds = warmup_seconds
+        self.rare_probability = rare_probability
+        self.min_transition_support = min_transition_support
+        self.max_keys = max_keys
+        self.reorder_tolerance = reorder_tolerance
+
+        self._fast_decay = math.log(2) / short_half_life
+        self._slow_decay = math.log(2) / long_half_life
+        self._keys = OrderedDict()
+        self._template_fast = DecayingCountMinSketch(sketch_width, sketch_depth, short_half_life)
+        self._template_slow = DecayingCountMinSketch(sketch_width, sketch_depth, long_half_life)
+        self._transitions = DecayingCountMinSketch(sketch_width, sketch_depth, transition_half_life)
+        self._transition_sources = DecayingCountMinSketch(sketch_width, sketch_depth, transition_half_life)
+        self._template_ids = {}
+        self._last_time_text = None
+        self._last_time_value = None
+
+        self.lines = 0
+        self.late_lines = 0
+        self.flag_counts = {}
+
+    def template_of(self, log_text):
+        """
+        Get a stable integer id for the masked template of a log line
+        """
+        template_id = self._template_ids.get(log_text)
+        if template_id is None:
+            if len(self._template_ids) >= self.max_keys:
+                self._template_ids.clear()
+            template_id = zlib.crc32(mask_log_template(log_text).encode('utf-8'))
+            self._template_ids[log_text] = template_id
+        return template_id
+
+    def _timestamp(self, value):
+        """
+        Convert a result's time to seconds, falling back to the current time
+        """
+        if value is None or value != value:  # None or NaN
+            return time.time()
+        if hasattr(value, 'timestamp'):
+            return value.timestamp()
+        text = str(value)
+        if text == self._last_time_text:
+            return self._last_time_value
+        try:
+            seconds = datetime.datetime.fromisoformat(text).timestamp()
+        except ValueError:
+            return time.time()
+        self._last_time_text, self._last_time_value = text, seconds
+        return seconds
+
+    def _key_state(self, key, timestamp):
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = _KeyState(key, timestamp)
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(key)
+        return state
+
+    def observe(self, keys, timestamp, template):
+        """
+        Update the counters with one line and get its flags
+
+        Lines should be observed in time order. A line older than a key's
+        latest line is counted at its own time, and if it is older by more
+        than reorder_tolerance, it gets no flags from that key.
+
+        Args:
+            keys: List of (field, value) pairs identifying the line's device and user
+            timestamp: Time of the line, in seconds
+            template: Integer template id of the line
+
+        Returns:
+            List of flags
+        """
+        flags = []
+        late = False
+        for position, key in enumerate(keys):
+            state = self._key_state(key, timestamp)
+            elapsed = timestamp - state.last_seen
+            # Decayed event counts over the short and long half lives, kept as of the key's latest line
+            if elapsed >= 0.0:
+                state.last_seen = timestamp
+                state.fast = state.fast * math.exp(-self._fast_decay * elapsed) + 1.0
+                state.slow = state.slow * math.exp(-self._slow_decay * elapsed) + 1.0
+            else:
+                # A late line adds its weight as decayed to the latest line, not a fresh event
+                state.fast += math.exp(self._fast_decay * elapsed)
+                state.slow += math.exp(self._slow_decay * elapsed)
+                state.first_seen = min(state.first_seen, timestamp)
+            judged = -elapsed <= self.reorder_tolerance
+            late = late or not judged
+
+            item = _mix(state.key_hash, template)
+            template_fast = self._template_fast.add(item, timestamp)
+            template_slow = self._template_slow.add(item, timestamp)
+
+            age = timestamp - state.first_seen
+            if judged and age >= self.warmup_seconds:
+                # A decayed count covers (1 - e**(-λ age)) / λ seconds, so young keys aren't mistaken for spikes
+                fast_window = -math.expm1(-self._fast_decay * age) / self._fast_decay
+                slow_window = -math.expm1(-self._slow_decay * age) / self._slow_decay
+                threshold = self.spike_factor * fast_window / slow_window
+                if state.fast >= self.min_events and state.fast >= threshold * state.slow:
+                    flags.append(f'{FLAG_RATE_SPIKE}:{key[0]}')
+                if template_fast >= self.min_events and template_fast >= threshold * template_slow:
+                    flags.append(f'{FLAG_TEMPLATE_BURST}:{key[0]}')
+
+            # Template sequences are followed on the first key, the most specific device identifier
+            if position == 0 and judged:
+                previous = state.last_template
+                state.last_template = template
+                if previous is not None:
+                    source = _mix(previous, 0)
+                    pair = _mix(previous, template + 1)
+                    support = self._transition_sources.estimate(source, timestamp)
+                    transition = self._transitions.estimate(pair, timestamp)
+                    if support >= self.min_transition_support and transition < self.rare_probability * support:
+                        flags.append(FLAG_RARE_TRANSITION)
+                    self._transition_sources.add(source, timestamp)
+                    self._transitions.add(pair, timestamp)
+
+        self.lines += 1
+        self.late_lines += late
+        for flag in flags:
+            self.flag_counts[flag] = self.flag_counts.get(flag, 0) + 1
+        return flags
+
+    def _keys_of(self, values):
+        return [(field, value) for field, value in zip(self.key_fields, values)
+                if value is not None and value == value and value != '']
+
+    @staticmethod
+    def _time_order(timestamps):
+        """
+        Get the indices of a batch's lines sorted by time, keeping the order of lines with equal times
+        """
+        if all(earlier <= later for earlier, later in zip(timestamps, timestamps[1:])):
+            return range(len(timestamps))
+        return sorted(range(len(timestamps)), key=timestamps.__getitem__)
+
+    def flag_records(self, records):
+        """
+        Observe result dictionaries in time order and get their flags
+
+        Args:
+            records: List of result dictionaries with 'log' and optional time, template_id and key fields
+
+        Returns:
+            List of comma-separated flag strings in the order of records, '' for lines without flags
+        """
+        timestamps = [self._timestamp(record.get('time')) for record in records]
+        flags = [''] * len(records)
+        for index in self._time_order(timestamps):
+            record = records[index]
+            template = record.get('template_id')
+            if template is None:
+                template = self.template_of(record['log'])
+            keys = self._keys_of([record.get(field) for field in self.key_fields])
+            flags[index] = ','.join(self.observe(keys, timestamps[index], template))
+        return flags
+
+    def flag_frame(self, frame):
+        """
+        Observe the rows of a results DataFrame in time order and get their flags
+
+        Args:
+            frame: DataFrame with a 'log' column and optional time, template_id and key columns
+
+        Returns:
+            List of comma-separated flag strings in the order of the rows, '' for lines without flags
+        """
+        num_rows = len(frame)
+
+        def column(name):
+            return frame[name].tolist() if name in frame.columns else [None] * num_rows
+
+        if 'template_id' in frame.columns:
+            templates = frame['template_id'].tolist()
+        else:
+            templates = [self.template_of(log_text) for log_text in frame['log'].tolist()]
+        key_columns = [column(field) for field in self.key_fields]
+
+        timestamps = [self._timestamp(value) for value in column('time')]
+        flags = [''] * num_rows
+        for index in self._time_order(timestamps):
+            keys = self._keys_of([values[index] for values in key_columns])
+            flags[index] = ','.join(self.observe(keys, timestamps[index], templates[index]))
+        return flags
+
+    def stats(self):
+        """
+        Get the number of lines observed, late lines not judged, keys tracked and flags raised by kind
+        """
+        return {'lines': self.lines, 'late_lines': self.late_lines, 'keys': len(self._keys),
+                'flags': dict(self.flag_counts)}
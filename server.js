@@ -47,6 +47,26 @@ const initializeDatabase = async () => {
   }
 };
 
+// Classify logs with the warm Python analysis service (log_analyzer_server.py)
+const ANALYZER_URL = process.env.ANALYZER_URL || 'http://127.0.0.1:8765';
+
+const proxyToAnalyzer = (endpoint) => async (req, res) => {
+  try {
+    const response = await fetch(`${ANALYZER_URL}${endpoint}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(req.body),
+    });
+    res.status(response.status).json(await response.json());
+  } catch (error) {
+    console.error('Error reaching analysis service:', error.message);
+    res.status(503).json({ error: 'Analysis service unavailable' });
+  }
+};
+
+app.post('/api/analyze', proxyToAnalyzer('/predict'));
+app.post('/api/analyze/batch', proxyToAnalyzer('/predict_batch'));
+
 // API Routes
 app.use('/api/users', userRoutes);
 app.use('/api/logs', logRoutes);
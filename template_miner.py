@@ -0,0 +1,234 @@
+import os
+import json
+import threading
+
+from prediction_cache import TEMPLATE_PATTERNS
+
+# Placeholder for a token position that varies between the members of a cluster
+WILDCARD = '<*>'
+
+
+def mask_token(token):
+    """
+    Replace a token that is a variable (IP, MAC, hex id, number, ...) by its placeholder
+
+    Args:
+        token: One whitespace-separated token of a log line
+
+    Returns:
+        The token with its variable parts masked
+    """
+    for pattern, placeholder in TEMPLATE_PATTERNS:
+        token = pattern.sub(placeholder, token)
+    return token
+
+
+def _is_variable(token):
+    """
+    Check whether a template token is a wildcard or contains a masked variable
+    """
+    return token == WILDCARD or ('<' in token and any(placeholder in token for _, placeholder in TEMPLATE_PATTERNS))
+
+
+class LogCluster:
+    """
+    A group of log lines sharing one template
+    """
+
+    def __init__(self, cluster_id, template_tokens, route=None):
+        self.cluster_id = cluster_id
+        self.template_tokens = list(template_tokens)
+        self.route = list(route or [])
+        self.size = 0
+        self.verdict = None
+
+    @property
+    def template(self):
+        return ' '.join(self.template_tokens)
+
+    def to_dict(self):
+        return {'id': self.cluster_id, 'template': self.template, 'count': self.size}
+
+
+class DrainTemplateMiner:
+    """
+    Mine log templates online with a Drain-style fixed-depth parse tree
+
+    Each line is split into tokens and its variables (IPs, ports, MACs, hex
+    ids, counters) are masked. The tree routes the line by token count and
+    then by its first few tokens (tokens containing digits share a wildcard
+    branch) to a short list of clusters; the line joins the most similar one
+    if enough tokens match, turning differing positions into wildcards, or
+    starts a new cluster. Tokens for which is_protected returns True (e.g.
+    anomaly keywords) must match exactly, so 'login failed' and
+    'login succeeded' are never merged.
+
+    See He et al., "Drain: An Online Log Parsing Approach with Fixed Depth Tree" (ICWS 2017).
+    """
+
+    def __init__(self, depth=4, similarity_threshold=0.4, max_children=100, is_protected=None):
+        """
+        Initialize the miner
+
+        Args:
+            depth: Depth of the parse tree, counting the root, length and leaf levels (minimum 3)
+            similarity_threshold: Fraction of matching tokens needed to join a cluster
+            max_children: Maximum number of distinct token branches per tree node
+            is_protected: Function deciding whether a token must match exactly (optional)
+        """
+        self.depth = max(3, int(depth))
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.is_protected = is_protected or (lambda token: False)
+        self.clusters = []
+        self._root = {}
+        self._lock = threading.Lock()
+
+    def _leaf(self, tokens, route=None):
+        """
+        Find (or create) the list of clusters that tokens route to
+
+        Args:
+            tokens: Masked tokens of a log line or template
+            route: Branch keys to follow instead of routing by the tokens (optional)
+
+        Returns:
+            Tuple of (list of clusters, branch keys followed below the length node)
+        """
+        node = self._root.setdefault(len(tokens), {})
+        if route is not None:
+            for key in route:
+                node = node.setdefault(key, {})
+            return node.setdefault('', []), list(route)
+
+        route = []
+        for token in tokens[:self.depth - 3]:
+            if any(char.isdigit() for char in token) or _is_variable(token):
+                token = WILDCARD
+            child = node.get(token)
+            if child is None:
+                # Once a node is full, new tokens share its wildcard branch
+                if len(node) < self.max_children - 1 or (WILDCARD in node and len(node) < self.max_children):
+                    child = node[token] = {}
+                else:
+                    token = WILDCARD
+                    child = node.setdefault(WILDCARD, {})
+            route.append(token)
+            node = child
+        return node.setdefault('', []), route
+
+    def _similarity(self, template_tokens, tokens):
+        """
+        Fraction of positions where the template and the tokens agree, or -1 if they can't merge
+        """
+        matches = 0
+        for template_token, token in zip(template_tokens, tokens):
+            if template_token == token:
+                matches += 1
+            elif template_token != WILDCARD and (self.is_protected(template_token) or self.is_protected(token)):
+                return -1.0
+            elif template_token == WILDCARD and self.is_protected(token):
+                return -1.0
+        return matches / len(tokens) if tokens else 1.0
+
+    def add_log(self, log_text):
+        """
+        Assign a log line to a cluster, creating or generalizing one as needed
+
+        Args:
+            log_text: The raw log text
+
+        Returns:
+            Tuple of (LogCluster, list of the line's parameter values)
+        """
+        raw_tokens = str(log_text).split()
+        tokens = [mask_token(token) for token in raw_tokens]
+
+        with self._lock:
+            leaf, route = self._leaf(tokens)
+            best, best_similarity = None, -1.0
+            for cluster in leaf:
+                similarity = self._similarity(cluster.template_tokens, tokens)
+                if similarity > best_similarity:
+                    best, best_similarity = cluster, similarity
+
+            if best is None or best_similarity < self.similarity_threshold:
+                best = LogCluster(len(self.clusters) + 1, tokens, route)
+                self.clusters.append(best)
+                leaf.append(best)
+            else:
+                best.template_tokens = [
+                    template_token if template_token == token else WILDCARD
+                    for template_token, token in zip(best.template_tokens, tokens)
+                ]
+            best.size += 1
+            template_tokens = list(best.template_tokens)
+
+        params = [raw for raw, template_token in zip(raw_tokens, template_tokens) if _is_variable(template_token)]
+        return best, params
+
+    def add_logs(self, log_texts):
+        """
+        Assign a list of log lines to clusters
+
+        Args:
+            log_texts: List of log texts
+
+        Returns:
+            List of (LogCluster, parameter list) tuples in the same order
+        """
+        return [self.add_log(log_text) for log_text in log_texts]
+
+    def templates(self, top=None):
+        """
+        Get the mined templates, largest first
+
+        Args:
+            top: Maximum number of templates to return (default: all)
+
+        Returns:
+            List of dictionaries with template id, template text and member count
+        """
+        clusters = sorted(self.clusters, key=lambda cluster: cluster.size, reverse=True)
+        return [cluster.to_dict() for cluster in clusters[:top]]
+
+    def save(self, path):
+        """
+        Save the mined templates so template ids stay stable across runs
+
+        Args:
+            path: Path of the JSON state file
+        """
+        state = {
+            'depth': self.depth,
+            'similarity_threshold': self.similarity_threshold,
+            'clusters': [
+                {'id': cluster.cluster_id, 'tokens': cluster.template_tokens, 'route': cluster.route,
+                 'count': cluster.size}
+                for cluster in self.clusters
+            ],
+        }
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """
+        Restore templates saved by save; ids continue from the saved clusters
+
+        Each cluster goes back into the tree branch it was created in, which
+        its generalized template can no longer be relied on to route to.
+        States saved without routes are routed by their template tokens.
+
+        Args:
+            path: Path of the JSON state file
+        """
+        with open(path) as f:
+            state = json.load(f)
+        for saved in state['clusters']:
+            cluster = LogCluster(saved['id'], saved['tokens'])
+            cluster.size = saved['count']
+            leaf, cluster.route = self._leaf(cluster.template_tokens, saved.get('route'))
+            self.clusters.append(cluster)
+            leaf.append(cluster)
@@ -1,5 +1,6 @@
 import os
 from log_analyzer_tool import LogAnalyzerTool
+from log_rollups import anomaly_count
 
 def main():
     # Initialize the log analyzer with model-only approach (default)
@@ -15,8 +16,11 @@ def main():
     analyzer.save_to_database(results)
     
     # Print summary
-    anomaly_count = sum(1 for r in results if r['status'] == 'anomaly')
-    print(f'Analysis complete: {len(results)} logs processed, {anomaly_count} anomalies detected')
+    run_anomalies = sum(1 for r in results if r['status'] == 'anomaly')
+    print(f'Analysis complete: {len(results)} logs processed, {run_anomalies} anomalies detected')
+    
+    # Read from the rollup tables rather than counting the logs table
+    print(f'Anomalies stored in the database: {anomaly_count(analyzer.db_config)}')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,172 @@
+import os
+import uuid
+import datetime
+from contextlib import contextmanager
+
+import pytest
+
+import db_loader
+from db_loader import BulkLoader, _month_of, frame_to_rows, parse_time
+
+
+@contextmanager
+def _scratch_db_config():
+    """
+    Database configuration whose tables live in a fresh schema, dropped afterwards
+
+    The tests only run against the database named by TEST_DB_NAME.
+    """
+    database = os.environ.get('TEST_DB_NAME')
+    if not database:
+        pytest.skip('Set TEST_DB_NAME to a scratch PostgreSQL database to run the database tests')
+    import psycopg2
+
+    base_config = {
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': database,
+        'password': os.environ.get('DB_PASSWORD', 'logai'),
+        'port': os.environ.get('DB_PORT', 5432),
+    }
+    schema = f'test_{uuid.uuid4().hex[:12]}'
+    conn = psycopg2.connect(**base_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE SCHEMA {schema}')
+        yield dict(base_config, options=f'-c search_path={schema}')
+    finally:
+        db_loader.close_connection_pools()
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA {schema} CASCADE')
+        conn.close()
+
+
+def _result(log, time):
+    return {'user_id': 1, 'device_name': 'Server-01', 'log': log, 'status': 'normal', 'confidence': 0.9,
+            'time': time}
+
+
+# Times in formats other than the one the tool writes, with the value PostgreSQL stores for them
+ODD_TIMES = {
+    '2025-06-20T19:56:42Z': datetime.datetime(2025, 6, 20, 19, 56, 42),
+    '2025-06-20 19:56:42.123+02:00': datetime.datetime(2025, 6, 20, 19, 56, 42, 123000),
+    '20250601 100000': datetime.datetime(2025, 6, 1, 10, 0),
+    '06/20/2025 19:56:42': datetime.datetime(2025, 6, 20, 19, 56, 42),
+    '2025/06/20 19:56:42': datetime.datetime(2025, 6, 20, 19, 56, 42),
+    'Jun 20 2025 18:00:00': datetime.datetime(2025, 6, 20, 18, 0),
+    '20/Jun/2025:19:56:42 +0000': datetime.datetime(2025, 6, 20, 19, 56, 42),
+}
+
+
+def test_parse_time_formats():
+    """
+    parse_time reads the odd time formats as PostgreSQL does and gives None for the rest
+    """
+    for text, expected in ODD_TIMES.items():
+        assert parse_time(text) == expected, text
+    assert parse_time(datetime.datetime(2025, 6, 20, tzinfo=datetime.timezone.utc)) == datetime.datetime(2025, 6, 20)
+    assert parse_time('not a time') is None
+    assert parse_time(None) is None
+    assert parse_time(float('nan')) is None
+
+
+def test_repeated_lines_get_distinct_fingerprints():
+    """
+    Identical lines get distinct fingerprints, which are the same however the CSV is read
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame([_result('Connection timeout to db', '2025-06-20 19:56:42')] * 4)
+    fingerprints = [row[-1] for row in frame_to_rows(frame)]
+    assert len(set(fingerprints)) == 4
+
+    chunked = []
+    for start in range(0, 4, 3):
+        chunk = frame.iloc[start:start + 3]
+        chunked.extend(row[-1] for row in frame_to_rows(chunk))
+    assert chunked == fingerprints
+
+
+def test_identical_lines_load_as_separate_rows():
+    """
+    Two identical lines are stored as two rows, and upserting them again keeps two
+    """
+    with _scratch_db_config() as db_config:
+        results = [_result('Connection timeout to db', '2025-06-20 19:56:42')] * 2
+        assert BulkLoader(db_config).load(results) == 2
+        assert BulkLoader(db_config, upsert=True).load(results) == 0
+        with db_loader.pooled_connection(db_config) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM logs")
+                assert cur.fetchone()[0] == 2
+            conn.commit()
+
+
+def test_month_of_compact_and_invalid_times():
+    """
+    _month_of parses the whole time, so compact ISO times get their real month and invalid months get None
+    """
+    assert _month_of('20250601 100000') == (2025, 6)
+    assert _month_of('2025-06-20 19:56:42') == (2025, 6)
+    assert _month_of(datetime.date(2025, 12, 31)) == (2025, 12)
+    assert _month_of('2025-60-01 10:00:00') is None
+    assert _month_of('2025-13') is None
+    assert _month_of('garbage') is None
+    assert _month_of(None) is None
+
+
+def test_compact_iso_time_loads_into_its_month_partition():
+    """
+    A compact ISO time creates and fills the partition of its month instead of aborting the load
+    """
+    with _scratch_db_config() as db_config:
+        assert BulkLoader(db_config).load([_result('compact time', '20250601 100000')]) == 1
+        with db_loader.pooled_connection(db_config) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT tableoid::regclass::text, time FROM logs")
+                assert cur.fetchall() == [(db_loader.partition_name(2025, 6), datetime.datetime(2025, 6, 1, 10, 0))]
+            conn.commit()
+
+
+def test_csv_and_binary_copy_store_the_same_times():
+    """
+    Odd time strings load the same with CSV and binary COPY framing
+    """
+    with _scratch_db_config() as db_config:
+        stored = {}
+        for copy_format in ('csv', 'binary'):
+            results = [_result(f'{copy_format} line {i}', text) for i, text in enumerate(ODD_TIMES)]
+            assert BulkLoader(db_config, copy_format=copy_format).load(results) == len(results)
+            with db_loader.pooled_connection(db_config) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT log, time FROM logs WHERE log LIKE %s", (f'{copy_format} line %',))
+                    stored[copy_format] = {log.split(' line ')[1]: value for log, value in cur.fetchall()}
+                conn.commit()
+        assert stored['csv'] == stored['binary'] == {str(i): value for i, value in enumerate(ODD_TIMES.values())}
+
+
+def test_binary_copy_stores_unparseable_times_as_null():
+    """
+    A time binary COPY can't parse is stored as NULL instead of failing the batch
+    """
+    with _scratch_db_config() as db_config:
+        results = [_result('odd time', 'sometime yesterday'), _result('good time', '2025-06-20 19:56:42')]
+        assert BulkLoader(db_config, copy_format='binary').load(results) == 2
+        with db_loader.pooled_connection(db_config) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT log, time FROM logs ORDER BY log")
+                assert cur.fetchall() == [('good time', datetime.datetime(2025, 6, 20, 19, 56, 42)),
+                                          ('odd time', None)]
+            conn.commit()
+
+
+if __name__ == '__main__':
+    test_parse_time_formats()
+    test_repeated_lines_get_distinct_fingerprints()
+    test_identical_lines_load_as_separate_rows()
+    test_month_of_compact_and_invalid_times()
+    test_compact_iso_time_loads_into_its_month_partition()
+    test_csv_and_binary_copy_store_the_same_times()
+    test_binary_copy_stores_unparseable_times_as_null()
+    print('All database loader tests passed')
@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+
+import psycopg2
+import pytest
+
+import db_sink
+from db_loader import LOG_COLUMNS
+from db_sink import REJECTED_DIR, DatabaseSink, list_spool_files, read_spool_file
+
+LOG_INDEX = LOG_COLUMNS.index('log')
+
+
+class StubLoader:
+    """
+    Stand-in for BulkLoader that records the batches it is given instead of writing them
+
+    Set error to an exception to raise it from every load, and gate to an
+    unset Event to hold loads until it is set.
+    """
+    batches = []
+    error = None
+    gate = None
+    entered = None
+
+    def __init__(self, db_config, batch_size=50000, copy_format='csv', upsert=False):
+        self.upsert = upsert
+
+    def load_rows(self, rows):
+        if StubLoader.entered is not None:
+            StubLoader.entered.set()
+        if StubLoader.gate is not None:
+            StubLoader.gate.wait()
+        if StubLoader.error is not None:
+            raise StubLoader.error
+        StubLoader.batches.append(([row[LOG_INDEX] for row in rows], self.upsert))
+        return len(rows)
+
+
+@pytest.fixture(autouse=True)
+def stub_loader(monkeypatch):
+    StubLoader.batches = []
+    StubLoader.error = None
+    StubLoader.gate = None
+    StubLoader.entered = None
+    monkeypatch.setattr(db_sink, 'BulkLoader', StubLoader)
+    yield StubLoader
+    if StubLoader.gate is not None:
+        StubLoader.gate.set()
+
+
+def _results(*logs):
+    return [{'log': log, 'device_name': 'router-1', 'time': '2025-06-20 10:00:00', 'status': 'Normal'} for log in logs]
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the sink'
+        time.sleep(0.01)
+
+
+def test_spooled_batches_are_replayed_in_order(tmp_path):
+    """
+    Batches written while the database is down are spooled and replayed oldest first, as upserts
+    """
+    StubLoader.error = psycopg2.OperationalError('connection refused')
+    sink = DatabaseSink({}, batch_size=2, flush_interval=0.01, spool_dir=str(tmp_path), max_retries=1,
+                        initial_backoff=0.01, max_backoff=0.05)
+    sink.put(_results('a1', 'a2'))
+    sink.put(_results('b1', 'b2'))
+    _wait_until(lambda: sink.stats['spooled'] == 4)
+    assert len(list_spool_files(str(tmp_path))) == 2
+    assert sink.stats['retries'] >= 1
+
+    StubLoader.error = None
+    _wait_until(lambda: sink.stats['replayed'] == 4)
+    stats = sink.close()
+    assert StubLoader.batches == [(['a1', 'a2'], True), (['b1', 'b2'], True)]
+    assert stats['written'] == 4 and stats['spool_files'] == 0
+    assert list_spool_files(str(tmp_path)) == []
+
+
+def test_rejected_batch_is_moved_aside(tmp_path):
+    """
+    A batch the database refuses goes to the rejected subdirectory and is not retried
+    """
+    StubLoader.error = psycopg2.DataError('invalid input syntax for type timestamp')
+    sink = DatabaseSink({}, batch_size=10, flush_interval=0.01, spool_dir=str(tmp_path), max_retries=3)
+    sink.put(_results('bad1', 'bad2'))
+    stats = sink.close()
+
+    assert stats['rejected'] == 2 and stats['retries'] == 0 and stats['spooled'] == 0
+    assert list_spool_files(str(tmp_path)) == []
+    rejected = list_spool_files(str(tmp_path / REJECTED_DIR))
+    assert len(rejected) == 1
+    assert [row[LOG_INDEX] for row in read_spool_file(rejected[0])] == ['bad1', 'bad2']
+
+
+def test_put_blocks_at_max_pending_rows(tmp_path):
+    """
+    put() waits while max_pending_rows rows are queued behind a busy worker
+    """
+    StubLoader.gate = threading.Event()
+    StubLoader.entered = threading.Event()
+    sink = DatabaseSink({}, batch_size=2, flush_interval=0.01, max_pending_rows=2, spool_dir=str(tmp_path))
+    sink.put(_results('a1', 'a2'))
+    assert StubLoader.entered.wait(10)
+    sink.put(_results('b1', 'b2'))
+
+    with pytest.raises(TimeoutError):
+        sink.put(_results('c1'), timeout=0.1)
+    blocked = threading.Thread(target=sink.put, args=(_results('c1'),))
+    blocked.start()
+    time.sleep(0.1)
+    assert blocked.is_alive()
+
+    StubLoader.gate.set()
+    blocked.join(10)
+    assert not blocked.is_alive()
+    stats = sink.close()
+    assert stats['written'] == 5
+    assert [log for logs, upsert in StubLoader.batches for log in logs] == ['a1', 'a2', 'b1', 'b2', 'c1']
+
+
+def test_close_during_backoff_spools_the_batch(tmp_path):
+    """
+    close() cuts a long backoff wait short and spools the batch instead of dropping it
+    """
+    StubLoader.error = psycopg2.OperationalError('connection refused')
+    sink = DatabaseSink({}, batch_size=2, flush_interval=0.01, spool_dir=str(tmp_path), max_retries=5,
+                        initial_backoff=30, max_backoff=30)
+    sink.put(_results('a1', 'a2'))
+    _wait_until(lambda: sink.stats['retries'] == 1)
+
+    start = time.monotonic()
+    stats = sink.close(timeout=10)
+    assert time.monotonic() - start < 5
+    assert stats['spooled'] == 2 and stats['spool_files'] == 1
+    spooled = list_spool_files(str(tmp_path))
+    assert [row[LOG_INDEX] for row in read_spool_file(spooled[0])] == ['a1', 'a2']
+    assert not os.path.isdir(tmp_path / REJECTED_DIR)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-q'])
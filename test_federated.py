@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+
+from federated import (
+    SAFETENSORS_DTYPES, WEIGHTS_FILE, SafetensorsFile, _from_float, _to_float, federated_average,
+    write_safetensors_header,
+)
+
+
+def save_checkpoint(model_dir, tensors):
+    """
+    Write a model directory whose model.safetensors holds the given tensors
+
+    Args:
+        model_dir: Directory to create
+        tensors: Dictionary of tensor name to (dtype, numpy array in that dtype's storage type)
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, WEIGHTS_FILE)
+    offsets, data_start = write_safetensors_header(
+        path, [(name, dtype, values.shape) for name, (dtype, values) in tensors.items()]
+    )
+    with open(path, 'r+b') as f:
+        for name, (dtype, values) in tensors.items():
+            f.seek(data_start + offsets[name][0])
+            f.write(np.ascontiguousarray(values, dtype=SAFETENSORS_DTYPES[dtype]).tobytes())
+
+
+def load_checkpoint(model_dir):
+    """
+    Read every tensor of a model directory into memory, keyed by name
+    """
+    checkpoint = SafetensorsFile(os.path.join(model_dir, WEIGHTS_FILE))
+    try:
+        return {name: np.array(checkpoint.flat(name)).reshape(checkpoint.shape(name)) for name in checkpoint.names()}
+    finally:
+        checkpoint.close()
+
+
+def _bf16(values):
+    return _from_float(np.asarray(values, dtype=np.float64), 'BF16')
+
+
+def test_weighted_average_across_chunks(tmp_path):
+    """
+    Chunks that split tensors at odd places average to the same weights as numpy does in one go
+    """
+    rng = np.random.default_rng(0)
+    counts = [1, 2, 5]
+    clients = []
+    for index in range(len(counts)):
+        client_dir = str(tmp_path / f'client{index}')
+        save_checkpoint(client_dir, {
+            'encoder.weight': ('F32', rng.normal(size=(37, 29)).astype(np.float32)),
+            'encoder.bias': ('F64', rng.normal(size=29)),
+            'head.weight': ('BF16', _bf16(rng.normal(size=(11, 7)))),
+            'position_ids': ('I64', np.arange(50, dtype=np.int64) + index),
+        })
+        clients.append(client_dir)
+    weights = np.array(counts, dtype=np.float64) / sum(counts)
+
+    info = federated_average(clients, counts, output_dir=str(tmp_path / 'chunked'), workers=3, chunk_elements=64)
+    whole = federated_average(clients, counts, output_dir=str(tmp_path / 'whole'), workers=1, chunk_elements=1 << 20)
+    chunked = load_checkpoint(str(tmp_path / 'chunked'))
+    assert info['total_samples'] == 8 and info['tensors'] == 4
+    assert all(np.array_equal(chunked[name], values) for name, values in load_checkpoint(str(tmp_path / 'whole')).items())
+
+    inputs = [load_checkpoint(client) for client in clients]
+    for name in ('encoder.weight', 'encoder.bias'):
+        expected = sum(weight * checkpoint[name].astype(np.float64) for weight, checkpoint in zip(weights, inputs))
+        assert chunked[name].dtype == inputs[0][name].dtype
+        np.testing.assert_allclose(chunked[name], expected, rtol=1e-6, atol=1e-6)
+    expected = sum(weight * _to_float(checkpoint['head.weight'].ravel(), 'BF16')
+                   for weight, checkpoint in zip(weights, inputs))
+    np.testing.assert_array_equal(chunked['head.weight'].ravel(), _from_float(expected, 'BF16'))
+    np.testing.assert_array_equal(chunked['position_ids'], inputs[0]['position_ids'])
+
+
+def test_half_precision_round_trip():
+    """
+    Every BF16 and F16 value survives widening and narrowing unchanged, and BF16 rounds to nearest even
+    """
+    words = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16)
+    bf16 = _to_float(words, 'BF16')
+    finite = ~np.isnan(bf16)
+    np.testing.assert_array_equal(_from_float(bf16, 'BF16')[finite], words[finite])
+
+    f16 = _to_float(words.view(np.float16), 'F16')
+    finite = ~np.isnan(f16)
+    np.testing.assert_array_equal(_from_float(f16, 'F16').view(np.uint16)[finite], words[finite])
+
+    # 1 + 2**-8 lies halfway between 1 and the next BF16 value, 1 + 2**-7
+    ties = np.array([1 + 2 ** -8, 1 + 3 * 2 ** -8, 1 + 2 ** -8 + 2 ** -20])
+    np.testing.assert_array_equal(_to_float(_bf16(ties), 'BF16'), [1.0, 1 + 2 ** -6, 1 + 2 ** -7])
+
+
+def test_bf16_nan_and_infinity():
+    """
+    NaNs stay NaN with their sign, infinities stay infinite and values past the BF16 range round to infinity
+    """
+    nan_words = np.array([0x7F800001, 0x7FFFFFFF, 0xFFFFFFFF, 0xFF800001, 0x7FC00000], dtype=np.uint32)
+    with np.errstate(invalid='ignore'):
+        nans = _to_float(_from_float(nan_words.view(np.float32).astype(np.float64), 'BF16'), 'BF16')
+    assert np.isnan(nans).all()
+    np.testing.assert_array_equal(np.signbit(nans), [False, False, True, True, False])
+
+    values = _to_float(_bf16([np.inf, -np.inf, 1e39, -1e39, 3.3895e38, -0.0]), 'BF16')
+    np.testing.assert_array_equal(values[:4], [np.inf, -np.inf, np.inf, -np.inf])
+    assert np.isfinite(values[4]) and values[5] == 0 and np.signbit(values[5])
+
+
+if __name__ == '__main__':
+    import tempfile
+    import pathlib
+    with tempfile.TemporaryDirectory() as directory:
+        test_weighted_average_across_chunks(pathlib.Path(directory))
+    test_half_precision_round_trip()
+    test_bf16_nan_and_infinity()
+    print('All federated averaging tests passed')
@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import pytest
+
+from federated import WEIGHTS_FILE, _from_float, _to_float, federated_average
+from federated_delta import DeltaFile, aggregate_deltas, apply_delta, create_delta
+from test_federated import load_checkpoint, save_checkpoint
+
+BLOCK_SIZE = 256
+
+
+def _models(tmp_path, num_clients=2, seed=0):
+    """
+    Write a base model and fine-tuned clients that change every weight a little and a few a lot
+    """
+    rng = np.random.default_rng(seed)
+    base = {
+        'encoder.weight': ('F32', rng.normal(size=(61, 47)).astype(np.float32)),
+        'head.weight': ('BF16', _from_float(rng.normal(size=(13, 9)), 'BF16')),
+        'position_ids': ('I64', np.arange(40, dtype=np.int64)),
+    }
+    base_dir = str(tmp_path / 'base')
+    save_checkpoint(base_dir, base)
+    client_dirs = []
+    for index in range(num_clients):
+        weight = base['encoder.weight'][1].astype(np.float64) + rng.normal(scale=1e-3, size=(61, 47))
+        weight.flat[rng.choice(weight.size, 20, replace=False)] += rng.normal(scale=0.5, size=20)
+        head = _to_float(base['head.weight'][1].ravel(), 'BF16') + rng.normal(scale=0.05, size=13 * 9)
+        client = {
+            'encoder.weight': ('F32', weight.astype(np.float32)),
+            'head.weight': ('BF16', _from_float(head, 'BF16').reshape(13, 9)),
+            'position_ids': ('I64', np.arange(40, dtype=np.int64) + (index == 1)),
+        }
+        client_dirs.append(str(tmp_path / f'client{index}'))
+        save_checkpoint(client_dirs[-1], client)
+    return base_dir, client_dirs
+
+
+def _float_weights(checkpoint, name):
+    dtype = 'BF16' if name == 'head.weight' else 'F32'
+    return _to_float(checkpoint[name].ravel(), dtype)
+
+
+@pytest.mark.parametrize('method', ['topk', 'int8'])
+def test_apply_delta_rebuilds_client(tmp_path, method):
+    """
+    A rebuilt client matches the original within the compression error, read in chunks that cross int8 blocks
+    """
+    base_dir, (client_dir, _) = _models(tmp_path)
+    delta_path = str(tmp_path / 'client.delta')
+    create_delta(base_dir, client_dir, delta_path, method=method, density=1.0, block_size=BLOCK_SIZE, num_samples=10)
+    apply_delta(base_dir, delta_path, str(tmp_path / 'rebuilt'), workers=3, chunk_elements=700)
+
+    client = load_checkpoint(client_dir)
+    rebuilt = load_checkpoint(str(tmp_path / 'rebuilt'))
+    base = load_checkpoint(base_dir)
+    for name in ('encoder.weight', 'head.weight'):
+        change = np.abs(_float_weights(client, name) - _float_weights(base, name))
+        if method == 'topk':
+            tolerance = change * 2 ** -10 + 1e-7  # fp16 values
+        else:
+            blocks = np.resize(change, -(-change.size // BLOCK_SIZE) * BLOCK_SIZE).reshape(-1, BLOCK_SIZE)
+            tolerance = np.repeat(blocks.max(axis=1) / 127 / 2, BLOCK_SIZE)[:change.size] * 1.01 + 1e-6
+        if name == 'head.weight':
+            tolerance = tolerance + np.abs(_float_weights(client, name)) * 2 ** -8  # BF16 rounding of the result
+        error = np.abs(_float_weights(rebuilt, name) - _float_weights(client, name))
+        assert (error <= tolerance).all(), f'{name}: largest error {error.max()}'
+    np.testing.assert_array_equal(rebuilt['position_ids'], client['position_ids'])
+
+
+def test_topk_keeps_largest_changes(tmp_path):
+    """
+    A sparse top-k delta applies the largest changes and leaves every other weight at the base value
+    """
+    base_dir, (client_dir, _) = _models(tmp_path)
+    delta_path = str(tmp_path / 'client.delta')
+    create_delta(base_dir, client_dir, delta_path, method='topk', density=0.01)
+    apply_delta(base_dir, delta_path, str(tmp_path / 'rebuilt'), chunk_elements=500)
+
+    base = load_checkpoint(base_dir)['encoder.weight'].ravel()
+    client = load_checkpoint(client_dir)['encoder.weight'].ravel()
+    rebuilt = load_checkpoint(str(tmp_path / 'rebuilt'))['encoder.weight'].ravel()
+    changed = rebuilt != base
+    assert changed.sum() == int(np.ceil(base.size * 0.01))
+    assert np.abs(client - base)[changed].min() >= np.abs(client - base)[~changed].max()
+    np.testing.assert_allclose(rebuilt[changed], client[changed], rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.parametrize('method', ['topk', 'int8'])
+def test_aggregate_matches_federated_average(tmp_path, method):
+    """
+    Aggregating deltas gives the sample-weighted average of the client models within the compression error
+    """
+    base_dir, client_dirs = _models(tmp_path, num_clients=3)
+    counts = [1, 3, 4]
+    delta_paths = []
+    for index, (client_dir, count) in enumerate(zip(client_dirs, counts)):
+        delta_paths.append(str(tmp_path / f'client{index}.delta'))
+        create_delta(base_dir, client_dir, delta_paths[-1], method=method, density=1.0, block_size=BLOCK_SIZE,
+                     num_samples=count)
+
+    info = aggregate_deltas(base_dir, delta_paths, str(tmp_path / 'aggregated'), workers=2, chunk_elements=300)
+    federated_average(client_dirs, counts, output_dir=str(tmp_path / 'averaged'))
+    assert [client['num_samples'] for client in info['clients']] == counts
+
+    aggregated = load_checkpoint(str(tmp_path / 'aggregated'))
+    averaged = load_checkpoint(str(tmp_path / 'averaged'))
+    np.testing.assert_allclose(_float_weights(aggregated, 'encoder.weight'), _float_weights(averaged, 'encoder.weight'),
+                               atol=5e-3 if method == 'int8' else 1e-3)
+    np.testing.assert_allclose(_float_weights(aggregated, 'head.weight'), _float_weights(averaged, 'head.weight'),
+                               atol=2e-2)
+    # The changed buffer comes from the heaviest client that changed it
+    np.testing.assert_array_equal(aggregated['position_ids'], load_checkpoint(client_dirs[1])['position_ids'])
+
+
+def test_verify_rejects_corrupt_or_mismatched_delta(tmp_path):
+    """
+    A delta with a damaged payload, or made against another base, is refused before anything is written
+    """
+    base_dir, (client_dir, other_dir) = _models(tmp_path)
+    delta_path = str(tmp_path / 'client.delta')
+    create_delta(base_dir, client_dir, delta_path, method='int8', num_samples=10)
+
+    # Made against another base model
+    with pytest.raises(ValueError, match='different base'):
+        apply_delta(other_dir, delta_path, str(tmp_path / 'wrong-base'))
+    assert not os.path.exists(tmp_path / 'wrong-base' / WEIGHTS_FILE)
+
+    # One flipped byte in the payload
+    delta = DeltaFile(delta_path)
+    data_start = delta.file.data_start
+    delta.close()
+    with open(delta_path, 'r+b') as f:
+        f.seek(data_start + 100)
+        byte = f.read(1)
+        f.seek(data_start + 100)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(ValueError, match='corrupt'):
+        aggregate_deltas(base_dir, [delta_path], str(tmp_path / 'corrupt'))
+    assert not os.path.exists(tmp_path / 'corrupt' / WEIGHTS_FILE)
+
+    # Without verification the damaged delta is applied as is
+    apply_delta(base_dir, delta_path, str(tmp_path / 'unverified'), verify=False)
+    assert os.path.exists(tmp_path / 'unverified' / WEIGHTS_FILE)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-q'])
@@ -4,71 +4,70 @@ import random
 import argparse
 from datetime import datetime, timedelta
 
-def generate_test_data(num_rows=50, output_file="test_logs.csv"):
-    """Generate test log data for GUI testing"""
+# Sample devices
+DEVICES = [
+    {"name": "Workstation-01", "ip": "192.168.1.101", "mac": "00:1B:44:11:3A:B7"},
+    {"name": "Workstation-02", "ip": "192.168.1.102", "mac": "00:1B:44:11:3A:C9"},
+    {"name": "Server-01", "ip": "192.168.1.10", "mac": "00:1B:63:84:45:E6"}
+]
+
+# Sample log templates
+NORMAL_LOGS = [
+    "System started normally",
+    "User logged in successfully",
+    "Backup completed successfully",
+    "Software update check completed",
+    "Network connection established",
+    "File sync completed",
+    "System scan completed: no threats found",
+    "Memory usage normal",
+    "CPU usage normal",
+    "Disk check completed successfully"
+]
+
+ANOMALY_LOGS = [
+    "Failed login attempt detected",
+    "Unusual network traffic detected",
+    "System error: service failed to start",
+    "Memory usage exceeds threshold",
+    "Potential malware detected",
+    "Firewall breach attempt detected",
+    "Unexpected system shutdown",
+    "CPU usage critical",
+    "Multiple authentication failures detected",
+    "Unusual process activity detected"
+]
+
+def generate_log_entry(start_time):
+    """Generate one random log entry within a day of start_time"""
+    # Select a random device
+    device = random.choice(DEVICES)
     
-    # Sample devices
-    devices = [
-        {"name": "Workstation-01", "ip": "192.168.1.101", "mac": "00:1B:44:11:3A:B7"},
-        {"name": "Workstation-02", "ip": "192.168.1.102", "mac": "00:1B:44:11:3A:C9"},
-        {"name": "Server-01", "ip": "192.168.1.10", "mac": "00:1B:63:84:45:E6"}
-    ]
+    # 70% normal logs, 30% anomaly logs
+    if random.random() < 0.7:
+        log = random.choice(NORMAL_LOGS)
+    else:
+        log = random.choice(ANOMALY_LOGS)
     
-    # Sample log templates
-    normal_logs = [
-        "System started normally",
-        "User logged in successfully",
-        "Backup completed successfully",
-        "Software update check completed",
-        "Network connection established",
-        "File sync completed",
-        "System scan completed: no threats found",
-        "Memory usage normal",
-        "CPU usage normal",
-        "Disk check completed successfully"
-    ]
+    # Generate a timestamp
+    log_time = start_time + timedelta(minutes=random.randint(1, 1440))
     
-    anomaly_logs = [
-        "Failed login attempt detected",
-        "Unusual network traffic detected",
-        "System error: service failed to start",
-        "Memory usage exceeds threshold",
-        "Potential malware detected",
-        "Firewall breach attempt detected",
-        "Unexpected system shutdown",
-        "CPU usage critical",
-        "Multiple authentication failures detected",
-        "Unusual process activity detected"
-    ]
+    # Create the entry
+    return {
+        "user_id": random.randint(1, 3),
+        "device_name": device["name"],
+        "device_mac": device["mac"],
+        "device_ip": device["ip"],
+        "time": log_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "log": log
+    }
+
+def generate_test_data(num_rows=50, output_file="test_logs.csv"):
+    """Generate test log data for GUI testing"""
     
     # Create data
-    data = []
     start_time = datetime.now() - timedelta(days=1)
-    
-    for i in range(num_rows):
-        # Select a random device
-        device = random.choice(devices)
-        
-        # 70% normal logs, 30% anomaly logs
-        if random.random() < 0.7:
-            log = random.choice(normal_logs)
-        else:
-            log = random.choice(anomaly_logs)
-        
-        # Generate a timestamp
-        log_time = start_time + timedelta(minutes=random.randint(1, 1440))
-        
-        # Create the entry
-        entry = {
-            "user_id": random.randint(1, 3),
-            "device_name": device["name"],
-            "device_mac": device["mac"],
-            "device_ip": device["ip"],
-            "time": log_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "log": log
-        }
-        
-        data.append(entry)
+    data = [generate_log_entry(start_time) for i in range(num_rows)]
     
     # Convert to DataFrame and save as CSV
     df = pd.DataFrame(data)
@@ -0,0 +1,54 @@
+import random
+
+from keyword_matcher import DEFAULT_ANOMALY_KEYWORDS, KeywordMatcher
+
+
+def test_nested_and_overlapping_keywords():
+    """
+    Keywords inside or overlapping other keywords are all reported
+    """
+    matcher = KeywordMatcher(['port scan', 'scan', 'fail', 'failed', 'led to'])
+    assert matcher.match('Port scan detected') == ['port scan', 'scan']
+    assert matcher.match('Login failed to 10.0.0.1') == ['fail', 'failed', 'led to']
+    assert matcher.score(matcher.match('PORT SCAN')) == 2.0
+
+
+def test_nested_keywords_with_word_boundaries():
+    """
+    With word boundaries, a keyword nested in another is only reported where it is a whole word
+    """
+    matcher = KeywordMatcher(['port scan', 'port', 'scan', 'fail'], word_boundaries=True)
+    assert matcher.match('port scan from 10.0.0.1') == ['port', 'port scan', 'scan']
+    assert matcher.match('portscan failed') == []
+
+
+def test_matches_per_keyword_substring_checks():
+    """
+    The single-pattern matcher finds the same keywords as checking each keyword separately
+    """
+    matcher = KeywordMatcher()
+    rng = random.Random(0)
+    words = DEFAULT_ANOMALY_KEYWORDS + ['user', 'login', 'from', 'port', 'ok', 'ion', 'ed']
+    for _ in range(2000):
+        text = rng.choice(['', ' ', '-']).join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        expected = {keyword for keyword in DEFAULT_ANOMALY_KEYWORDS if keyword in text}
+        assert set(matcher.match(text)) == expected, text
+
+
+def test_match_series():
+    """
+    match_series gives the same keywords as match for every log
+    """
+    import pandas as pd
+
+    matcher = KeywordMatcher()
+    logs = pd.Series(['Port scan detected', None, 'all good', 'brute force attack blocked'])
+    assert matcher.match_series(logs).tolist() == [matcher.match(str(log or '')) for log in logs]
+
+
+if __name__ == '__main__':
+    test_nested_and_overlapping_keywords()
+    test_nested_keywords_with_word_boundaries()
+    test_matches_per_keyword_substring_checks()
+    test_match_series()
+    print('All keyword matcher tests passed')
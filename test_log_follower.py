@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+from log_follower import FollowedFile
+
+
+def _read_entries(path, state=None):
+    followed = FollowedFile(path, state)
+    entries = followed.to_entries(followed.poll())
+    return followed, entries
+
+
+def test_repeated_lines_keep_distinct_fingerprints():
+    """
+    Identical followed lines get distinct fingerprints, and reading them again gives the same ones
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'app.log')
+        with open(path, 'w') as f:
+            f.write('Connection timeout to db\n' * 2 + 'Jun 20 19:56:42 web01 Disk full\n' * 2)
+
+        followed, entries = _read_entries(path)
+        fingerprints = [entry['fingerprint'] for entry in entries]
+        assert len(set(fingerprints)) == 4
+
+        # Replaying from a checkpoint saved before the batch was written gives the same fingerprints
+        state = dict(followed.pending_checkpoint(), offset=0)
+        followed.close()
+        replayed, entries = _read_entries(path, state)
+        assert [entry['fingerprint'] for entry in entries] == fingerprints
+        replayed.close()
+
+
+def test_csv_lines_are_fingerprinted_by_offset():
+    """
+    Identical CSV rows get distinct fingerprints, and rows appended later don't change earlier ones
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'app.csv')
+        with open(path, 'w') as f:
+            f.write('time,device_name,log\n' + '2025-06-20 19:56:42,web01,Disk full\n' * 2)
+
+        followed, entries = _read_entries(path)
+        first = [entry['fingerprint'] for entry in entries]
+        assert len(set(first)) == 2
+
+        with open(path, 'a') as f:
+            f.write('2025-06-20 19:56:42,web01,Disk full\n')
+        entries = followed.to_entries(followed.poll())
+        followed.close()
+        assert len(entries) == 1 and entries[0]['fingerprint'] not in first
+
+        followed, entries = _read_entries(path)
+        followed.close()
+        assert [entry['fingerprint'] for entry in entries][:2] == first
+
+
+if __name__ == '__main__':
+    test_repeated_lines_keep_distinct_fingerprints()
+    test_csv_lines_are_fingerprinted_by_offset()
+    print('All log follower tests passed')
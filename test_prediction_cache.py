@@ -0,0 +1,49 @@
+from prediction_cache import PredictionCache
+
+
+def test_claim_many_hands_each_missing_key_to_one_caller():
+    """
+    A missing key is claimed by the first caller only; later callers see it in flight until it is stored
+    """
+    cache = PredictionCache(namespace='test')
+    key = cache.key_for('Failed login from 10.0.0.5')
+    assert key == cache.key_for('Failed login from 10.0.0.9')
+
+    found, claimed, in_flight = cache.claim_many([key, key])
+    assert found == {} and claimed == {key} and in_flight == set()
+    found, claimed, in_flight = cache.claim_many([key])
+    assert found == {} and claimed == set() and in_flight == {key}
+    assert cache.stats()['misses'] == 2
+
+    cache.put_many({key: {'label': 'anomaly', 'score': 0.9}})
+    assert cache.get_many([key]) == {key: {'label': 'anomaly', 'score': 0.9}}
+    assert cache.claim_many([key])[0] == {key: {'label': 'anomaly', 'score': 0.9}}
+    assert cache.stats()['memory_hits'] == 2
+
+
+def test_release_lets_another_caller_claim():
+    """
+    A released claim, e.g. after a failed forward pass, can be claimed again
+    """
+    cache = PredictionCache(namespace='test')
+    key = cache.key_for('Disk check passed')
+    assert cache.claim_many([key])[1] == {key}
+    cache.release([key])
+    assert cache.claim_many([key])[1] == {key}
+
+
+def test_get_many_does_not_claim():
+    """
+    Plain lookups leave missing keys free to be claimed
+    """
+    cache = PredictionCache(namespace='test')
+    key = cache.key_for('CPU usage normal')
+    assert cache.get_many([key]) == {}
+    assert cache.claim_many([key])[1] == {key}
+
+
+if __name__ == '__main__':
+    test_claim_many_hands_each_missing_key_to_one_caller()
+    test_release_lets_another_caller_claim()
+    test_get_many_does_not_claim()
+    print('All prediction cache tests passed')
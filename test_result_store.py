@@ -0,0 +1,68 @@
+import os
+import json
+
+import pytest
+
+from result_store import ColumnarResultReader, ColumnarResultWriter
+
+RESULTS = [
+    {'device_name': 'router-1', 'device_ip': '10.0.0.1', 'time': '2025-06-20 10:00:00',
+     'log': 'CPU usage normal', 'status': 'Normal', 'confidence': 0.9},
+    {'device_name': 'router-2', 'device_ip': '10.0.0.2', 'time': '2025-06-20 10:00:05',
+     'log': 'Failed login attempt for admin', 'status': 'Critical', 'confidence': 0.8},
+]
+
+
+def _write(path, results):
+    writer = ColumnarResultWriter(path)
+    writer.write(results)
+    writer.close()
+
+
+def test_round_trip(tmp_path):
+    """
+    Results written to a new directory read back unchanged
+    """
+    path = str(tmp_path / 'store')
+    _write(path, RESULTS)
+    reader = ColumnarResultReader(path)
+    assert len(reader) == 2
+    assert reader.values('log') == [result['log'] for result in RESULTS]
+    assert reader.values('status', reader.select(status='Critical')) == ['Critical']
+
+
+def test_refuses_directory_without_store(tmp_path):
+    """
+    A non-empty directory that holds no store is left untouched
+    """
+    (tmp_path / 'notes.data').write_text('keep me')
+    (tmp_path / 'model.f32').write_bytes(b'\x00' * 8)
+    with pytest.raises(ValueError):
+        ColumnarResultWriter(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['model.f32', 'notes.data']
+    assert (tmp_path / 'notes.data').read_text() == 'keep me'
+
+
+def test_replaces_only_store_files(tmp_path):
+    """
+    Rewriting a store deletes the files its meta.json lists and keeps everything else
+    """
+    path = tmp_path / 'store'
+    _write(str(path), RESULTS + [dict(RESULTS[0], extra='only in the first store')])
+    (path / 'README.data').write_text('keep me')
+    assert (path / 'extra.data').exists()
+
+    _write(str(path), RESULTS[:1])
+    assert (path / 'README.data').read_text() == 'keep me'
+    assert not (path / 'extra.data').exists()
+    assert json.loads((path / 'meta.json').read_text())['rows'] == 1
+    assert ColumnarResultReader(str(path)).values('log') == ['CPU usage normal']
+
+
+if __name__ == '__main__':
+    import tempfile
+    import pathlib
+    for test in (test_round_trip, test_refuses_directory_without_store, test_replaces_only_store_files):
+        with tempfile.TemporaryDirectory() as directory:
+            test(pathlib.Path(directory))
+    print('All result store tests passed')
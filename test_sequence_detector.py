@@ -0,0 +1,78 @@
+import random
+import datetime
+
+from sequence_detector import FLAG_RATE_SPIKE, SequenceDetector
+
+
+def _records(seed=0, burst=False):
+    """
+    Steady traffic from a few devices over ten hours, with an optional burst from one IP
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 6, 20)
+    messages = ['CPU usage normal', 'System started normally', 'User login ok', 'Disk check passed']
+    records = []
+    for i in range(20000):
+        records.append({'device_ip': f'10.0.0.{rng.randint(1, 5)}', 'user_id': rng.randint(1, 3),
+                        'time': str(start + datetime.timedelta(seconds=i * 1.8)), 'log': rng.choice(messages)})
+    if burst:
+        burst_start = start + datetime.timedelta(hours=6)
+        for i in range(300):
+            records.append({'device_ip': '10.0.0.99', 'user_id': 9,
+                            'time': str(burst_start + datetime.timedelta(seconds=i * 0.1, microseconds=1)),
+                            'log': 'Failed login attempt for admin'})
+        records.extend({'device_ip': '10.0.0.99', 'user_id': 9,
+                        'time': str(start + datetime.timedelta(minutes=i, microseconds=1)), 'log': 'Heartbeat ok'}
+                       for i in range(600))
+        records.sort(key=lambda record: record['time'])
+    return records
+
+
+def test_shuffled_batch_flags_match_sorted():
+    """
+    A batch in random order gets the same flags, row for row, as the same batch in time order
+    """
+    for burst in (False, True):
+        records = _records(burst=burst)
+        expected = SequenceDetector().flag_records(records)
+
+        order = list(range(len(records)))
+        random.Random(1).shuffle(order)
+        flags = SequenceDetector().flag_records([records[index] for index in order])
+        assert flags == [expected[index] for index in order]
+        assert any(expected) == burst
+
+
+def test_shuffled_frame_flags_match_sorted():
+    """
+    flag_frame observes a shuffled DataFrame in time order too
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(_records(burst=True))
+    expected = SequenceDetector().flag_frame(frame)
+    shuffled = frame.sample(frac=1.0, random_state=2)
+    flags = SequenceDetector().flag_frame(shuffled)
+    assert flags == [expected[index] for index in shuffled.index]
+    assert any(flag.startswith(FLAG_RATE_SPIKE) for line_flags in flags for flag in line_flags.split(','))
+
+
+def test_late_lines_across_batches_are_not_flagged():
+    """
+    Lines much older than earlier batches are counted but not judged, so steady traffic raises no flags
+    """
+    records = _records()
+    random.Random(3).shuffle(records)
+    detector = SequenceDetector()
+    flags = []
+    for start in range(0, len(records), 500):
+        flags.extend(detector.flag_records(records[start:start + 500]))
+    assert not any(flags)
+    assert detector.stats()['late_lines'] > 0
+
+
+if __name__ == '__main__':
+    test_shuffled_batch_flags_match_sorted()
+    test_shuffled_frame_flags_match_sorted()
+    test_late_lines_across_batches_are_not_flagged()
+    print('All sequence detector tests passed')
@@ -0,0 +1,59 @@
+import os
+import json
+import random
+import tempfile
+
+from template_miner import DrainTemplateMiner
+
+
+def _lines(count, seed=0):
+    rng = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'user7', '10.0.0.1', 'port8080', 'failed', 'ok']
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(2, 5))) for _ in range(count)]
+
+
+def test_template_ids_stable_after_reload():
+    """
+    A miner restored from saved state assigns the same template ids as the miner that saved it
+    """
+    lines = _lines(3000)
+    for depth, max_children in [(4, 100), (5, 3), (6, 2)]:
+        miner = DrainTemplateMiner(depth=depth, max_children=max_children)
+        miner.add_logs(lines[:1500])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'templates.json')
+            miner.save(path)
+            restored = DrainTemplateMiner(depth=depth, max_children=max_children)
+            restored.load(path)
+
+        expected = [cluster.cluster_id for cluster, _ in miner.add_logs(lines[1500:])]
+        assert [cluster.cluster_id for cluster, _ in restored.add_logs(lines[1500:])] == expected
+
+
+def test_load_state_without_routes():
+    """
+    State files saved before routes were stored still load
+    """
+    miner = DrainTemplateMiner()
+    miner.add_logs(['user alice logged in', 'user bob logged in', 'disk full on sda1'])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'templates.json')
+        miner.save(path)
+        with open(path) as f:
+            state = json.load(f)
+        for cluster in state['clusters']:
+            del cluster['route']
+        with open(path, 'w') as f:
+            json.dump(state, f)
+        restored = DrainTemplateMiner()
+        restored.load(path)
+
+    cluster, params = restored.add_log('user carol logged in')
+    assert cluster.template == 'user <*> logged in'
+    assert params == ['carol']
+
+
+if __name__ == '__main__':
+    test_template_ids_stable_after_reload()
+    test_load_state_without_routes()
+    print('All template miner tests passed')